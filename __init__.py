@@ -46,18 +46,18 @@ bl_info = {
 #		importlib.reload(tractor_render_dispatcher)
 
 
-import bpy
-from bpy.app.handlers import persistent
-#import script files
-from . import tractor_render_dispatcher
-
+# bpy, and the add-on UI needing it, are only imported once Blender
+# registers the add-on, so the engine client and job builder modules
+# (and "python -m" on this package) work without Blender.
 
 
 def register():
+	from . import tractor_render_dispatcher
 	tractor_render_dispatcher.register()
 
 
 def unregister():
+	from . import tractor_render_dispatcher
 	tractor_render_dispatcher.unregister()
 
 
@@ -0,0 +1,207 @@
+'''
+Command line use of the dispatcher, without Blender:
+
+    python -m <package> spool [tractor-spool options] JOBFILE...
+    python -m <package> generate-alf [-o OUT] [--json] [--spool] SCENE.json...
+    python -m <package> query [--filter EXPR] [--columns COLS]
+    python -m <package> delete [--filter EXPR] [JOB_ID...]
+    python -m <package> control OPERATION [--value VALUE] [--filter EXPR] [JOB_ID...]
+    python -m <package> outbox [--drain]
+
+The engine is given with --engine, or in $TRACTOR_ENGINE.  A scene
+description is a JSON object with the job settings the add-on gathers
+in Blender, see alfred.describedJob.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from . alfred import buildJob, describedJob
+from . submitter import (Spool, TrHttpRPC, JOB_OPERATIONS, spoolOptionParser,
+                         jobSpool, jobControlMain, urlQuote)
+
+## ------------------------------------------------------------- ##
+
+def spoolOptions(args):
+    # The tractor-spool options (as jobSpool and jobControl take them)
+    # for the common command line arguments.
+    argv = ["--priority", str(args.priority), "--concurrency", str(args.concurrency)]
+    if args.engine:
+        argv += ["--engine", args.engine]
+    if args.user:
+        argv += ["--user", args.user]
+    if args.quiet:
+        argv += ["-q"]
+    if getattr(args, "outbox", False):
+        argv += ["--outbox"]
+    options, rest = spoolOptionParser().parse_args(argv)
+    if ":" not in options.mtdhost:
+        options.mtdhost += ":80"
+    return options
+
+
+def generateAlf(args):
+    if args.output not in (None, "-") and len(args.descriptions) > 1:
+        raise ValueError("-o names a single file, for a single description")
+
+    jobs = []
+    for path in args.descriptions:
+        with open(path, "r") as f:
+            job, batch = describedJob(json.load(f))
+        root = buildJob(job, batch)
+        jobs.append( (path, job, root.asJSON() if args.json else root.asAlfred()) )
+
+    if not args.spool:
+        for path, job, text in jobs:
+            if args.output == "-":
+                sys.stdout.write(text)
+            else:
+                out = args.output or os.path.splitext(path)[0] + (".json" if args.json else ".alf")
+                with open(out, "w") as f:
+                    f.write(text)
+        return 0
+
+    options = spoolOptions(args)
+    jobfiles = [job['jobfull'] or os.path.splitext(path)[0] + ".alf" for path, job, text in jobs]
+    alfdatas = [text for path, job, text in jobs]
+    if len(jobs) > 1 and options.concurrency > 1:
+        from . trasync import runSync, jobSpoolAll
+        results = runSync( jobSpoolAll(jobfiles, options, alfdatas) )
+    else:
+        results = [jobSpool(f, options, a) for f, a in zip(jobfiles, alfdatas)]
+
+    rc = 0
+    for (path, job, text), (errcode, reply) in zip(jobs, results):
+        if errcode:
+            rc = errcode
+        if errcode or not args.quiet:
+            print("{}: {}".format(path, reply))
+    return rc
+
+
+def query(args):
+    options = spoolOptions(args)
+    rpc = TrHttpRPC(options.mtdhost, 0, keepalive=True, login=options.uname)
+    form = "q={}&columns={}".format(args.what, urlQuote(args.columns))
+    if args.filter:
+        form += "&filter={}".format(urlQuote(args.filter))
+    if args.limit:
+        form += "&limit={}".format(args.limit)
+
+    errcode, rows = rpc.TransactionItems("queries", form, "data")
+    if errcode:
+        print("query: {}".format(rows), file=sys.stderr)
+        return errcode
+    for row in rows:
+        print(json.dumps(row))
+    return 0
+
+
+def outbox(args):
+    from . outbox import trOutbox, OutboxDrainer
+    box = trOutbox()
+    if args.drain:
+        drainer = OutboxDrainer(box, batch=args.batch, rate=args.rate)
+        for engine in box.Engines():
+            drainer.drain(engine)
+            if drainer.status:
+                print(drainer.status)
+
+    rc = 0
+    for id, engine, title, state, queued, attempts, jid, error in box.Entries():
+        print("{:5d} {:8s} {} {} (queued {}, {} tries){}".format(id, state, engine, title,
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(queued)), attempts,
+                ": " + error if error else ""))
+        if args.drain and state != "failed":
+            rc = 1
+    return rc
+
+
+def control(args):
+    options = spoolOptions(args)
+    options.jfilter = args.filter
+    options.jvalue = getattr(args, "value", None)
+    return jobControlMain(getattr(args, "operation", "delete"), args.jids, options)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=__package__,
+                description="Spool and manage Blender render jobs on a Tractor engine.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--engine", default=os.environ.get("TRACTOR_ENGINE"),
+            help="hostname[:port] of the engine, default $TRACTOR_ENGINE")
+    common.add_argument("--user", default=None,
+            help="job owner and login user, default the user running this")
+    common.add_argument("--priority", type=float, default=1.0,
+            help="priority of spooled jobs")
+    common.add_argument("--concurrency", type=int, default=8,
+            help="requests sent at the same time when there are several")
+    common.add_argument("-q", "--quiet", action="store_true",
+            help="only report failures")
+
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("spool", help="spool alfred job files, as tractor-spool")
+    p.add_argument("argv", nargs=argparse.REMAINDER,
+            help="tractor-spool options and job files")
+    p.set_defaults(run=lambda args: Spool(args.argv))
+
+    p = sub.add_parser("generate-alf", parents=[common],
+            help="build the job script for JSON scene descriptions")
+    p.add_argument("descriptions", nargs="+", metavar="SCENE.json")
+    p.add_argument("-o", "--output", default=None,
+            help="where to write the script, '-' for stdout; default is "
+                 "next to each description")
+    p.add_argument("--json", action="store_true",
+            help="write the job's JSON form rather than alfred script")
+    p.add_argument("--spool", action="store_true",
+            help="spool the jobs rather than writing them out")
+    p.add_argument("--outbox", action="store_true",
+            help="with --spool, keep the jobs in the local outbox if the "
+                 "engine can't be reached")
+    p.set_defaults(run=generateAlf)
+
+    p = sub.add_parser("query", parents=[common], help="list jobs (or tasks) on the engine")
+    p.add_argument("--what", default="jobs", choices=("jobs", "tasks", "commands", "blades"))
+    p.add_argument("--filter", default=None, help="query filter expression")
+    p.add_argument("--columns", default="jid,owner,title,numtasks,numdone,numerror,priority")
+    p.add_argument("--limit", type=int, default=0)
+    p.set_defaults(run=query)
+
+    p = sub.add_parser("delete", parents=[common], help="delete jobs")
+    p.add_argument("jids", nargs="*", metavar="JOB_ID")
+    p.add_argument("--filter", default=None, help="also delete the jobs matching this filter")
+    p.set_defaults(run=control)
+
+    p = sub.add_parser("control", parents=[common],
+            help="pause, resume, restart, retry or re-prioritize jobs")
+    p.add_argument("operation", choices=sorted(JOB_OPERATIONS))
+    p.add_argument("jids", nargs="*", metavar="JOB_ID")
+    p.add_argument("--value", default=None, help="e.g. the new priority")
+    p.add_argument("--filter", default=None, help="also act on the jobs matching this filter")
+    p.set_defaults(run=control)
+
+    p = sub.add_parser("outbox",
+            help="list the jobs waiting in the local outbox, or spool them")
+    p.add_argument("--drain", action="store_true",
+            help="spool the waiting jobs now, if their engine answers")
+    p.add_argument("--batch", type=int, default=20,
+            help="jobs sent between looks at the outbox")
+    p.add_argument("--rate", type=float, default=2.0,
+            help="most jobs spooled a second")
+    p.set_defaults(run=outbox)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.run(args)
+    except (OSError, ValueError) as e:
+        print("{}: {}".format(args.command, e), file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,612 @@
+'''
+Alfred job script generation.
+
+A job is built as a small tree of Job, Task and Cmd objects, which can
+be serialized to Alfred script text (what gets spooled) or to the
+equivalent dict/JSON form for caching, diffing or re-spooling.
+buildJob() makes that tree from the settings gathered by
+TRACTORDISPACHER_OT_Button.jobSettings, or by describedJob() from a
+JSON scene description; jobScriptLines() and jobScript() are shortcuts
+to its Alfred text.  Nothing in here touches bpy or the disk.
+'''
+
+import os
+import json
+
+from . framehistory import adaptiveChunks
+
+## ------------------------------------------------------------- ##
+
+def alfQuote(value):
+    # Alfred scripts are Tcl, a word with spaces (or nothing in it)
+    # is wrapped in braces to keep it together.
+    value = str(value)
+    if not value or any(c in value for c in " \t\n{}\"\\$[];"):
+        return "{" + value + "}"
+    return value
+
+
+def alfList(values):
+    return "{" + " ".join(alfQuote(v) for v in values) + "}"
+
+
+class Cmd(object):
+    '''
+    A single command, normally a RemoteCmd run on a blade.  'argv' is
+    a tuple of strings; tasks of one job share most of their argv
+    strings, which keeps big jobs small in memory.
+
+    Commands inherit the job's -service, -envkey and -tags, so the
+    serialized forms leave out any of them that is the same as the
+    job's ('inherited', as (service, envkey, tags)); on a job with
+    thousands of tasks that is most of the script.
+    '''
+
+    __slots__ = ("argv", "kind", "service", "envkey", "tags")
+
+    def __init__(self, argv, kind="RemoteCmd", service=None, envkey=None, tags=None):
+        self.argv = tuple(argv)
+        self.kind = kind
+        self.service = service
+        self.envkey = envkey
+        self.tags = tags
+
+    def own(self, inherited):
+        # The service, envkey and tags to spell out on this command.
+        service, envkey, tags = inherited or (None, (), ())
+        return (self.service if self.service != service else None,
+                self.envkey if self.envkey and tuple(self.envkey) != envkey else None,
+                self.tags if self.tags and tuple(self.tags) != tags else None)
+
+    def alfredLines(self, indent, inherited=None):
+        service, envkey, tags = self.own(inherited)
+        line = "{}{} {}".format(indent, self.kind, alfList(self.argv))
+        if service:
+            line += " -service {}".format(alfQuote(service))
+        if envkey:
+            line += " -envkey {}".format(alfList(envkey))
+        if tags:
+            line += " -tags {}".format(alfList(tags))
+        yield line + "\n"
+
+    def asDict(self, inherited=None):
+        service, envkey, tags = self.own(inherited)
+        d = {"type": self.kind, "argv": list(self.argv)}
+        if service:
+            d["service"] = service
+        if envkey:
+            d["envkey"] = list(envkey)
+        if tags:
+            d["tags"] = list(tags)
+        return d
+
+
+class Task(object):
+    '''
+    A task with commands to run and/or subtasks to finish first.
+    '''
+
+    __slots__ = ("title", "cmds", "subtasks", "serialsubtasks")
+
+    def __init__(self, title, cmds=(), subtasks=(), serialsubtasks=False):
+        self.title = title
+        self.cmds = list(cmds)
+        self.subtasks = list(subtasks)
+        self.serialsubtasks = serialsubtasks
+
+    def alfredLines(self, indent, inherited=None):
+        head = "{}Task {}".format(indent, alfQuote(self.title))
+        if self.serialsubtasks:
+            head += " -serialsubtasks 1"
+        if self.subtasks:
+            yield head + " -subtasks {\n"
+            for t in self.subtasks:
+                for line in t.alfredLines(indent + "    ", inherited):
+                    yield line
+            head = indent + "}"
+        if self.cmds:
+            yield head + " -cmds {\n"
+            for c in self.cmds:
+                for line in c.alfredLines(indent + "    ", inherited):
+                    yield line
+            head = indent + "}"
+        yield head + "\n"
+
+    def asDict(self, inherited=None):
+        d = {"title": self.title}
+        if self.serialsubtasks:
+            d["serialsubtasks"] = True
+        if self.subtasks:
+            d["subtasks"] = [t.asDict(inherited) for t in self.subtasks]
+        if self.cmds:
+            d["cmds"] = [c.asDict(inherited) for c in self.cmds]
+        return d
+
+
+class Job(object):
+    '''
+    The job itself, the root of the task tree.
+    '''
+
+    __slots__ = ("title", "priority", "service", "tags", "crews", "projects",
+                 "envkey", "serialsubtasks", "subtasks")
+
+    def __init__(self, title, priority=1.0, service=None, tags=(), crews=(),
+                    projects=("Default",), envkey=(), serialsubtasks=False,
+                    subtasks=()):
+        self.title = title
+        self.priority = priority
+        self.service = service
+        self.tags = tuple(tags)
+        self.crews = tuple(crews)
+        self.projects = tuple(projects)
+        self.envkey = tuple(envkey)
+        self.serialsubtasks = serialsubtasks
+        self.subtasks = list(subtasks)
+
+    def alfredLines(self):
+        head = "Job -title {}".format(alfQuote(self.title))
+        head += " -priority {}".format(self.priority)
+        head += " -tags {}".format(alfList(self.tags))
+        if self.service:
+            head += " -service {}".format(alfQuote(self.service))
+        head += " -crews {}".format(alfList(self.crews))
+        head += " -projects {}".format(alfList(self.projects))
+        head += " -envkey {}".format(alfList(self.envkey))
+        if self.serialsubtasks:
+            head += " -serialsubtasks 1"
+        yield head + " -subtasks {\n"
+        inherited = self.inherited()
+        for t in self.subtasks:
+            for line in t.alfredLines("    ", inherited):
+                yield line
+        yield "}\n"
+
+    def inherited(self):
+        # What the job's commands get from it unless they say otherwise.
+        return (self.service, self.envkey, self.tags)
+
+    def asAlfred(self):
+        return "".join(self.alfredLines())
+
+    def asDict(self):
+        d = {
+            "title": self.title,
+            "priority": self.priority,
+            "tags": list(self.tags),
+            "crews": list(self.crews),
+            "projects": list(self.projects),
+            "envkey": list(self.envkey),
+            "serialsubtasks": bool(self.serialsubtasks),
+            "subtasks": [t.asDict(self.inherited()) for t in self.subtasks],
+        }
+        if self.service:
+            d["service"] = self.service
+        return d
+
+    def asJSON(self):
+        return json.dumps(self.asDict(), separators=(",", ":"))
+
+## ------------------------------------------------------------- ##
+
+def frameChunks(start, end, step, fpu):
+    '''
+    Split start..end (inclusive) into (first, last) chunks of 'fpu'
+    rendered frames each.
+    '''
+    s = start
+    while s <= end:
+        e = min(s + step * fpu - 1, end)
+        yield (s, e)
+        s = e + 1
+
+
+def frameRuns(frames, step, fpu):
+    '''
+    Coalesce the ordered 'frames' into (first, last) chunks of at most
+    'fpu' frames, each a run of frames 'step' apart.
+    '''
+    chunk = None
+    count = 0
+    for f in frames:
+        if chunk and (count == fpu or f != chunk[1] + step):
+            yield chunk
+            chunk = None
+        if chunk is None:
+            chunk, count = (f, f), 0
+        chunk = (chunk[0], f)
+        count += 1
+    if chunk:
+        yield chunk
+
+
+def frameList(chunks, step):
+    '''
+    The tractor_worker.py frame list ("1-10,21-30x2,41") rendering the
+    (first, last) 'chunks' every 'step' frames.
+    '''
+    parts = []
+    for s, e in chunks:
+        if s == e:
+            parts.append(str(s))
+        elif step == 1:
+            parts.append("{}-{}".format(s, e))
+        else:
+            parts.append("{}-{}x{}".format(s, e, step))
+    return ",".join(parts)
+
+
+def wrapProgress(argv, job):
+    # Runs a render command under the tractor_progress.py filter, which
+    # turns Blender's output into TR_PROGRESS lines.
+    if not job.get('progressengine'):
+        return tuple(argv)
+    return ("python3", job['progressscript'], "--engine", job['progressengine'], "--") + tuple(argv)
+
+
+def viewLayerExpr(name):
+    # A --python-expr rendering only the named view layer, into a
+    # subdirectory of the same name next to the usual output.
+    return ("import bpy,os;s=bpy.context.scene;"
+            "[setattr(l,'use',l.name=={0!r}) for l in s.view_layers];"
+            "p=bpy.path.abspath(s.render.filepath);"
+            "s.render.filepath=os.path.join(os.path.dirname(p),{0!r},os.path.basename(p))").format(name)
+
+
+MINTILE = 64  # pixels, the narrowest a split-frame tile gets
+
+
+def tileGrid(width, height, tiles):
+    '''
+    The (columns, rows) splitting a 'width' x 'height' frame into as
+    close to 'tiles' tiles as it goes, of MINTILE pixels or more, as
+    near square as they get.
+    '''
+    best = None
+    for cols in range(1, max(1, min(tiles, width // MINTILE)) + 1):
+        rows = max(1, min(int(round(tiles / float(cols))), height // MINTILE))
+        aspect = (width * rows) / float(height * cols)
+        score = (abs(cols * rows - tiles), max(aspect, 1.0 / aspect))
+        if best is None or score < best[0]:
+            best = (score, (cols, rows))
+    return best[1]
+
+
+def tileCount(job, seconds):
+    '''
+    How many tiles to split a frame estimated to take 'seconds' into,
+    for each tile's task to take about job['chunktarget'] seconds,
+    Blender startup included.  Never more than job['maxtiles'], nor so
+    many the tiles get narrower than MINTILE pixels.
+    '''
+    width, height = job['resolution']
+    work = max(job['chunktarget'] - job['startupcost'], 0.1 * job['chunktarget'])
+    tiles = -(-int(seconds) // int(max(1.0, work)))
+    return max(1, min(tiles, job['maxtiles'], (width // MINTILE) * (height // MINTILE)))
+
+
+def targetName(job):
+    # The scene and view layer a job renders, as a file name; "" when
+    # it just renders the file's current scene.
+    target = "_".join(n for n in (job.get('scene'), job.get('viewlayer')) if n)
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in target)
+
+
+def tileDir(job, frame):
+    # Where the tiles of a split frame go.
+    return os.path.join(scratchStem(job) + "_tiles", targetName(job) or "frames", str(frame))
+
+
+def splitFrameTask(job, frame, head, grid):
+    '''
+    The task rendering 'frame' as a 'grid' of (columns, rows) tiles,
+    all at once, then pasting them into the output frame.  'head' is
+    the blade command line up to the tile script's arguments.
+    '''
+    service = job['service']
+    envkey = job['envkey'].split()
+    tags = ["Blender"] + job['tags'].split()
+
+    cols, rows = grid
+    width, height = job['resolution']
+    spec = ("--frame", str(frame), "--grid", "{}x{}".format(cols, rows),
+            "--tiledir", tileDir(job, frame))
+
+    tiles = Task("Render Tiles")
+    for i in range(cols * rows):
+        argv = head + spec + ("--tile", str(i))
+        tiles.subtasks.append(Task("Tile {} / {}".format(i + 1, cols * rows), cmds=[
+            Cmd(wrapProgress(argv, job), service=service, envkey=envkey, tags=tags)]))
+
+    # with the output path known the .blend needn't be loaded again
+    output = (job.get('framepaths') or {}).get(frame)
+    if output:
+        argv = (job['blender_binary'], "--background", "--factory-startup",
+                "--python-exit-code", "1", "--python", job['tilescript'], "--")
+        argv += spec + ("--assemble", "--size", "{}x{}".format(width, height), "--output", output)
+    else:
+        argv = head + spec + ("--assemble",)
+    assemble = Task("Assemble Tiles", cmds=[Cmd(argv, service=service, envkey=envkey, tags=tags)])
+
+    return Task("Frame {} ({} tiles)".format(frame, cols * rows),
+                subtasks=[tiles, assemble], serialsubtasks=True)
+
+
+def renderTask(job, title="Render Frames"):
+    '''
+    The task rendering the frames of one scene (or view layer) of the
+    job, with a subtask per chunk of frames.
+    '''
+    service = job['service']
+    envkey = job['envkey'].split()
+    tags = ["Blender"] + job['tags'].split()
+
+    render = Task(title)
+
+    step = job['frame_step']
+    # everything but the frame range is the same for every task
+    head = (job['blender_binary'], "--background", "--factory-startup", "-y", job['blendfull'])
+    if job.get('scene'):
+        head += ("--scene", job['scene'])
+    if job.get('blender_user_scripts'):
+        head += ("--python", "{}/init.py".format(job['blender_user_scripts']))
+    if job.get('viewlayer'):
+        head += ("--python-expr", viewLayerExpr(job['viewlayer']))
+    if job.get('splitframes'):
+        # the tile script records times itself, scaled up to whole frames
+        tiled = head + ("--python-exit-code", "1", "--python", job['tilescript'], "--", "-e", job['addons'])
+    if job.get('historyscript'):
+        head += ("--python", job['historyscript'])
+    tail = ("--frame-jump", str(step), "--render-anim", "--", "-e", job['addons'])
+
+    # only the frames still missing, or the whole range
+    frames = job.get('framelist')
+    if frames is None:
+        frames = range(job['frame_start'], job['frame_end'] + 1, step)
+
+    if job.get('splitframes'):
+        # frames too heavy for one task are split into tiles, up front
+        # as they keep the most blades busy; the others are chunked as
+        # usual, split frames leaving gaps between the chunks
+        width, height = job['resolution']
+        whole = []
+        for f in frames:
+            seconds = job['frametimes'][f] if job.get('frametimes') else job['frametime']
+            tiles = tileCount(job, seconds)
+            if tiles > 1:
+                render.subtasks.append(splitFrameTask(job, f, tiled, tileGrid(width, height, tiles)))
+            else:
+                whole.append(f)
+        frames = whole
+
+    if job.get('chunking') == 'ADAPTIVE' and job.get('frametimes'):
+        chunks = adaptiveChunks(frames, job['frametimes'], job['chunktarget'], job['startupcost'], step)
+    elif job.get('framelist') is not None or job.get('splitframes'):
+        chunks = frameRuns(frames, step, job['framesperunit'])
+    else:
+        chunks = frameChunks(job['frame_start'], job['frame_end'], step, job['framesperunit'])
+
+    if job.get('workers'):
+        # persistent workers: each task loads the file once and renders
+        # every n-th chunk, so all of the shot gets going early on
+        chunks = list(chunks)
+        workers = min(job['workers'], len(chunks))
+        head += ("--python-exit-code", "1", "--python", job['workerscript'])
+        for w in range(workers):
+            mine = chunks[w::workers]
+            frames = frameList(mine, step)
+            argv = head + ("--", "-e", job['addons'], "--frames", frames)
+            render.subtasks.append(Task("Worker {} ({})".format(w + 1, frames), cmds=[
+                Cmd(wrapProgress(argv, job), service=service, envkey=envkey, tags=tags)]))
+        return render
+
+    for s, e in chunks:
+        title = "Frame {}".format(s) if s == e else "Frame {} - {}".format(s, e)
+        argv = head + ("--frame-start", str(s), "--frame-end", str(e)) + tail
+        render.subtasks.append(Task(title, cmds=[
+            Cmd(wrapProgress(argv, job), service=service, envkey=envkey, tags=tags)]))
+
+    return render
+
+
+def scratchStem(job):
+    # Where a job's own files go, as a path to add a suffix to: in the
+    # dispatch's scratch directory, or next to the spooled .blend.
+    stem = os.path.splitext(job['blendfull'])[0]
+    if job.get('scratchdir'):
+        return os.path.join(job['scratchdir'], os.path.basename(stem))
+    return stem
+
+
+def bakedPaths(job):
+    # The .blend the renders of a baking job load, and the directory
+    # the bakes go to; one of each per scene and view layer, as the
+    # jobs of a batch may bake side by side.
+    stem = scratchStem(job)
+    if targetName(job):
+        stem += "_" + targetName(job)
+    return (stem + "_baked.blend", stem + "_bake")
+
+
+def bakeTask(job, title="Bake Simulations"):
+    '''
+    The task baking the simulations of the objects in job['bakeobjects'],
+    one subtask per object, all at once, then saving the baked file.
+    '''
+    baked, bakedir = bakedPaths(job)
+    head = (job['blender_binary'], "--background", "--factory-startup", "-y", job['blendfull'])
+    if job.get('scene'):
+        head += ("--scene", job['scene'])
+    if job.get('blender_user_scripts'):
+        head += ("--python", "{}/init.py".format(job['blender_user_scripts']))
+    head += ("--python-exit-code", "1", "--python", job['bakescript'], "--", "--bakedir", bakedir)
+
+    caches = Task("Bake Caches", subtasks=[
+        Task("Bake {}".format(name), cmds=[Cmd(head + (name,))])
+        for name in job['bakeobjects']])
+    save = Task("Save Baked File", cmds=[
+        Cmd(head + ("--collect", baked) + tuple(job['bakeobjects']))])
+    return Task(title, subtasks=[caches, save], serialsubtasks=True)
+
+
+def buildJob(job, batch=None):
+    '''
+    Build the Job tree for the gathered job settings 'job'.  With a
+    list of job settings in 'batch' (for several scenes or view layers
+    of the same spooled file) the job renders all of them, as sibling
+    subtasks run in parallel; 'job' then supplies everything else.
+    '''
+    blendfull = job['blendfull']
+    blender_binary = job['blender_binary']
+    service = job['service']
+    envkey = job['envkey'].split()
+    tags = ["Blender"] + job['tags'].split()
+
+    root = Job(job['title'], priority=job['priority'], service=service,
+                tags=tags, crews=job['crews'].replace(",", " ").split(),
+                envkey=envkey, serialsubtasks=True)
+
+    # Run pre-script
+    if job['prescript']:
+        root.subtasks.append(Task("Pre-Job Script", cmds=[
+            Cmd((blender_binary, "--background", blendfull, "--python", job['prefull']))]))
+
+    # Bake simulations, once per scene, for its renders to read
+    if job['dorender']:
+        bakes = []
+
+        def baked(j, scene):
+            # 'j' renders what 'scene' (settings of the same) bakes
+            if not j.get('bakeobjects'):
+                return j
+            path = bakedPaths(scene)[0]
+            if path not in [bakedPaths(b)[0] for b in bakes]:
+                bakes.append(scene)
+            return dict(j, blendfull=path)
+
+        if batch:
+            # the view layers of a scene share its bake
+            batch = [baked(j, dict(j, viewlayer=None)) for j in batch]
+        else:
+            job = baked(job, job)
+        if len(bakes) == 1:
+            root.subtasks.append(bakeTask(bakes[0]))
+        elif bakes:
+            root.subtasks.append(Task("Bake Simulations", subtasks=[
+                bakeTask(b, "Bake {}".format(b['scene'])) for b in bakes]))
+
+    # Render frames
+    if job['dorender']:
+        if batch:
+            root.subtasks.append(Task("Render", subtasks=[
+                renderTask(j, j['target']) for j in batch]))
+        else:
+            root.subtasks.append(renderTask(job))
+
+    # Run post-script
+    if job['postscript']:
+        root.subtasks.append(Task("Post-Script", cmds=[
+            Cmd((blender_binary, "--background", blendfull, "--python", job['postfull']))]))
+
+    return root
+
+
+def jobScriptLines(job):
+    '''
+    Generate the lines (each ending in a newline) of the alfred script
+    for the job settings 'job'.
+    '''
+    return buildJob(job).alfredLines()
+
+
+def jobScript(job):
+    '''
+    The whole alfred script for 'job' as one string.
+    '''
+    return buildJob(job).asAlfred()
+
+## ------------------------------------------------------------- ##
+
+# the job settings a scene description may leave out
+JOB_DEFAULTS = {
+    'jobfull': "",
+    'prescript': "",
+    'prefull': "",
+    'postscript': "",
+    'postfull': "",
+    'blender_binary': "blender",
+    'blender_user_scripts': None,
+    'addons': "",
+    'envkey': "",
+    'service': "BlenderRender",
+    'priority': 1.0,
+    'tags': "",
+    'crews': "",
+    'dorender': True,
+    'frame_step': 1,
+    'framesperunit': 1,
+    'chunking': "FIXED",
+    'framelist': None,
+    'scene': None,
+    'viewlayer': None,
+    'progressengine': "",
+    'progressscript': "",
+    'historyscript': "",
+    'workerscript': "",
+    'workers': 0,
+    'bakeobjects': [],
+    'bakescript': "",
+    'scratchdir': "",
+    'splitframes': False,
+    'resolution': None,
+    'frametime': 3600.0,
+    'maxtiles': 16,
+    'tilescript': "",
+    'framepaths': None,
+    'chunktarget': 600.0,
+    'startupcost': 30.0,
+    'frametimes': None,
+}
+
+JOB_REQUIRED = ('blendfull', 'frame_start', 'frame_end')
+
+
+def describedJob(desc):
+    '''
+    The (job, batch) settings buildJob takes, from the dict 'desc' of a
+    JSON scene description: the same keys jobSettings gathers in
+    Blender, of which only blendfull, frame_start and frame_end are
+    needed.  A "batch" list in it holds the keys that differ for each
+    scene or view layer to render, batch is None without one.  Pre and
+    post scripts given by path are run as they are.
+    '''
+    job = dict(JOB_DEFAULTS)
+    job.update((k, v) for k, v in desc.items() if k != 'batch')
+    if 'chunking' not in desc and desc.get('frametimes'):
+        job['chunking'] = "ADAPTIVE"  # frame times given are meant to be used
+    job.setdefault('title', job.get('blendfull', "").rpartition("/")[2])
+    job['prefull'] = job['prefull'] or job['prescript']
+    job['postfull'] = job['postfull'] or job['postscript']
+
+    batch = None
+    if desc.get('batch'):
+        batch = []
+        for i, target in enumerate(desc['batch']):
+            j = dict(job)
+            j.update(target)
+            j.setdefault('target', j.get('viewlayer') or j.get('scene') or str(i + 1))
+            batch.append(j)
+
+    for j in batch or [job]:
+        missing = [k for k in JOB_REQUIRED if j.get(k) is None]
+        if missing:
+            raise ValueError("job description lacks {}".format(", ".join(missing)))
+        if j['splitframes'] and not (j['resolution'] and j['tilescript']):
+            raise ValueError("splitting frames needs the resolution and tilescript")
+        if j['frametimes']:
+            # JSON object keys are strings
+            j['frametimes'] = dict((int(f), float(t)) for f, t in j['frametimes'].items())
+        if j['framepaths']:
+            j['framepaths'] = dict((int(f), p) for f, p in j['framepaths'].items())
+
+    return (job, batch)
@@ -0,0 +1,87 @@
+'''
+Microbenchmark of the engine reply decoders: the old eval() based
+parseJSON against trjson.loads (stdlib json and, if installed, the
+faster backend) and the streaming trjson.iterArray, on synthetic
+multi-megabyte "jobs" query replies.
+
+    python benchmarks/bench_json.py [--jobs 20000 50000] [--repeat 3]
+
+Compiling a reply with eval() grows much faster than linearly with its
+size, so eval is only timed on replies below --evallimit megabytes.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import trjson
+
+
+def makeReply (njobs):
+    jobs = []
+    for i in range(njobs):
+        jobs.append({
+            "jid": 1000 + i, "user": "artist", "title": "shot_{:04d}.blend".format(i),
+            "priority": 1.0, "numtasks": 240, "numdone": i % 240, "numerror": 0,
+            "service": "BlenderRender", "tags": ["Blender"], "spooled": 1700000000 + i,
+            "comment": "", "crews": [], "envkey": ["TOOLS=/tools"],
+            "paused": False, "deleted": None,
+        })
+    return json.dumps({"rc": 0, "msg": "", "jobs": jobs}).encode("utf-8")
+
+
+def evalDecode (data):
+    # what TrHttpRPC.parseJSON used to do
+    null = None
+    true = True
+    false = False
+    return eval( bytes(data).strip() )
+
+
+def timeit (fn, data, repeat):
+    best = None
+    peak = 0
+    for i in range(repeat):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        fn(data)
+        dt = time.perf_counter() - t0
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        best = dt if best is None else min(best, dt)
+    return best, peak
+
+
+def main (argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    ap.add_argument("--jobs", type=int, nargs="+", default=[5000, 20000, 50000])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--evallimit", type=float, default=1.0)
+    args = ap.parse_args(argv)
+
+    decoders = [
+        ("eval", evalDecode),
+        ("json", lambda d: json.loads(d)),
+    ]
+    if trjson.backend != "json":
+        decoders.append( (trjson.backend, trjson.loads) )
+    decoders.append( ("iterArray", lambda d: sum(1 for j in trjson.iterArray(d, "jobs"))) )
+
+    print("{:>8} {:>9} {:>10} {:>10} {:>10}".format("jobs", "MB", "decoder", "ms", "peak MB"))
+    for n in args.jobs:
+        data = bytearray(makeReply(n))
+        mb = len(data) / 1e6
+        for name, fn in decoders:
+            if name == "eval" and mb > args.evallimit:
+                print("{:>8} {:>9.1f} {:>10} {:>10}".format(n, mb, name, "skipped"))
+                continue
+            dt, peak = timeit(fn, data, args.repeat)
+            print("{:>8} {:>9.1f} {:>10} {:>10.1f} {:>10.1f}".format(n, mb, name, dt * 1e3, peak / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+'''
+End-to-end client benchmarks against the in-process mock engine, with
+the results written as JSON for tracking regressions between versions.
+
+    python benchmarks/bench_suite.py [--quick] [--output results.json]
+
+  spool      spools/sec, p50/p99 latency and bytes on the wire for
+             TrHttpRPC.Transaction one connection per request, over
+             keep-alive, and concurrently through trasync
+  alfred     building and writing the alfred script for jobs of 10,
+             1k and 100k frames
+  json       decoding large "jobs" query replies, from memory and as
+             a whole query round trip
+  payload    spool request size and latency of large jobs sent plain,
+             gzip and deflate encoded, over a link of --bandwidth
+
+Peak memory is taken on a separate tracemalloc run of each case, so
+it doesn't slow down the timed one.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from mockengine import MockEngine
+from bench_json import makeReply
+
+package = os.path.basename(ROOT)
+submitter = importlib.import_module(package + ".submitter")
+alfred = importlib.import_module(package + ".alfred")
+trasync = importlib.import_module(package + ".trasync")
+trjson = importlib.import_module(package + ".trjson")
+
+
+def percentile (values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def peakMemory (fn):
+    # Peak bytes allocated while running fn() once.
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def sampleJob (frames, fpu=1):
+    job, batch = alfred.describedJob({
+        "blendfull": "/proj/shots/sh010/sh010_lighting_v012.blend",
+        "frame_start": 1, "frame_end": frames, "framesperunit": fpu,
+        "addons": "cycles,io_scene_fbx,node_wrangler",
+        "blender_user_scripts": "/tools/blender/scripts",
+        "envkey": "TOOLS=/tools", "tags": "gpu", "crews": "lighting",
+    })
+    return job
+
+## ------------------------------------------------------------- ##
+
+def benchSpool (engine, n, alfdata):
+    options = submitter.spoolOptionParser().parse_args(
+                ["--engine", engine.address, "--user", "bench"])[0]
+    hdrs = submitter.jobSpoolRequest("bench.alf", options, alfdata)[1]
+    results = []
+
+    for mode in ("oneshot", "keepalive"):
+        rpc = submitter.TrHttpRPC(engine.address, 0, keepalive=(mode == "keepalive"))
+
+        def run (count):
+            times = []
+            for i in range(count):
+                t0 = time.perf_counter()
+                errcode, reply = rpc.Transaction("spool", alfdata, None, hdrs)
+                times.append(time.perf_counter() - t0)
+            return times
+
+        run(5)  # warm up
+        before = dict(engine.stats)
+        t0 = time.perf_counter()
+        times = run(n)
+        elapsed = time.perf_counter() - t0
+        after = dict(engine.stats)
+        results.append(spoolResult(mode, n, elapsed, before, after, times,
+                                    peakMemory(lambda: run(min(n, 50)))))
+        submitter.trCloseConnectionPools()
+
+    options.concurrency = 16
+    jobfiles = ["bench.alf"] * n
+    alfdatas = [alfdata] * n
+    before = dict(engine.stats)
+    t0 = time.perf_counter()
+    replies = trasync.runSync( trasync.jobSpoolAll(jobfiles, options, alfdatas) )
+    elapsed = time.perf_counter() - t0
+    after = dict(engine.stats)
+    result = spoolResult("async16", n, elapsed, before, after, None,
+                    peakMemory(lambda: trasync.runSync(
+                        trasync.jobSpoolAll(jobfiles[:50], options, alfdatas[:50]))))
+    result["failed"] = sum(1 for err, reply in replies if err)
+    results.append(result)
+    return results
+
+
+def spoolResult (mode, n, elapsed, before, after, times, peak):
+    # 'before' and 'after' are the engine's stats around the timed run
+    result = {
+        "bench": "spool",
+        "mode": mode,
+        "spools": n,
+        "spools_per_sec": n / elapsed,
+        "bytes_sent": after["bytesin"] - before["bytesin"],
+        "bytes_received": after["bytesout"] - before["bytesout"],
+        "connections": after["connections"] - before["connections"],
+        "peak_mem_bytes": peak,
+    }
+    if times:
+        result["p50_ms"] = percentile(times, 50) * 1e3
+        result["p99_ms"] = percentile(times, 99) * 1e3
+    return result
+
+
+def benchAlfred (framecounts, repeat):
+    results = []
+    for frames in framecounts:
+        job = sampleJob(frames)
+        best = None
+        size = 0
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            size = len(alfred.jobScript(job))
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        results.append({
+            "bench": "alfred",
+            "frames": frames,
+            "seconds": best,
+            "frames_per_sec": frames / best,
+            "script_bytes": size,
+            "peak_mem_bytes": peakMemory(lambda: alfred.jobScript(job)),
+        })
+    return results
+
+
+def benchJSON (engine, jobcounts, repeat):
+    results = []
+    for njobs in jobcounts:
+        data = bytearray(makeReply(njobs))
+        decoders = [
+            ("loads", lambda: trjson.loads(data)),
+            ("iterArray", lambda: sum(1 for j in trjson.iterArray(data, "jobs"))),
+        ]
+        for name, fn in decoders:
+            best = min(timed(fn) for i in range(repeat))
+            results.append({
+                "bench": "json",
+                "decoder": name,
+                "backend": trjson.backend,
+                "jobs": njobs,
+                "reply_bytes": len(data),
+                "seconds": best,
+                "mb_per_sec": len(data) / 1e6 / best,
+                "peak_mem_bytes": peakMemory(fn),
+            })
+
+        # the same through a query round trip to the mock engine
+        engine.jobs.clear()
+        engine.addJobs(njobs)
+        rpc = submitter.TrHttpRPC(engine.address, 0, keepalive=True)
+        query = lambda: sum(1 for j in rpc.TransactionItems("queries", "q=jobs", "data")[1])
+        before = dict(engine.stats)
+        best = min(timed(query) for i in range(repeat))
+        results.append({
+            "bench": "json",
+            "decoder": "query",
+            "backend": trjson.backend,
+            "jobs": njobs,
+            "reply_bytes": (engine.stats["bytesout"] - before["bytesout"]) // repeat,
+            "seconds": best,
+            "peak_mem_bytes": peakMemory(query),
+        })
+        engine.jobs.clear()
+    submitter.trCloseConnectionPools()
+    return results
+
+
+def benchPayload (framecounts, bandwidth, repeat):
+    results = []
+    with MockEngine(bandwidth=bandwidth) as engine:
+        options = submitter.spoolOptionParser().parse_args(
+                    ["--engine", engine.address, "--user", "bench"])[0]
+        for frames in framecounts:
+            alfdata = alfred.jobScript(sampleJob(frames))
+            hdrs = submitter.jobSpoolRequest("bench.alf", options, alfdata)[1]
+            raw = alfdata.strip().encode("utf-8")
+            for encoding in ("none", "gzip", "deflate"):
+                rpc = submitter.TrHttpRPC(engine.address, 0, keepalive=True, compress=encoding)
+                spool = lambda: rpc.Transaction("spool", alfdata, None, hdrs)
+                spool()  # warm up
+                results.append({
+                    "bench": "payload",
+                    "frames": frames,
+                    "encoding": encoding,
+                    "bandwidth": bandwidth,
+                    "script_bytes": len(raw),
+                    "body_bytes": len(submitter.encodeBody(raw, encoding)),
+                    "encode_seconds": min(timed(lambda: submitter.encodeBody(raw, encoding))
+                                            for i in range(repeat)),
+                    "spool_seconds": min(timed(spool) for i in range(repeat)),
+                })
+        submitter.trCloseConnectionPools()
+    return results
+
+
+def timed (fn):
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+## ------------------------------------------------------------- ##
+
+def main (argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    ap.add_argument("--spools", type=int, default=1000)
+    ap.add_argument("--frames", type=int, nargs="+", default=[10, 1000, 100000])
+    ap.add_argument("--jobs", type=int, nargs="+", default=[10000, 100000])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--latency", type=float, default=0.0,
+            help="seconds the mock engine takes over each request")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--errorrate", type=float, default=0.0)
+    ap.add_argument("--payload-frames", type=int, nargs="+", default=[1000, 10000])
+    ap.add_argument("--bandwidth", type=float, default=12.5e6,
+            help="bytes/second of the link in the payload bench")
+    ap.add_argument("--only", choices=("spool", "alfred", "json", "payload"), nargs="+",
+            default=["spool", "alfred", "json", "payload"])
+    ap.add_argument("--quick", action="store_true",
+            help="small sizes, for a smoke test")
+    ap.add_argument("--output", default="-", help="JSON results file, '-' for stdout")
+    args = ap.parse_args(argv)
+
+    if args.quick:
+        args.spools = 100
+        args.frames = [10, 1000]
+        args.jobs = [1000]
+        args.payload_frames = [1000]
+        args.repeat = 1
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "json_backend": trjson.backend,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "errorrate": args.errorrate,
+        },
+        "results": [],
+    }
+
+    with MockEngine(latency=args.latency, jitter=args.jitter,
+                    errorrate=args.errorrate, seed=1) as engine:
+        if "spool" in args.only:
+            alfdata = alfred.jobScript(sampleJob(100))
+            report["results"] += benchSpool(engine, args.spools, alfdata)
+        if "alfred" in args.only:
+            report["results"] += benchAlfred(args.frames, args.repeat)
+        if "json" in args.only:
+            report["results"] += benchJSON(engine, args.jobs, args.repeat)
+    if "payload" in args.only:
+        report["results"] += benchPayload(args.payload_frames, args.bandwidth, args.repeat)
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+'''
+A stand-in Tractor engine, run in-process, for exercising and timing
+the client without a farm.
+
+    with MockEngine(latency=0.005, jitter=0.002, errorrate=0.01) as engine:
+        rpc = TrHttpRPC(engine.address, 0, keepalive=True)
+        ...
+
+It answers spool, monitor (login, logout) and queries (jobs, tasks and
+the job control operations) over HTTP/1.1 keep-alive, much as the real
+engine does, keeping spooled jobs in memory.  Every request can be
+delayed by 'latency' plus up to 'jitter' seconds, answered with a 503 at
+'errorrate', or be carried out but have its connection dropped before
+the reply at 'droprate'.  Spools repeating an X-Tractor-Spool-Token
+get the job the first one made.  Request bodies may come gzip or
+deflate encoded, as far as 'encodings' allows (others get a 415), and
+with 'bandwidth' set (bytes/second) the time to move the request and
+reply over such a link is added to the latency.
+'stats' counts requests and the bytes that went each way.
+
+    python benchmarks/mockengine.py [--port 8080] [--latency 0.01]
+
+runs one in the foreground, e.g. to point the add-on at with
+TRACTOR_ENGINE=localhost:8080.
+'''
+
+import re
+import sys
+import gzip
+import zlib
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockEngineServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # clients resetting idle keep-alive connections are business
+        # as usual, not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class MockEngine(object):
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                    errorrate=0.0, droprate=0.0, requirelogin=False, seed=None,
+                    encodings=("gzip", "deflate"), bandwidth=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.errorrate = errorrate
+        self.droprate = droprate
+        self.requirelogin = requirelogin
+        self.encodings = encodings
+        self.bandwidth = bandwidth
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.nextjid = 1
+        self.sessions = set()
+        self.tokens = {}  # spool token: jid
+        self.stats = {"requests": 0, "bytesin": 0, "bytesout": 0,
+                        "errors": 0, "drops": 0, "connections": 0}
+
+        handler = type("Handler", (MockEngineHandler,), {"engine": self})
+        self.server = MockEngineServer((host, port), handler)
+        self.thread = None
+
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return "{}:{}".format(host, port)
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                        name="mock tractor engine", daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+    def addJobs(self, n, **attrs):
+        # Fill the queue with 'n' made up jobs, for query benchmarks.
+        with self.lock:
+            for i in range(n):
+                jid = self.nextjid
+                self.nextjid += 1
+                job = {"jid": jid, "owner": "artist", "title": "shot_{:05d}.blend".format(jid),
+                        "priority": 1.0, "numtasks": 240, "numactive": 0,
+                        "numdone": jid % 240, "numerror": 0, "spooltime": time.time(),
+                        "stoptime": "", "pausetime": "", "service": "BlenderRender"}
+                job.update(attrs)
+                self.jobs[jid] = job
+
+    ## ----- ##
+
+    def spool(self, body, headers):
+        m = re.search(r"-title\s+(\{[^}]*\}|\S+)", body)
+        title = m.group(1).strip("{}") if m else "untitled"
+        token = headers.get("X-Tractor-Spool-Token")
+        with self.lock:
+            if token in self.tokens:
+                jid = self.tokens[token]
+                return {"rc": 0, "msg": "job script already spooled, jid: {}".format(jid), "jid": jid}
+            jid = self.nextjid
+            if token:
+                self.tokens[token] = jid
+            self.nextjid += 1
+            self.jobs[jid] = {"jid": jid, "owner": headers.get("X-Tractor-User", ""),
+                                "title": title, "priority": float(headers.get("X-Tractor-Priority") or 1),
+                                "numtasks": body.count("RemoteCmd"), "numactive": 0,
+                                "numdone": 0, "numerror": 0, "spooltime": time.time(),
+                                "stoptime": "", "pausetime": "", "service": ""}
+        return {"rc": 0, "msg": "job script accepted, jid: {}".format(jid), "jid": jid}
+
+
+    def monitor(self, form):
+        q = form.get("q")
+        if q == "login":
+            tsid = "{:016x}".format(self.random.getrandbits(64))
+            with self.lock:
+                self.sessions.add(tsid)
+            return {"rc": 0, "tsid": tsid, "user": form.get("user", "")}
+        if q == "logout":
+            with self.lock:
+                self.sessions.discard(form.get("tsid"))
+            return {"rc": 0, "msg": "logged out"}
+        return {"rc": 0, "mbox": []}
+
+
+    def queries(self, form):
+        q = form.get("q")
+        if q in ("jobs", "tasks"):
+            jids = None
+            m = re.search(r"jid\s+in\s+\[([\d\s]*)\]", form.get("filter", ""))
+            if m:
+                jids = set(int(j) for j in m.group(1).split())
+            with self.lock:
+                rows = [dict(j) for j in self.jobs.values() if jids is None or j["jid"] in jids]
+            if q == "tasks":
+                rows = [{"jid": j["jid"], "tid": 1, "title": "Frame 1", "state": "active",
+                         "progress": 50} for j in rows if j["numactive"]]
+            columns = [c for c in form.get("columns", "").split(",") if c]
+            if columns:
+                rows = [dict((c, r.get(c)) for c in columns) for r in rows]
+            limit = int(form.get("limit") or 0)
+            if limit:
+                rows = rows[:limit]
+            return {"rc": 0, "msg": "", "data": rows}
+
+        jid = int(form.get("jid") or 0)
+        with self.lock:
+            job = self.jobs.get(jid)
+            if job is None:
+                return {"rc": 1, "msg": "no such job: {}".format(jid)}
+            if q == "jdelete":
+                del self.jobs[jid]
+            elif q == "jattr":
+                if "set_pause" in form:
+                    job["pausetime"] = time.time() if form["set_pause"] == "1" else ""
+                if "set_priority" in form:
+                    job["priority"] = float(form["set_priority"])
+            elif q in ("jrestart", "jretryerrs"):
+                job["numerror"] = 0
+            else:
+                return {"rc": 1, "msg": "unknown query: {}".format(q)}
+        return {"rc": 0, "msg": "{} {}".format(q, jid)}
+
+
+class CountingFile(object):
+    # Wraps a handler's rfile or wfile, adding up the bytes through it.
+
+    def __init__(self, f, engine, key):
+        self.f = f
+        self.engine = engine
+        self.key = key
+
+    def count(self, n):
+        with self.engine.lock:
+            self.engine.stats[self.key] += n
+
+    def read(self, *args):
+        data = self.f.read(*args)
+        self.count(len(data))
+        return data
+
+    def readline(self, *args):
+        data = self.f.readline(*args)
+        self.count(len(data))
+        return data
+
+    def write(self, data):
+        self.count(len(data))
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class MockEngineHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    engine = None
+    wbufsize = 1 << 16  # a reply leaves in one write, not held up by Nagle
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.rfile = CountingFile(self.rfile, self.engine, "bytesin")
+        self.wfile = CountingFile(self.wfile, self.engine, "bytesout")
+        with self.engine.lock:
+            self.engine.stats["connections"] += 1
+
+
+    def do_POST(self):
+        engine = self.engine
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+
+        delay = engine.latency + engine.jitter * engine.random.random()
+        if engine.bandwidth:
+            delay += length / float(engine.bandwidth)
+        roll = engine.random.random()
+        with engine.lock:
+            engine.stats["requests"] += 1
+        if delay:
+            time.sleep(delay)
+
+        url = urlparse(self.path)
+        verb = url.path.rpartition("/")[2]
+        query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+
+        if engine.droprate <= roll < engine.droprate + engine.errorrate:
+            with engine.lock:
+                engine.stats["errors"] += 1
+            return self.reply(503, {"rc": 503, "msg": "injected error"})
+
+        encoding = self.headers.get("Content-Encoding")
+        if encoding:
+            if encoding not in engine.encodings:
+                return self.reply(415, {"rc": 415, "msg": "unsupported encoding: {}".format(encoding)})
+            body = gzip.decompress(body) if encoding == "gzip" else zlib.decompress(body)
+
+        status, data = self.answer(verb, query, body)
+
+        # the request was carried out, but the reply gets lost
+        if roll < engine.droprate:
+            with engine.lock:
+                engine.stats["drops"] += 1
+            self.close_connection = True
+            return
+        self.reply(status, data)
+
+
+    def answer(self, verb, query, body):
+        engine = self.engine
+        if verb == "spool":
+            return (200, engine.spool(body.decode("utf-8", "replace"), self.headers))
+
+        form = dict((k, v[-1]) for k, v in parse_qs(body.decode("utf-8")).items())
+        form.update(query)
+        if verb == "monitor":
+            return (200, engine.monitor(form))
+        if verb == "queries":
+            if engine.requirelogin and form.get("tsid") not in engine.sessions:
+                return (403, {"rc": 403, "msg": "login required"})
+            return (200, engine.queries(form))
+        return (404, {"rc": 404, "msg": "unknown verb: {}".format(verb)})
+
+
+    def reply(self, status, data):
+        out = json.dumps(data).encode("utf-8")
+        if self.engine.bandwidth:
+            time.sleep(len(out) / float(self.engine.bandwidth))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+    def log_message(self, *args):
+        pass
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run a stand-in Tractor engine.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--errorrate", type=float, default=0.0)
+    ap.add_argument("--droprate", type=float, default=0.0)
+    ap.add_argument("--bandwidth", type=float, default=0,
+            help="bytes/second of the simulated link, 0 for no limit")
+    ap.add_argument("--jobs", type=int, default=0, help="made up jobs to start with")
+    args = ap.parse_args(argv)
+
+    engine = MockEngine(args.host, args.port, args.latency, args.jitter,
+                        args.errorrate, args.droprate, bandwidth=args.bandwidth)
+    engine.addJobs(args.jobs)
+    print("mock tractor engine on {}".format(engine.address))
+    try:
+        engine.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
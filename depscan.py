@@ -0,0 +1,193 @@
+'''
+Checking the files a spooled .blend depends on.
+
+The add-on gathers what the scene refers to (linked libraries, images,
+movie clips, sounds, fonts, Alembic/USD caches, OpenVDB volumes, point
+and fluid caches, sequencer strips) as plain dependency dicts:
+
+    {"kind": "image", "owner": "Wood", "path": "/abs/path/wood_<UDIM>.png",
+     "relative": True, "sequence": False, "directory": False,
+     "optional": False}
+
+("optional" for caches the blades may well write themselves.)
+
+scanManifest() expands sequences, UDIM tiles and cache directories to
+the files behind them and builds the manifest: every file with its
+size, mtime and sha256, and the dependencies nothing was found for.
+Digests are kept in a DigestCache by path, size and mtime, so only new
+or changed files are ever read.  problems() then lists whatever would
+make blades render the wrong thing: missing or empty files, and files
+outside the directories the blades can see.
+'''
+
+import os
+import re
+import json
+import threading
+
+from . spoolstore import fileDigest
+
+# frame number or tile placeholders in sequence and tile paths
+TILE_TOKENS = re.compile(r"<UDIM>|<UVTILE>|#+")
+
+
+class DependencyError(Exception):
+    pass
+
+## ------------------------------------------------------------- ##
+
+class DigestCache(object):
+    '''
+    sha256 digests of files by path, good for as long as the file's
+    size and mtime stay the same; kept in a JSON file at 'path'.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+        if path:
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+
+    def digest(self, path, st):
+        key = [st.st_size, st.st_mtime_ns]
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[:2] == key:
+                return entry[2]
+        digest = fileDigest(path)
+        with self.lock:
+            self.entries[path] = key + [digest]
+            self.dirty = True
+        return digest
+
+
+    def save(self):
+        # Writes the cache back, if there is anything new in it.
+        if not (self.path and self.dirty):
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with self.lock:
+            # forget files that are gone
+            self.entries = dict((p, e) for p, e in self.entries.items() if os.path.exists(p))
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            self.dirty = False
+        os.replace(tmp, self.path)
+
+
+def sequencePattern(path, sequence):
+    # A regex for the file names of the sequence (or tiles) 'path' is
+    # one of, or None if it names a single file.
+    name = os.path.basename(path)
+    if TILE_TOKENS.search(name):
+        parts = TILE_TOKENS.split(name)
+        return re.compile(r"\d+".join(re.escape(p) for p in parts) + "$")
+    if sequence:
+        m = re.search(r"(\d+)(?!.*\d)", name)
+        if m:
+            return re.compile(re.escape(name[:m.start()]) + r"\d+" + re.escape(name[m.end():]) + "$")
+    return None
+
+
+def expandDependency(dep):
+    '''
+    The paths of the files behind dependency 'dep'; none when nothing
+    is there.
+    '''
+    path = dep["path"]
+    if dep.get("directory"):
+        found = []
+        for top, dirs, names in os.walk(path):
+            found.extend(os.path.join(top, n) for n in names)
+        return sorted(found)
+
+    pattern = sequencePattern(path, dep.get("sequence"))
+    if pattern is None:
+        return [path] if os.path.isfile(path) else []
+
+    try:
+        with os.scandir(os.path.dirname(path)) as it:
+            return sorted(e.path for e in it if pattern.match(e.name) and e.is_file())
+    except OSError:
+        return []
+
+
+def scanManifest(deps, cache=None, hashfiles=True):
+    '''
+    The manifest of dependencies 'deps':
+
+        {"files": [{"path", "kind", "owner", "relative", "size", "mtime",
+                    "sha256"}...],
+         "missing": [dependency...], "bytes": total size}
+
+    A file several dependencies share is listed once.  Without
+    'hashfiles' the "sha256" of files is None.
+    '''
+    cache = cache or DigestCache()
+    files = {}
+    missing = []
+    for dep in deps:
+        found = expandDependency(dep)
+        if not found and not dep.get("optional"):
+            missing.append(dep)
+        for path in found:
+            if path in files:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files[path] = {
+                "path": path,
+                "kind": dep["kind"],
+                "owner": dep["owner"],
+                "relative": bool(dep.get("relative")),
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "sha256": cache.digest(path, st) if hashfiles else None,
+            }
+
+    files = [files[p] for p in sorted(files)]
+    return {"files": files, "missing": missing,
+            "bytes": sum(f["size"] for f in files)}
+
+
+def isBelow(path, roots):
+    path = os.path.normcase(os.path.abspath(path))
+    for root in roots:
+        root = os.path.normcase(os.path.abspath(root))
+        if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+def problems(manifest, roots=(), staged=False):
+    '''
+    What is wrong with the dependencies in 'manifest', as a list of
+    messages.  With 'roots', the directories the blades can see,
+    files outside all of them are reported too, except those found by
+    relative path when they are 'staged' along with the .blend.
+    '''
+    found = []
+    for dep in manifest["missing"]:
+        found.append("missing {} {}: {}".format(dep["kind"], dep["owner"], dep["path"]))
+    for f in manifest["files"]:
+        if f["size"] == 0:
+            found.append("empty {} {}: {}".format(f["kind"], f["owner"], f["path"]))
+        elif roots and not (staged and f["relative"]) and not isBelow(f["path"], roots):
+            found.append("not visible to the blades, {} {}: {}".format(f["kind"], f["owner"], f["path"]))
+    return found
+
+
+def writeManifest(path, manifest):
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return path
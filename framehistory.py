@@ -0,0 +1,207 @@
+'''
+Per-frame render time history, and frame chunking based on it.
+
+Blades append one line per rendered frame ("frame <n> <seconds>") and
+one per Blender launch ("startup <seconds>", the time spent before the
+first frame started) to a plain text log next to the source .blend.
+Appending keeps concurrent blades from stepping on each other, and
+FrameHistory folds the log into per-frame estimates when the next job
+for the same .blend is built.
+
+Run as a Blender --python script this file installs the render
+handlers that write the log; the log path is taken from the
+"tractordispacher_history" property of the spooled scene, which for
+a batch of view layers maps each layer's name to its own log.
+'''
+
+import os
+import time
+
+HISTORY_PROP = "tractordispacher_history"
+
+## ------------------------------------------------------------- ##
+
+def historyPath(blendpath, scene=None):
+    '''
+    Where the render time log for the given source .blend (and scene
+    in it) lives.
+    '''
+    d, f = os.path.split(blendpath)
+    name = os.path.splitext(f)[0]
+    if scene:
+        name += "." + "".join(c if c.isalnum() or c in "-_" else "_" for c in scene)
+    return os.path.join(d, ".tractor", name + ".history")
+
+
+class FrameHistory(object):
+    '''
+    Per-frame render time estimates folded from a history log.  Newer
+    measurements weigh as much as all the older ones together, so the
+    estimates follow a shot as it gets heavier or lighter.
+    '''
+
+    maxlogsize = 1 << 20  # compact logs growing beyond this many bytes
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = {}
+        self.startup = None
+        self.load()
+
+
+    def load(self):
+        nlines = 0
+        try:
+            f = open(self.path, "r")
+        except OSError:
+            return
+        with f:
+            for line in f:
+                w = line.split()
+                try:
+                    if len(w) == 3 and w[0] == "frame":
+                        self.fold(int(w[1]), float(w[2]))
+                    elif len(w) == 2 and w[0] == "startup":
+                        t = float(w[1])
+                        self.startup = t if self.startup is None else (self.startup + t) * 0.5
+                    nlines += 1
+                except ValueError:
+                    pass  # a line cut short by a dying blade
+
+        if nlines and os.path.getsize(self.path) > self.maxlogsize:
+            self.compact()
+
+
+    def fold(self, frame, seconds):
+        old = self.frames.get(frame)
+        self.frames[frame] = seconds if old is None else (old + seconds) * 0.5
+
+
+    def compact(self):
+        # Rewrite the log as one line per frame.  A line appended by a
+        # blade while this runs may be lost, which only costs accuracy.
+        tmp = self.path + ".tmp{}".format(os.getpid())
+        with open(tmp, "w") as f:
+            if self.startup is not None:
+                f.write("startup {:.3f}\n".format(self.startup))
+            for frame in sorted(self.frames):
+                f.write("frame {} {:.3f}\n".format(frame, self.frames[frame]))
+        os.replace(tmp, self.path)
+
+
+    def estimates(self, frames):
+        '''
+        Returns {frame: seconds} for 'frames', filling frames never
+        measured with the median of those that were, or None if none
+        of them were measured.
+        '''
+        known = sorted(self.frames[f] for f in frames if f in self.frames)
+        if not known:
+            return None
+        median = known[len(known) // 2]
+        return dict((f, self.frames.get(f, median)) for f in frames)
+
+
+def historyLog(scene):
+    '''
+    The render time log named in a spooled scene, for the one view
+    layer rendered where it names one per layer; None for none.
+    '''
+    logs = scene.get(HISTORY_PROP)
+    if not logs or isinstance(logs, str):
+        return logs or None
+    used = [layer.name for layer in scene.view_layers if layer.use]
+    if len(used) != 1:
+        return None
+    return logs.get(used[0])
+
+
+def appendRecord(path, *words):
+    # One write() of one short line with O_APPEND, so lines from many
+    # blades don't interleave.
+    line = " ".join(str(w) for w in words) + "\n"
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        os.write(fd, line.encode("ascii"))
+    finally:
+        os.close(fd)
+
+## ------------------------------------------------------------- ##
+
+def adaptiveChunks(frames, times, target, startup, step=1):
+    '''
+    Pack the ordered 'frames' into (first, last) chunks of consecutive
+    frames, 'step' apart, each estimated to take about 'target' seconds
+    including the 'startup' cost of launching Blender for it.  'times'
+    maps each frame to its estimated render time.  A frame costing more
+    than the target on its own gets a chunk of its own, and a gap in
+    'frames' always starts a new chunk.
+    '''
+    chunk = None
+    cost = startup
+    for f in frames:
+        t = times[f]
+        if chunk and (cost + t > target or f != chunk[1] + step):
+            yield chunk
+            chunk = None
+            cost = startup
+        chunk = (f, f) if chunk is None else (chunk[0], f)
+        cost += t
+    if chunk:
+        yield chunk
+
+## ------------------------------------------------------------- ##
+
+def processAge():
+    # Seconds since this process started, or None where unknown.
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return None
+    started = int(stat.rpartition(")")[2].split()[19])
+    return uptime - started / os.sysconf("SC_CLK_TCK")
+
+
+def installRecorder():
+    '''
+    Install render handlers appending this blade's render times to the
+    history log named in the spooled scene.
+    '''
+    import bpy
+    from bpy.app.handlers import persistent
+
+    path = historyLog(bpy.context.scene)
+    if not path:
+        return
+
+    state = {"start": None, "first": True}
+
+    @persistent
+    def renderPre(scene, *args):
+        if state["first"]:
+            state["first"] = False
+            age = processAge()
+            if age is not None:
+                appendRecord(path, "startup", "{:.3f}".format(age))
+        state["start"] = time.monotonic()
+
+    @persistent
+    def renderPost(scene, *args):
+        if state["start"] is None:
+            return
+        seconds = time.monotonic() - state["start"]
+        state["start"] = None
+        try:
+            appendRecord(path, "frame", scene.frame_current, "{:.3f}".format(seconds))
+        except OSError as e:
+            print("tractor frame history: {}".format(e))
+
+    bpy.app.handlers.render_pre.append(renderPre)
+    bpy.app.handlers.render_post.append(renderPost)
+
+
+if __name__ == "__main__":
+    installRecorder()
@@ -0,0 +1,85 @@
+'''
+Finding the frames of a shot that still need rendering.
+
+The expected output path of every frame is worked out in Blender
+(scene.render.frame_path); here each output directory is listed once
+with os.scandir and the frames whose file is missing, empty (a
+placeholder left by a failed blade) or, optionally, not starting with
+the header its extension calls for are returned.  Only the files that
+are there get a stat, so a 10k frame shot over NFS costs one listing
+plus one stat per rendered frame rather than a lookup per frame.
+'''
+
+import os
+
+# leading bytes of the image formats Blender writes, by extension
+IMAGE_MAGIC = {
+    ".png": (b"\x89PNG\r\n\x1a\n",),
+    ".exr": (b"\x76\x2f\x31\x01",),
+    ".jpg": (b"\xff\xd8\xff",),
+    ".jpeg": (b"\xff\xd8\xff",),
+    ".tif": (b"II*\x00", b"MM\x00*"),
+    ".tiff": (b"II*\x00", b"MM\x00*"),
+    ".bmp": (b"BM",),
+    ".hdr": (b"#?",),
+    ".dpx": (b"SDPX", b"XPDS"),
+    ".cin": (b"\x80\x2a\x5f\xd7",),
+    ".jp2": (b"\x00\x00\x00\x0cjP  ", b"\xff\x4f\xff\x51"),
+    ".webp": (b"RIFF",),
+}
+
+## ------------------------------------------------------------- ##
+
+def headerOK(path):
+    '''
+    True when the file at 'path' starts the way its extension says it
+    should; files of unknown types pass.
+    '''
+    magic = IMAGE_MAGIC.get(os.path.splitext(path)[1].lower())
+    if not magic:
+        return True
+    try:
+        with open(path, "rb") as f:
+            head = f.read(max(len(m) for m in magic))
+    except OSError:
+        return False
+    return any(head.startswith(m) for m in magic)
+
+
+def listSizes(directory, names):
+    # Sizes of those of 'names' present in 'directory', from a single
+    # listing of it.
+    sizes = {}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name in names:
+                    try:
+                        sizes[entry.name] = entry.stat().st_size
+                    except OSError:
+                        pass
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return sizes
+
+
+def missingFrames(expected, checkheader=False):
+    '''
+    The frames, in order, of the {frame: output path} mapping 'expected'
+    whose output is missing or invalid.
+    '''
+    bydir = {}
+    for frame, path in expected.items():
+        d, name = os.path.split(path)
+        bydir.setdefault(d, {})[name] = frame
+
+    missing = []
+    for d, names in bydir.items():
+        sizes = listSizes(d or ".", names)
+        for name, frame in names.items():
+            size = sizes.get(name)
+            if not size:
+                missing.append(frame)
+            elif checkheader and not headerOK(os.path.join(d, name)):
+                missing.append(frame)
+    return sorted(missing)
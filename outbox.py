@@ -0,0 +1,314 @@
+'''
+A durable local outbox for jobs that could not be spooled.
+
+When the engine can't be reached, jobSpool (with options.outbox set)
+stores the spool request, alfred text and headers, spool token
+included, in a small SQLite database instead of failing.  An
+OutboxDrainer thread sends the entries once the engine answers again:
+it probes with one job, then sends the rest in batches of 'batch' at
+no more than 'rate' jobs a second, so a farm coming back from an
+outage isn't flooded by every artist's backlog at once.  Entries the
+engine turns down for any other reason than being unavailable are
+kept, marked failed, for the user to look at.
+
+The database is shared by every Blender and command line client of
+the user; entries are claimed before sending so two drainers don't
+send the same one (and the spool token makes that harmless anyway).
+'''
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+from . submitter import TrHttpRPC, spoolReplyJid, engineUnavailable, spoolCompression
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    engine TEXT NOT NULL,
+    jobfile TEXT NOT NULL,
+    title TEXT,
+    alfdata TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    queued REAL NOT NULL,
+    claimed REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    jid INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_state ON outbox (state, id);
+'''
+
+## ------------------------------------------------------------- ##
+
+def outboxPath():
+    '''
+    The user's outbox database, $TRACTOR_OUTBOX or one in the user's
+    data directory.
+    '''
+    if os.environ.get("TRACTOR_OUTBOX"):
+        return os.environ["TRACTOR_OUTBOX"]
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "tractor-dispatcher", "outbox.sqlite")
+
+
+class Outbox(object):
+
+    claimtime = 600.0  # seconds after which a claimed entry is up for grabs again
+
+    def __init__(self, path=None):
+        self.path = path or outboxPath()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(self.connect()) as db, db:
+            db.executescript(SCHEMA)
+
+
+    def connect(self):
+        # Used as "with closing(self.connect()) as db, db:", which
+        # commits (or rolls back) and then closes the connection.
+        db = sqlite3.connect(self.path, timeout=30.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=FULL")
+        return db
+
+
+    def Put(self, engine, jobfile, alfdata, hdrs, title=""):
+        '''
+        Queue a spool request, returns the entry's id.
+        '''
+        with closing(self.connect()) as db, db:
+            cur = db.execute("INSERT INTO outbox (engine, jobfile, title, alfdata, headers, queued) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (engine, jobfile, title, alfdata, json.dumps(hdrs), time.time()))
+            return cur.lastrowid
+
+
+    def Claim(self, engine, limit):
+        '''
+        Claim up to 'limit' of the oldest entries waiting for 'engine',
+        returns them as (id, jobfile, alfdata, headers) tuples.
+        '''
+        now = time.time()
+        claimed = []
+        with closing(self.connect()) as db, db:
+            rows = db.execute("SELECT id, jobfile, alfdata, headers FROM outbox "
+                              "WHERE engine = ? AND (state = 'queued' OR "
+                              "(state = 'sending' AND claimed < ?)) ORDER BY id LIMIT ?",
+                              (engine, now - self.claimtime, limit)).fetchall()
+            for id, jobfile, alfdata, headers in rows:
+                # only if still up for grabs: another drainer may have
+                # claimed it since the SELECT
+                cur = db.execute("UPDATE outbox SET state = 'sending', claimed = ?, "
+                                 "attempts = attempts + 1 WHERE id = ? AND (state = 'queued' OR "
+                                 "(state = 'sending' AND claimed < ?))",
+                                 (now, id, now - self.claimtime))
+                if cur.rowcount:
+                    claimed.append( (id, jobfile, alfdata, json.loads(headers)) )
+        return claimed
+
+
+    def Done(self, id, jid):
+        with closing(self.connect()) as db, db:
+            db.execute("UPDATE outbox SET state = 'sent', jid = ?, error = NULL, "
+                       "alfdata = '' WHERE id = ?", (jid, id))
+
+
+    def Requeue(self, id, error):
+        with closing(self.connect()) as db, db:
+            db.execute("UPDATE outbox SET state = 'queued', error = ? WHERE id = ?", (error, id))
+
+
+    def Fail(self, id, error):
+        with closing(self.connect()) as db, db:
+            db.execute("UPDATE outbox SET state = 'failed', error = ? WHERE id = ?", (error, id))
+
+
+    def Entry(self, id):
+        # (state, jid) of entry 'id', None if there is no such entry.
+        with closing(self.connect()) as db, db:
+            return db.execute("SELECT state, jid FROM outbox WHERE id = ?", (id,)).fetchone()
+
+
+    def Engines(self):
+        # The engines with entries waiting.
+        with closing(self.connect()) as db, db:
+            return [r[0] for r in db.execute("SELECT DISTINCT engine FROM outbox "
+                                             "WHERE state IN ('queued', 'sending')")]
+
+
+    def Entries(self, states=("queued", "sending", "failed")):
+        '''
+        (id, engine, title, state, queued, attempts, jid, error) of the
+        entries in any of 'states', oldest first.
+        '''
+        with closing(self.connect()) as db, db:
+            return db.execute("SELECT id, engine, title, state, queued, attempts, jid, error "
+                              "FROM outbox WHERE state IN ({}) ORDER BY id".format(
+                                ",".join("?" * len(states))), tuple(states)).fetchall()
+
+
+    def Counts(self):
+        with closing(self.connect()) as db, db:
+            return dict(db.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state"))
+
+
+    def Purge(self, maxage=7 * 86400.0):
+        # Forget entries sent more than 'maxage' seconds ago.
+        with closing(self.connect()) as db, db:
+            db.execute("DELETE FROM outbox WHERE state = 'sent' AND claimed < ?",
+                       (time.time() - maxage,))
+
+
+class OutboxDrainer(threading.Thread):
+    '''
+    Sends the outbox's entries once their engine answers again, and
+    every 'purgeinterval' seconds forgets those sent long ago.
+    'onspooled(engine, jid, title, id)' is called for each job spooled,
+    'id' being its outbox entry's.
+    '''
+
+    def __init__(self, outbox, batch=20, rate=2.0, interval=30.0,
+                    maxinterval=300.0, onspooled=None, purgeinterval=3600.0):
+        threading.Thread.__init__(self, name="tractor outbox drainer", daemon=True)
+        self.outbox = outbox
+        self.batch = batch
+        self.rate = rate
+        self.interval = interval
+        self.maxinterval = maxinterval
+        self.onspooled = onspooled
+        self.purgeinterval = purgeinterval
+        self.purged = None  # when sent entries were last purged
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.waits = {}  # engine: seconds to wait before trying it again
+        self.status = ""
+        self.waiting = 0
+        self.failed = 0
+        self.generation = 0
+
+
+    def Kick(self):
+        # Something was queued, have a go now.
+        self.wakeup.set()
+
+
+    def Stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+
+    def run(self):
+        while not self.stopping:
+            wait = self.interval
+            try:
+                if self.purged is None or time.monotonic() - self.purged > self.purgeinterval:
+                    self.outbox.Purge()
+                    self.purged = time.monotonic()
+                self.recount()
+                for engine in self.outbox.Engines():
+                    wait = min(wait, self.drain(engine))
+                    self.recount()
+                    if self.stopping:
+                        break
+            except sqlite3.Error as e:
+                self.setStatus("Outbox: {}".format(e))
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+
+
+    def drain(self, engine):
+        # Send what is waiting for 'engine', returns how long to wait
+        # before the next go at it.
+        rpc = TrHttpRPC(engine, 0, keepalive=True, compress=spoolCompression())
+        mininterval = 1.0 / self.rate if self.rate else 0.0
+        sent = 0
+
+        while not self.stopping:
+            # a single probe job first, then whole batches
+            entries = self.outbox.Claim(engine, self.batch if sent else 1)
+            if not entries:
+                break
+            self.recount()
+            for n, (id, jobfile, alfdata, hdrs) in enumerate(entries):
+                t0 = time.monotonic()
+                errcode, reply = rpc.Transaction("spool", alfdata, None, hdrs)
+                if errcode == 0:
+                    jid = spoolReplyJid(reply)
+                    self.outbox.Done(id, jid)
+                    sent += 1
+                    if self.onspooled:
+                        self.onspooled(engine, jid, os.path.basename(jobfile), id)
+                elif engineUnavailable(errcode):
+                    for rest in entries[n:]:
+                        self.outbox.Requeue(rest[0], str(reply))
+                    wait = min(self.maxinterval, self.waits.get(engine, self.interval / 2) * 2)
+                    self.waits[engine] = wait
+                    self.setStatus("Outbox: {} unreachable, next try in {:.0f}s".format(engine, wait))
+                    return wait
+                else:
+                    self.outbox.Fail(id, str(reply))
+                # rate limit
+                time.sleep(max(0.0, mininterval - (time.monotonic() - t0)))
+
+        self.waits.pop(engine, None)
+        if sent:
+            self.setStatus("Outbox: spooled {} queued jobs to {}".format(sent, engine))
+        return self.interval
+
+
+    def recount(self):
+        counts = self.outbox.Counts()
+        waiting = counts.get("queued", 0) + counts.get("sending", 0)
+        failed = counts.get("failed", 0)
+        if (waiting, failed) != (self.waiting, self.failed):
+            self.waiting, self.failed = waiting, failed
+            self.generation += 1
+
+
+    def setStatus(self, text):
+        if text != self.status:
+            self.status = text
+            self.generation += 1
+
+## ------------------------------------------------------------- ##
+
+_trOutbox = None
+_trOutboxDrainer = None
+_trOutboxLock = threading.Lock()
+
+def trOutbox ():
+    '''
+    The user's outbox.
+    '''
+    global _trOutbox
+    with _trOutboxLock:
+        if _trOutbox is None:
+            _trOutbox = Outbox()
+        return _trOutbox
+
+
+def trOutboxDrainer (start=True, **kwargs):
+    '''
+    The running drainer of the user's outbox; unless 'start' is set
+    None is returned where there isn't one yet.  'kwargs' go to the
+    OutboxDrainer made.
+    '''
+    global _trOutboxDrainer
+    outbox = trOutbox() if start else None
+    with _trOutboxLock:
+        if _trOutboxDrainer is None and start:
+            _trOutboxDrainer = OutboxDrainer(outbox, **kwargs)
+            _trOutboxDrainer.start()
+        return _trOutboxDrainer
+
+
+def trStopOutboxDrainer ():
+    global _trOutboxDrainer
+    with _trOutboxLock:
+        if _trOutboxDrainer:
+            _trOutboxDrainer.Stop()
+        _trOutboxDrainer = None
@@ -0,0 +1,211 @@
+'''
+A content-addressed store for spooled files.
+
+Files are stored under the hex digest of their content, as
+<root>/<first two digits>/<digest><suffix>, so spooling an unchanged
+.blend again finds the copy already there and neither writes nor makes
+blades read another multi-gigabyte file.  A stored file's mtime is
+touched each time it is spooled, which is what eviction goes by.
+
+Files to be added are written to <root>/tmp first; that is as deep
+below the root as the stored files, so relative paths remapped for the
+temporary location stay valid once the file is moved into place.
+
+Jobs using stored files are noted in <root>/refs, one small JSON file
+per job, which the store's users look up to tell evict() what not to
+remove while the jobs are still to load them; the store itself knows
+nothing about engines.  A reference may also name scratch directories
+the job writes outside the store (bakes, tiles), removed along with
+the reference once the job is done.
+'''
+
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+## ------------------------------------------------------------- ##
+
+def fileDigest(path, chunksize=1 << 20):
+    '''
+    The sha256 hex digest of a file, read in chunks into one buffer.
+    '''
+    h = hashlib.sha256()
+    buf = bytearray(chunksize)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+class SpoolStore(object):
+
+    def __init__(self, root):
+        self.root = root
+
+
+    def tempPath(self, suffix=""):
+        '''
+        A fresh path to write a file to before put()ting it.
+        '''
+        d = os.path.join(self.root, "tmp")
+        os.makedirs(d, exist_ok=True)
+        return os.path.join(d, uuid.uuid4().hex + suffix)
+
+
+    def storedPath(self, digest, suffix=""):
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+
+    def put(self, path, suffix="", keep=False):
+        '''
+        Add the file at 'path' to the store and return its stored path.
+        The file is moved into the store (or, with 'keep', hard linked
+        or copied), unless identical content is stored already.
+        '''
+        digest = fileDigest(path)
+        dest = self.storedPath(digest, suffix)
+
+        if os.path.exists(dest):
+            if not keep:
+                os.remove(path)
+            os.utime(dest)
+            return dest
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if not keep:
+            os.replace(path, dest)
+        else:
+            try:
+                os.link(path, dest)
+            except OSError:
+                tmp = self.tempPath(suffix)
+                shutil.copy2(path, tmp)
+                os.replace(tmp, dest)
+        os.utime(dest)
+        return dest
+
+
+    def addReference(self, name, paths, **info):
+        '''
+        Note that the job called 'name' uses the stored 'paths'; 'info'
+        (e.g. its engine and jid) is kept along, for references() to
+        return.
+        '''
+        d = os.path.join(self.root, "refs")
+        os.makedirs(d, exist_ok=True)
+        ref = dict(info, paths=[os.path.abspath(p) for p in paths], time=time.time())
+        tmp = os.path.join(d, ".{}.{}".format(name, uuid.uuid4().hex))
+        with open(tmp, "w") as f:
+            json.dump(ref, f)
+        os.replace(tmp, os.path.join(d, name + ".json"))
+
+
+    def references(self):
+        '''
+        Generate (name, reference) of the jobs noted as using stored
+        files, each reference a dict with "paths", "time" and whatever
+        else addReference was given.
+        '''
+        d = os.path.join(self.root, "refs")
+        try:
+            names = os.listdir(d)
+        except FileNotFoundError:
+            return
+        for n in names:
+            if n.startswith(".") or not n.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(d, n), "r") as f:
+                    yield (n[:-5], json.load(f))
+            except (OSError, ValueError):
+                continue
+
+
+    def reference(self, name):
+        # The reference called 'name', None if there is none.
+        try:
+            with open(os.path.join(self.root, "refs", name + ".json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+    def dropReference(self, name, scratch=True):
+        # Forget the reference, removing its scratch directories unless
+        # told not to.
+        path = os.path.join(self.root, "refs", name + ".json")
+        ref = self.reference(name) if scratch else None
+        for d in (ref or {}).get("scratch", []):
+            shutil.rmtree(d, ignore_errors=True)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def entries(self):
+        '''
+        Generate (path, size, mtime) of everything stored.
+        '''
+        try:
+            top = os.scandir(self.root)
+        except FileNotFoundError:
+            return
+        with top:
+            for d in top:
+                if len(d.name) != 2 or not d.is_dir():
+                    continue
+                with os.scandir(d.path) as files:
+                    for f in files:
+                        if not f.is_file():
+                            continue
+                        st = f.stat()
+                        yield (f.path, st.st_size, st.st_mtime)
+
+
+    def evict(self, maxage=None, maxbytes=None, keep=()):
+        '''
+        Remove stored files not spooled for 'maxage' seconds, then the
+        least recently spooled ones until at most 'maxbytes' remain.
+        Paths in 'keep' (those of the references of jobs not finished
+        yet) are never removed.  Leftover temporary files older than a day are
+        removed as well.  Returns the (count, bytes) removed.
+        '''
+        now = time.time()
+        keep = set(os.path.abspath(p) for p in keep)
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        removed = 0
+        freed = 0
+
+        for path, size, mtime in entries:
+            old = maxage is not None and now - mtime > maxage
+            over = maxbytes is not None and total > maxbytes
+            if not (old or over) or os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            freed += size
+
+        tmp = os.path.join(self.root, "tmp")
+        if os.path.isdir(tmp):
+            with os.scandir(tmp) as files:
+                for f in files:
+                    try:
+                        if now - f.stat().st_mtime > 86400:
+                            os.remove(f.path)
+                    except OSError:
+                        pass
+
+        return (removed, freed)
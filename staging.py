@@ -0,0 +1,223 @@
+'''
+Copying spooled files to where the blades can see them.
+
+Artists working on a local disk stage the spooled .blend, the scripts
+run on the blades and the files the .blend refers to by relative path
+into a shared directory.  stagePaths() mirrors them below one staging
+root, keeping their positions relative to each other so the relative
+paths saved in the .blend still lead to the right files.
+
+stageFiles() copies with a thread pool, a big file split into segments
+copied side by side.  Each segment is copied with copy_file_range, or
+sendfile, so the data needn't pass through Python (plain reads and
+writes where neither is available).  A file is written to a .part
+file named after the source's size and mtime; segments done are noted
+next to it, so an interrupted staging picks up where it stopped, and
+the .part file only replaces the staged file once complete.  Files
+already staged are skipped: same size and mtime, or same size and the
+same content when the mtimes differ.
+'''
+
+import os
+import errno
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . spoolstore import fileDigest
+
+SEGMENT = 64 << 20  # bytes copied by one task
+BUFSIZE = 1 << 20
+
+# zero-copy calls not tried again once the platform turned them down
+_unsupported = set()
+
+## ------------------------------------------------------------- ##
+
+def stageRoot(stagedir, paths):
+    '''
+    The directory below 'stagedir' mirroring the deepest directory
+    holding all of 'paths', and that directory.  Projects get their
+    own root, named after and by a hash of the directory mirrored.
+    '''
+    common = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+    key = hashlib.sha1(common.encode("utf-8")).hexdigest()[:10]
+    name = os.path.basename(common.rstrip("/\\")) or "root"
+    return os.path.join(stagedir, "{}-{}".format(name, key)), common
+
+
+def stagePaths(stagedir, paths):
+    '''
+    A dict mapping each of 'paths' to where it is staged below
+    'stagedir'.
+    '''
+    paths = [os.path.abspath(p) for p in paths]
+    root, common = stageRoot(stagedir, paths)
+    return dict((p, os.path.join(root, os.path.relpath(p, common))) for p in paths)
+
+
+def isStaged(src, st, dst):
+    # Whether 'dst' holds what 'src' (of stat 'st') does already.
+    try:
+        dt = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    if dt.st_size != st.st_size:
+        return False
+    if dt.st_mtime_ns == st.st_mtime_ns:
+        return True
+    if fileDigest(src) != fileDigest(dst):
+        return False
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return True
+
+
+def copyRange(sfd, dfd, offset, length):
+    '''
+    Copy 'length' bytes at 'offset' of file descriptor 'sfd' to the
+    same offset of 'dfd'.
+    '''
+    end = offset + length
+
+    if "copy_file_range" not in _unsupported and hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                n = os.copy_file_range(sfd, dfd, end - offset, offset, offset)
+                if n == 0:
+                    raise EOFError("source shrank while staging")
+                offset += n
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            _unsupported.add("copy_file_range")
+
+    if "sendfile" not in _unsupported and hasattr(os, "sendfile"):
+        try:
+            os.lseek(dfd, offset, os.SEEK_SET)
+            while offset < end:
+                n = os.sendfile(dfd, sfd, offset, end - offset)
+                if n == 0:
+                    raise EOFError("source shrank while staging")
+                offset += n
+            return
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                raise
+            _unsupported.add("sendfile")
+
+    os.lseek(sfd, offset, os.SEEK_SET)
+    os.lseek(dfd, offset, os.SEEK_SET)
+    while offset < end:
+        data = os.read(sfd, min(BUFSIZE, end - offset))
+        if not data:
+            raise EOFError("source shrank while staging")
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dfd, view):]
+        offset += len(data)
+
+
+class StagedFile(object):
+    '''
+    One file being staged: its .part file and the segments done.
+    '''
+
+    def __init__(self, src, dst, st, segment):
+        self.src = src
+        self.dst = dst
+        self.size = st.st_size
+        self.st = st
+        self.part = "{}.{}-{}.part".format(dst, st.st_size, st.st_mtime_ns)
+        self.donelog = self.part + ".done"
+        self.segments = max(1, -(-self.size // segment))
+        self.segment = segment
+        self.lock = threading.Lock()
+        self.resumed = False
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.exists(self.part) and os.path.exists(self.donelog):
+            with open(self.donelog, "r") as f:
+                self.done = set(int(line) for line in f if line.strip().isdigit())
+            self.resumed = bool(self.done)
+        else:
+            self.done = set()
+            with open(self.part, "wb") as f:
+                f.truncate(self.size)
+            open(self.donelog, "w").close()
+
+
+    def pending(self):
+        return [i for i in range(self.segments) if i not in self.done]
+
+
+    def copySegment(self, i):
+        # Copy segment 'i' and note it done, once it is on disk.
+        offset = i * self.segment
+        length = min(self.segment, self.size - offset)
+        sfd = os.open(self.src, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            dfd = os.open(self.part, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+            try:
+                if length > 0:
+                    copyRange(sfd, dfd, offset, length)
+                os.fsync(dfd)
+            finally:
+                os.close(dfd)
+        finally:
+            os.close(sfd)
+
+        with self.lock:
+            self.done.add(i)
+            with open(self.donelog, "a") as f:
+                f.write("{}\n".format(i))
+        return length
+
+
+    def finish(self):
+        # Put the complete file in place.
+        os.utime(self.part, ns=(self.st.st_atime_ns, self.st.st_mtime_ns))
+        os.chmod(self.part, self.st.st_mode & 0o7777)
+        os.replace(self.part, self.dst)
+        os.remove(self.donelog)
+
+
+def stageFiles(pairs, threads=4, segment=SEGMENT, progress=None):
+    '''
+    Copy each (src, dst) of 'pairs' in parallel, skipping those staged
+    already and resuming those staged part way.  'progress(done,
+    total)' is called with the bytes copied so far, from the copying
+    threads.  Returns (src, dst, how) for each pair, 'how' being
+    "unchanged", "copied" or "resumed".
+    '''
+    results = []
+    files = []
+    for src, dst in pairs:
+        st = os.stat(src)
+        if isStaged(src, st, dst):
+            results.append((src, dst, "unchanged"))
+        else:
+            files.append(StagedFile(src, dst, st, segment))
+
+    total = sum(f.size for f in files)
+    copied = [sum(min(segment, f.size - i * segment) for f in files for i in f.done)]
+    lock = threading.Lock()
+
+    def copy(f, i):
+        n = f.copySegment(i)
+        with lock:
+            copied[0] += n
+            done = copied[0]
+        if progress:
+            progress(done, total)
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = [pool.submit(copy, f, i) for f in files for i in f.pending()]
+    errors = [fut.exception() for fut in futures if fut.exception()]
+    if errors:
+        raise errors[0]
+
+    for f in files:
+        f.finish()
+        results.append((f.src, f.dst, "resumed" if f.resumed else "copied"))
+    return results
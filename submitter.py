@@ -1,4 +1,3 @@
-import bpy
 #import six
 import json
 import pprint
@@ -10,6 +9,8 @@ import select
 import struct
 import platform
 import optparse
+import threading
+import time
 import getpass
 import datetime
 from time import gmtime, strftime, sleep
@@ -20,21 +21,443 @@ import errno
 import re
 import shutil
 import math
+import uuid
+import gzip
+import zlib
+import urllib.parse
 
 from functools import reduce
+
+from . import trjson
 #import numpy as np
 
 
 #http class 
+# Requests that only read engine state (or, logging in and out, don't
+# mind being done twice) are safe to resend after a failure that may
+# have happened once the request reached the engine.  "monitor" and
+# "queries" carry operations that change jobs too, so for those it is
+# the q= operation that counts.
+IDEMPOTENT_VERBS = ("config",)
+IDEMPOTENT_QUERIES = ("jobs", "tasks", "commands", "invocations", "blades",
+                      "login", "logout")
+
+# A client made token sent with each spool, so that a spool whose reply
+# got lost can be sent again.  That is only safe with an engine making
+# a single job of any number of spool requests carrying the same token:
+# benchmarks/mockengine.py does, the stock Tractor engine doesn't know
+# the header and spools such a resend as a second job.
+SPOOL_TOKEN_HEADER = "X-Tractor-Spool-Token"
+
+# Transaction errcodes meaning the engine couldn't be reached at all,
+# or is there but not taking requests; worth trying again later
+ENGINE_UNAVAILABLE = (errno.ECONNREFUSED, errno.ECONNRESET, errno.ETIMEDOUT,
+                      errno.EHOSTUNREACH, errno.ENETUNREACH,
+                      getattr(errno, "WSAECONNREFUSED", 10061),
+                      getattr(errno, "WSAECONNRESET", 10054),
+                      502, 503, 504)
+
+# Request bodies at least this big are sent compressed, where the
+# client is set to (see TrHttpRPC); smaller ones aren't worth it.
+COMPRESS_MINSIZE = 16384
+
+# Replies of an engine that can't take a compressed request body.  A
+# plain 400 isn't one of them, that is as likely a bad job script.
+ENCODING_REFUSED = (411, 415, 501)
+
+## ------------------------------------------------------------- ##
+
+class TrConnectionPool(object):
+    '''
+    A small pool of idle HTTP/1.1 keep-alive sockets to one engine.
+    Sockets are handed out most-recently-used first, and any socket
+    that has been idle longer than 'idletime' seconds (or that the
+    engine has closed in the meantime) is dismantled rather than
+    reused.  At most 'maxsize' idle sockets are retained.
+    '''
+
+    def __init__(self, host, port, maxsize=4, idletime=30.0):
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.idletime = idletime
+        self.idle = []  # (socket, time it was returned to the pool)
+        self.lock = threading.Lock()
+
+
+    def Acquire (self, timeout=30.0):
+        '''
+        Returns (socket, reused), reusing an idle socket if possible.
+        '''
+        now = time.monotonic()
+        s = None
+        with self.lock:
+            stale = [c for c in self.idle if now - c[1] > self.idletime]
+            self.idle = [c for c in self.idle if now - c[1] <= self.idletime]
+            while self.idle and not s:
+                c,t = self.idle.pop()
+                if self.isAlive(c):
+                    s = c
+                else:
+                    stale.append( (c,t) )
+
+        for c,t in stale:
+            self.dismantle(c)
+
+        if s:
+            return (s, True)
+
+        s = socket.create_connection( (self.host, self.port), timeout )
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return (s, False)
+
+
+    def Release (self, s):
+        '''
+        Return a socket whose reply has been fully consumed.
+        '''
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append( (s, time.monotonic()) )
+                return
+        self.dismantle(s)
+
+
+    def Discard (self, s):
+        self.dismantle(s)
+
+
+    def Close (self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for c,t in idle:
+            self.dismantle(c)
+
+
+    def isAlive (self, s):
+        # an idle keep-alive socket should never be readable, if it
+        # is then the engine has closed it (or sent us garbage)
+        try:
+            r,w,x = select.select([s], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not r
+
+
+    def dismantle (self, s):
+        # see the note about TIME_WAIT in TrHttpRPC.oneshotExchange
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        except OSError:
+            pass
+        s.close()
+
+
+class TrCircuitBreaker(object):
+    '''
+    Stops clients from queueing up against an engine that is down.
+    After 'threshold' failed transactions in a row the breaker opens
+    and calls fail straight away; once 'cooldown' seconds have passed
+    one call is let through to probe the engine, closing the breaker
+    again if it gets an answer.
+    '''
+
+    def __init__(self, threshold=3, cooldown=5.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None  # when the breaker last opened
+        self.probing = False
+        self.lock = threading.Lock()
+
+
+    def Allow (self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.probing or time.monotonic() - self.opened < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+
+    def Success (self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+
+    def Failure (self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.threshold:
+                self.opened = time.monotonic()
+
+
+    def Release (self):
+        # A call ended without telling whether the engine is there,
+        # e.g. on a reply that couldn't be read; if it was the probe,
+        # the next call after the cooldown probes again.
+        with self.lock:
+            self.probing = False
+
+
+    def RetryIn (self):
+        # Seconds until a call may go through again, 0 if it may now.
+        with self.lock:
+            if self.opened is None:
+                return 0.0
+            return max(0.0, self.opened + self.cooldown - time.monotonic())
+
+
+_trBreakers = {}
+
+def trCircuitBreaker (host, port):
+    '''
+    The circuit breaker shared by all clients of the engine at host:port.
+    '''
+    key = "{}:{}".format(host, port)
+    with _trEnginePoolsLock:
+        breaker = _trBreakers.get(key)
+        if breaker is None:
+            breaker = TrCircuitBreaker()
+            _trBreakers[key] = breaker
+        return breaker
+
+
+_trEncodings = {}  # "host:port": the encoding the engine took, "" for none
+
+def trRequestEncoding (host, port, compress):
+    '''
+    The Content-Encoding to send large requests to host:port with,
+    for the 'compress' setting of the client; None for none.
+    '''
+    if compress == "auto":
+        return _trEncodings.get("{}:{}".format(host, port), "gzip") or None
+    if compress in ("gzip", "deflate"):
+        return compress
+    return None
+
+
+def trNoteEncoding (host, port, encoding):
+    # Remember whether the engine took an encoded request ('encoding'),
+    # or turned one down ("").
+    _trEncodings["{}:{}".format(host, port)] = encoding
+
+
+def encodeBody (body, encoding):
+    if encoding == "gzip":
+        return gzip.compress(body, 6, mtime=0)
+    if encoding == "deflate":
+        return zlib.compress(body, 6)
+    return body
+
+
+def spoolCompression ():
+    # The default compression of spools, $TRACTOR_SPOOL_COMPRESS.
+    return os.environ.get("TRACTOR_SPOOL_COMPRESS", "none")
+
+
+_trEnginePools = {}
+_trEnginePoolsLock = threading.Lock()
+
+def trConnectionPool (host, port, maxsize=4, idletime=30.0):
+    '''
+    Return the shared connection pool for the engine at host:port,
+    creating it on first use.
+    '''
+    key = "{}:{}".format(host, port)
+    with _trEnginePoolsLock:
+        pool = _trEnginePools.get(key)
+        if pool is None:
+            pool = TrConnectionPool(host, port, maxsize, idletime)
+            _trEnginePools[key] = pool
+        return pool
+
+
+def trCloseConnectionPools ():
+    '''
+    Dismantle all idle keep-alive sockets, e.g. when unregistering.
+    '''
+    with _trEnginePoolsLock:
+        pools = list(_trEnginePools.values())
+        _trEnginePools.clear()
+    for pool in pools:
+        pool.Close()
+
+## ------------------------------------------------------------- ##
+
+class TrHttpReply(object):
+    '''
+    One HTTP reply as read off a socket.  The body is kept as the
+    bytearray it was received into, so it can be handed to a JSON
+    decoder without another copy; text() decodes it exactly once.
+    '''
+
+    __slots__ = ("status", "header", "fields", "body", "reusable", "_text")
+
+    def __init__(self, status, header, fields, body, reusable):
+        self.status = status
+        self.header = header
+        self.fields = fields
+        self.body = body
+        self.reusable = reusable
+        self._text = None
+
+    def text (self):
+        if self._text is None:
+            self._text = self.body.decode("utf-8", "replace")
+        return self._text
+
+
+class TrHttpReader(object):
+    '''
+    Reads a single HTTP reply from a socket into one growable buffer,
+    honoring Content-Length and chunked transfer-encoding so that the
+    read stops as soon as the reply is complete.  Replies without any
+    framing are read until the peer closes the connection.
+    '''
+
+    recvsize = 65536
+
+    def __init__(self, s):
+        self.s = s
+        self.buf = bytearray()
+        self.pos = 0  # start of the unconsumed part of buf
+
+
+    def Read (self):
+        n = self.fill(b"\r\n\r\n")
+        if n < 0:
+            if self.buf:
+                raise EOFError("truncated http reply header")
+            return None
+
+        header = self.buf[:n].decode("iso-8859-1")
+        self.pos = n + 4
+
+        lines = header.split("\r\n")
+        status = lines[0].split(None, 2)
+        fields = {}
+        for line in lines[1:]:
+            k,c,v = line.partition(":")
+            fields[k.strip().lower()] = v.strip()
+
+        reusable = status[0] != "HTTP/1.0" and \
+                    fields.get("connection", "").lower() != "close"
+
+        if "chunked" in fields.get("transfer-encoding", "").lower():
+            body, complete = self.readChunked()
+        elif "content-length" in fields:
+            body, complete = self.readExact( int(fields["content-length"]) )
+        else:
+            body, complete = self.readToClose(), False
+
+        return TrHttpReply(int(status[1]), header, fields, body,
+                            reusable and complete)
+
+
+    def fill (self, delim):
+        # receive until 'delim' appears after pos, returns its offset
+        start = self.pos
+        while True:
+            n = self.buf.find(delim, start)
+            if n >= 0:
+                return n
+            start = max(self.pos, len(self.buf) - len(delim) + 1)
+            r = self.s.recv(self.recvsize)
+            if not r:
+                return -1
+            self.buf += r
+
+
+    def readExact (self, length):
+        # the body is received straight into its final buffer
+        body = bytearray(length)
+        view = memoryview(body)
+        got = min(length, len(self.buf) - self.pos)
+        view[:got] = self.buf[self.pos:self.pos+got]
+        self.buf = bytearray()
+        self.pos = 0
+
+        while got < length:
+            k = self.s.recv_into(view[got:], min(self.recvsize, length - got))
+            if not k:
+                break
+            got += k
+
+        view.release()
+        if got < length:
+            del body[got:]
+            return (body, False)
+        return (body, True)
+
+
+    def readChunked (self):
+        body = bytearray()
+        while True:
+            n = self.fill(b"\r\n")
+            if n < 0:
+                return (body, False)
+            size = int(self.buf[self.pos:n].split(b";")[0], 16)
+            self.pos = n + 2
+
+            if size == 0:
+                # skip any trailer fields up to the final blank line
+                while True:
+                    n = self.fill(b"\r\n")
+                    if n < 0:
+                        return (body, False)
+                    blank = (n == self.pos)
+                    self.pos = n + 2
+                    if blank:
+                        return (body, True)
+
+            while len(self.buf) - self.pos < size + 2:
+                r = self.s.recv(self.recvsize)
+                if not r:
+                    body += self.buf[self.pos:]
+                    return (body, False)
+                self.buf += r
+
+            body += self.buf[self.pos:self.pos+size]
+            self.pos += size + 2
+
+            # drop consumed bytes now and then rather than on each chunk
+            if self.pos > self.recvsize:
+                del self.buf[:self.pos]
+                self.pos = 0
+
+
+    def readToClose (self):
+        body = self.buf[self.pos:]
+        while True:
+            r = self.s.recv(self.recvsize)
+            if not r:
+                return body
+            body += r
+
 ## ------------------------------------------------------------- ##
 
 class TrHttpRPC(object):
 
-    def __init__(self, host, port=80, logger=None, apphdrs={}):
+    def __init__(self, host, port=80, logger=None, apphdrs={},
+                    keepalive=False, timeout=30.0, login=False,
+                    retries=0, backoff=0.5, maxbackoff=8.0, compress=None):
         self.host = host
         self.port = port
         self.logger = logger
         self.appheaders = apphdrs
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.session = None
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.compress = compress
 
         if port <= 0:
             h,c,p = host.partition(':')
@@ -42,6 +465,12 @@ class TrHttpRPC(object):
                 self.host = h
                 self.port = int(p)
 
+        # transactions carry the tsid of the shared login session, of
+        # the user named by 'login' if it is a string
+        if login:
+            user = login if isinstance(login, str) else None
+            self.session = trSession(self.host, self.port, user)
+
         # embrace and extend errno values
         if not hasattr(errno, "WSAECONNRESET"):
             errno.WSAECONNRESET = 10054
@@ -50,75 +479,260 @@ class TrHttpRPC(object):
 
 
     def Transaction (self, tractorverb, formdata, parseCtxName=None,
-                        xheaders={}, analyzer=None):
+                        xheaders={}, analyzer=None, rawbody=False):
         """
         Make an HTTP request and retrieve the reply from the server.
         An implementation using a few high-level methods from the
         urllib2 module is also possible, however it is many times
         slower than this implementation, and pulls in modules that
         are not always available (e.g. when running in maya's python).
+
+        When 'keepalive' is set the request is sent as HTTP/1.1 over a
+        socket from the shared per-engine pool, and the socket goes
+        back to the pool once the reply has been read.  Otherwise each
+        call uses its own HTTP/1.0 socket.
+
+        With 'rawbody' a successful reply's body is returned as the
+        undecoded bytearray it was received into.
+
+        With a login 'session' the request carries its tsid, logging
+        in on first use; a tsid the engine turns down is renewed and
+        the request sent again, once.
+
+        A request that failed on the network, or that the engine
+        answered with 502-504, is sent again up to 'retries' times,
+        with a jittered, doubling delay; see plainTransaction for which
+        requests are safe to resend.
+
+        Request bodies of COMPRESS_MINSIZE bytes or more are sent gzip
+        or deflate encoded when 'compress' says so.  With "auto" they
+        are gzipped until the engine turns one down (see
+        ENCODING_REFUSED): that request is sent again as it is, and so
+        are all later ones to the engine.
         """
+        if not self.session:
+            return self.plainTransaction(tractorverb, formdata, parseCtxName,
+                                            xheaders, analyzer, rawbody)
+
+        stale = None
+        for attempt in range(2):
+            errcode, tsid = self.session.Tsid(self, stale)
+            if errcode:
+                return (errcode, tsid)
+
+            errcode, outdata = self.plainTransaction(
+                                    sessionVerb(tractorverb, tsid), formdata,
+                                    parseCtxName, xheaders, analyzer, rawbody)
+            if errcode not in (401, 403):
+                break
+            stale = tsid
+
+        return (errcode, outdata)
+
+
+    def plainTransaction (self, tractorverb, formdata, parseCtxName=None,
+                            xheaders={}, analyzer=None, rawbody=False):
+        '''
+        Transaction without any session handling.  Requests that only
+        read engine state, spools carrying a spool token (see
+        SPOOL_TOKEN_HEADER), and requests that never got through
+        because the connection was refused are retried; others are
+        sent once.  While the engine's circuit breaker is open calls
+        fail at once, retries left or not.
+        '''
+        breaker = trCircuitBreaker(self.host, self.port)
+        resendable = isResendable(tractorverb, formdata, xheaders)
+        encoding = self.requestEncoding(formdata)
+
+        attempt = 0
+        while True:
+            if breaker.Allow():
+                errcode, outdata, failed = self.attemptTransaction(tractorverb,
+                            formdata, parseCtxName, xheaders, analyzer, rawbody, encoding)
+                if encoding and errcode in ENCODING_REFUSED and self.compress == "auto":
+                    # the engine didn't take it, so nothing was done
+                    self.Debug("{} refused {} request: {}".format(self.host, encoding, outdata))
+                    trNoteEncoding(self.host, self.port, "")
+                    encoding = None
+                    errcode, outdata, failed = self.attemptTransaction(tractorverb,
+                                formdata, parseCtxName, xheaders, analyzer, rawbody)
+                elif encoding and errcode == 0:
+                    trNoteEncoding(self.host, self.port, encoding)
+                if failed:
+                    breaker.Failure()
+                elif failed is None:
+                    breaker.Release()
+                else:
+                    breaker.Success()
+                retry = failed and (resendable or errcode in (errno.ECONNREFUSED,
+                                                              errno.WSAECONNREFUSED))
+            else:
+                return (errno.ECONNREFUSED,
+                        "engine {}:{} is not answering, not trying again for {:.0f}s".format(
+                        self.host, self.port, breaker.RetryIn()))
+
+            if not retry or attempt >= self.retries:
+                return (errcode, outdata)
+
+            attempt += 1
+            delay = min(self.maxbackoff, self.backoff * (2 ** (attempt - 1)))
+            delay = delay * random.uniform(0.5, 1.0)
+            self.Debug("retrying {} in {:.1f}s: {}".format(tractorverb, delay, outdata))
+            time.sleep(delay)
+
+
+    def attemptTransaction (self, tractorverb, formdata, parseCtxName=None,
+                            xheaders={}, analyzer=None, rawbody=False,
+                            encoding=None):
+        '''
+        One try at a transaction, returns (errcode, outdata, failed)
+        where 'failed' tells whether the engine (or the network to it)
+        let us down, True, or not, False; None if that is unknown.
+        '''
+        try:
+            req = self.formatRequest(tractorverb, formdata, xheaders, encoding)
+
+            if self.keepalive:
+                reply = self.keepaliveExchange(req)
+            else:
+                reply = self.oneshotExchange(req)
+
+            errcode, outdata = self.replyResult(reply, parseCtxName,
+                                                analyzer, rawbody)
+            failed = reply is None or errcode in (502, 503, 504)
+
+        except (OSError, EOFError) as e:
+            errcode, outdata = self.errorResult(e)
+            failed = True
+
+        except Exception as e:
+            errcode, outdata = self.errorResult(e)
+            failed = None
+
+        return (errcode, outdata, failed)
+
+
+    def replyResult (self, reply, parseCtxName=None, analyzer=None,
+                        rawbody=False):
+        '''
+        Turn a TrHttpReply into the (errcode, outdata) pair returned
+        by Transaction.
+        '''
         outdata = None
         errcode = 0
-        s = None
 
-        try:
-            # like:  http://tractor-engine:80/Tractor/task?q=nextcmd&...
-            t = "/Tractor/{}".format(tractorverb)
+        if reply:
+            errcode = reply.status
+
+            if errcode == 200:
+                errcode = 0
+
+                # expecting a json dict?  parse it
+                if reply.body and parseCtxName:
+                    try:
+                        outdata = self.parseJSON(reply.body)
+
+                    except Exception:
+                        errcode = -1
+                        self.Debug("json parse:\n {}".format(reply.text()))
+                        outdata = "parse {}: {}".format(parseCtxName, self.Xmsg())
+
+                elif rawbody:
+                    outdata = reply.body
+
+            if outdata is None:
+                outdata = reply.text().strip()  # body, or error msg, no CRLF
+
+            if analyzer:
+                analyzer( reply.header )
+
+        else:
+            outdata = "no data received"
+            errcode = -1
+
+        return (errcode, outdata)
+
+
+    def errorResult (self, e):
+        '''
+        Map an exception raised during a transaction to (errcode, outdata).
+        '''
+        self.Debug("http transaction: {}".format(e))
+
+        if e.args and e.args[0] in (errno.ECONNREFUSED, errno.WSAECONNREFUSED):
+            outdata = "connection refused"
+            errcode = e.args[0]
+        elif e.args and e.args[0] in (errno.ECONNRESET, errno.WSAECONNRESET):
+            outdata = "connection dropped"
+            errcode = e.args[0]
+        elif isinstance(e, socket.timeout):
+            outdata = "http transaction: time-out waiting for the engine"
+            errcode = errno.ETIMEDOUT
+        elif isinstance(e, OSError) and e.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH,
+                                                    errno.ETIMEDOUT):
+            outdata = "http transaction: {}".format(e.strerror)
+            errcode = e.errno
+        else:
+            errcode = -1
+            outdata = "http transaction: {} ".format(self.Xmsg())
+
+        return (errcode, outdata)
+
+
+    def requestEncoding (self, formdata):
+        # The Content-Encoding to send 'formdata' with, or None.
+        if not formdata or len(formdata) < COMPRESS_MINSIZE:
+            return None
+        return trRequestEncoding(self.host, self.port, self.compress)
+
+
+    def formatRequest (self, tractorverb, formdata, xheaders, encoding=None):
+        # like:  http://tractor-engine:80/Tractor/task?q=nextcmd&...
+        t = "/Tractor/{}".format(tractorverb)
 
-            # we use POST when making changes to the destination (REST)
+        # we use POST when making changes to the destination (REST)
+        if self.keepalive:
+            req = "POST {} HTTP/1.1\r\n".format(t)
+            req += "Host: {}:{}\r\n".format(self.host, self.port)
+            req += "Connection: keep-alive\r\n"
+        else:
             req = "POST {} HTTP/1.0\r\n".format(t)
-            for h in self.appheaders:
-                req = "{} : {} \r\n".format(h,self.appheaders[h])
-            for h in xheaders:
-                req = "{}: {} \r\n".format(h,xheaders[h])
-
-            if formdata:
-                t = formdata.strip()
-                print("This is t inside req1 if formdata: {}".format(t))
-                #req += "Content-Type: application/x-www-form-urlencoded\r\n"
-                #req += "Content-Length: %d\r\n" % len(t)
-                #req += "\r\n"  # end of http headers
-                #req += t
-                req = "{}Content-Type: application/x-www-form-urlencoded \r\n".format(req) 
-                req = "{}Content-Length:{}".format(req,len(t))
-                req = "{}\r\n".format(req)
-                #convert to byte? python3
-                req = "{} {}".format(req,t)
-                req = b"%b" % (bytes(req, encoding="ascii"))
-                #print("This is req: {}".format(req))
-                        
-            else:
-                req = "{}\r\n".format(req)  # end of http headers
-                req = b"%b" % (bytes(req, encoding="ascii"))
-            # error checking?  why be a pessimist?
-            # that's why we have exceptions
-
-            #socket starts a program 
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                #s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                #s.setblocking(0)
-                s.connect( (self.host, self.port) )
-                #encoding the string before sending changes the string
-                s.sendall(req)
+        for h in self.appheaders:
+            req += "{}: {}\r\n".format(h, self.appheaders[h])
+        for h in xheaders:
+            req += "{}: {}\r\n".format(h, xheaders[h])
+
+        body = b""
+        if formdata:
+            body = formdata.strip().encode("utf-8")
+            if 'Content-Type' not in xheaders:
+                req += "Content-Type: application/x-www-form-urlencoded\r\n"
+            if encoding:
+                body = encodeBody(body, encoding)
+                req += "Content-Encoding: {}\r\n".format(encoding)
+        if formdata or self.keepalive:
+            req += "Content-Length: {}\r\n".format(len(body))
+
+        req += "\r\n"  # end of http headers
+        return req.encode("utf-8") + body
+
+
+    def oneshotExchange (self, req):
+        '''
+        The classic exchange: one socket per request.
+        '''
+        s = socket.create_connection( (self.host, self.port), self.timeout )
+        mustTimeWait = False
+        try:
+            s.sendall(req)
+            reply = TrHttpReader(s).Read()
 
-            mustTimeWait = False
-
-            t = ""  # build up the reply text
-            while True:
-                r,w,x = select.select([s], [], [], 30.0)
-                if r:
-                    if 0 == len(r):
-                        self.Debug("time-out waiting for http reply")
-                        mustTimeWait = True
-                        break
-                    else:
-                        r = s.recv(4096)
-                if not r:
-                    break
-                else:
-                    t = "{}{}".format(t,r)
+        except socket.timeout:
+            self.Debug("time-out waiting for http reply")
+            mustTimeWait = True
+            raise
 
+        finally:
             # Attempt to reduce descriptors held in TIME_WAIT on the
             # engine by dismantling this request socket immediately
             # if we've received an answer.  Usually the close() call
@@ -129,82 +743,77 @@ class TrHttpRPC(object):
             #
             if not mustTimeWait:
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
-            
             s.close()
 
-            print("This is t before weird if statement: {}".format(t))
-            if t and len(t):
-                n = t.find("\r\n\r\n")
-                
-                h = t[0:n] # headers
-                
-                n = "{}{}".format(n,4)
-                
-                outdata = t[n:].strip()  # body, or error msg, no CRLF
-                
-                n = h.find(' ') + 1
-                e = h.find(' ', n)
-                errcode = int( h[n:e] )
-
-                if errcode == 200:
-                    errcode = 0
-
-                    # expecting a json dict?  parse it
-                    if outdata and parseCtxName:
-                        try:
-                            outdata = self.parseJSON(outdata)
-
-                        except Exception:
-                            errcode = -1
-                            self.Debug("json parse:\n {}".format(outdata))
-                            outdata = "parse {}: {}".format(parseCtxName, self.Xmsg())
-
-                if analyzer:
-                    analyzer( h )
-
-            else:
-                outdata = "no data received"
-                errcode = -1
+        return reply
 
 
+    def keepaliveExchange (self, req):
+        '''
+        Send the request over a pooled socket and read exactly one
+        reply.  A stale pooled socket (closed by the engine while it
+        sat idle) is retried once on a fresh connection: that is when
+        sending fails, or the connection is reset or closed before any
+        of a reply came back.  A time-out waiting for the reply is not
+        retried, the engine may be working on the request.
+        '''
+        pool = trConnectionPool(self.host, self.port)
 
-        except Exception as e:
-            print("This is Exception as e: {}".format(e.args[0]))
-            
-            if e.args[0] in (errno.ECONNREFUSED, errno.WSAECONNREFUSED):
-                outdata = "connection refused"
-                errcode = e.args[0]
-            elif e.args[0] in (errno.ECONNRESET, errno.WSAECONNRESET):
-                outdata = "connection dropped"
-                errcode = e.args[0]
+        for attempt in (0, 1):
+            s, reused = pool.Acquire(self.timeout)
+            reader = None
+            try:
+                s.settimeout(self.timeout)
+                s.sendall(req)
+                reader = TrHttpReader(s)
+                reply = reader.Read()
+            except (OSError, EOFError) as e:
+                pool.Discard(s)
+                stale = reader is None or \
+                        (not reader.buf and not isinstance(e, socket.timeout))
+                if reused and attempt == 0 and stale:
+                    continue
+                raise
+
+            if not reply:
+                pool.Discard(s)
+                if reused and attempt == 0:
+                    continue
+                return None
+
+            if reply.reusable:
+                pool.Release(s)
             else:
-                errcode = -1
-                outdata = "http transaction: {} ".format(self.Xmsg())
-            
+                pool.Discard(s)
+            return reply
 
-        return (errcode, outdata)
+        return None
 
 
-    def parseJSON(self, json):
-        #
-        # A simpleminded "converter" from inbound json to python dicts.
-        #
-        # Expect a JSON object, which of course also happens to be the
-        # same format as a python dictionary:
-        #  { "user": "yoda", "jid": 123, ..., "cmdline": "prman ..." }
+    def parseJSON(self, data):
         #
-        # NOTE: python eval() will *fail* on strings ending in CRLF (\r\n),
-        # they must be stripped!  (by our caller, if necessary)
+        # Decode an inbound json reply (str or the raw reply bytes) into
+        # python objects.  This used to eval() the reply, which was slow
+        # on large replies and would run anything the peer sent us; see
+        # trjson for the decoder actually used.
         #
-        # We add local variables to stand in for the three JSON
-        # "native" types that aren't available in python, however
-        # these types aren't expected to appear in tractor data.
-        #
-        null = None
-        true = True
-        false = False
+        return trjson.loads( data )
+
+
+    def TransactionItems (self, tractorverb, formdata, key=None,
+                            xheaders={}):
+        '''
+        Like Transaction, but for replies holding one very large array,
+        e.g. the "jobs" of a jobs query.  On success the outdata is a
+        generator of the array elements (of the member named 'key'),
+        decoded one by one from the raw reply body.
+        '''
+        errcode, outdata = self.Transaction(tractorverb, formdata, None,
+                                            xheaders, rawbody=True)
+        if errcode == 0:
+            outdata = trjson.iterArray(outdata, key)
 
-        return eval( json )
+        return (errcode, outdata)
 
 
     def Debug (self, txt):
@@ -220,9 +829,129 @@ class TrHttpRPC(object):
 
 ## --------------------------------------------------- ##
 
-def Spool (argv):
+class TrSession(object):
     '''
-    tractor-spool - main - examine options, connect to engine, transfer job
+    A login session (tsid) on one engine, shared by every TrHttpRPC
+    talking to it for the same user, so only the first transaction,
+    and the first after the engine expires the session, pays for the
+    login round trip.
+    '''
+
+    def __init__(self, host, port, user, passwd=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.tsid = None
+        self.lock = threading.Lock()
+
+
+    def Tsid (self, rpc, stale=None):
+        '''
+        The session's tsid, logging in through 'rpc' if there is none
+        yet or it is the 'stale' one the engine turned down.  Returns
+        (errcode, tsid or error message).
+        '''
+        with self.lock:
+            if self.tsid is None or self.tsid == stale:
+                self.tsid = None
+                errcode, outdata = rpc.plainTransaction("monitor",
+                                        self.loginForm(), "login")
+                if errcode:
+                    return (errcode, "login: {}".format(outdata))
+                tsid = outdata.get("tsid") if isinstance(outdata, dict) else None
+                if not tsid:
+                    return (-1, "login: no tsid in reply: {}".format(outdata))
+                self.tsid = tsid
+
+            return (0, self.tsid)
+
+
+    def Logout (self, rpc):
+        with self.lock:
+            if self.tsid:
+                rpc.plainTransaction("monitor", "q=logout&user={}&tsid={}".format(
+                                        urlQuote(self.user), urlQuote(self.tsid)))
+                self.tsid = None
+
+
+    def loginForm (self):
+        form = "q=login&user={}".format(urlQuote(self.user))
+        if self.passwd:
+            form += "&c={}".format(urlQuote(self.passwd))
+        return form
+
+
+def sessionVerb (tractorverb, tsid):
+    # The verb, with its query string if any, extended by the tsid.
+    sep = "&" if "?" in tractorverb else "?"
+    return "{}{}tsid={}".format(tractorverb, sep, urlQuote(tsid))
+
+
+def urlQuote (s):
+    return urllib.parse.quote(str(s), safe="")
+
+
+def isResendable (tractorverb, formdata, xheaders):
+    '''
+    Whether a request may be sent again after a failure that could have
+    come once the engine had it: spools carrying a spool token, and
+    requests whose every q= operation (in the verb's query string or
+    the form) leaves engine state alone.
+    '''
+    if SPOOL_TOKEN_HEADER in xheaders:
+        return True
+    verb, _, query = tractorverb.partition("?")
+    if verb in IDEMPOTENT_VERBS:
+        return True
+    if verb not in ("monitor", "queries"):
+        return False
+    if isinstance(formdata, bytes):
+        formdata = formdata.decode("utf-8", "replace")
+    ops = urllib.parse.parse_qs("&".join((query, formdata or ""))).get("q", [])
+    return bool(ops) and all(op in IDEMPOTENT_QUERIES for op in ops)
+
+
+_trSessions = {}
+_trSessionsLock = threading.Lock()
+
+def trSession (host, port, user=None, passwd=None):
+    '''
+    The shared login session on the engine at host:port, for 'user'
+    (default $TRACTOR_USER, or the login name) with 'passwd' (default
+    $TRACTOR_PASSWORD, if the site needs one).  The session lives on
+    until trLogoutSessions, e.g. across dispatches in one Blender.
+    '''
+    if not user:
+        user = os.environ.get("TRACTOR_USER") or getpass.getuser()
+    if passwd is None:
+        passwd = os.environ.get("TRACTOR_PASSWORD")
+
+    key = "{}:{}:{}".format(host, port, user)
+    with _trSessionsLock:
+        session = _trSessions.get(key)
+        if session is None:
+            session = TrSession(host, port, user, passwd)
+            _trSessions[key] = session
+        return session
+
+
+def trLogoutSessions ():
+    '''
+    Log out of every engine logged in to, e.g. when unregistering.
+    '''
+    with _trSessionsLock:
+        sessions = list(_trSessions.values())
+        _trSessions.clear()
+    for session in sessions:
+        session.Logout(TrHttpRPC(session.host, session.port, timeout=5.0))
+
+## --------------------------------------------------- ##
+
+def spoolOptionParser ():
+    '''
+    The tractor-spool command line parser, also used to build the
+    options handed to jobSpool when spooling from inside Blender.
     '''
 
     appName =        "tractor-spool"
@@ -246,7 +975,9 @@ def Spool (argv):
     optparser = optparse.OptionParser(version=appBuild,
                                       usage="%prog [options] JOBFILE...\n"
                                         "%prog [options] --rib RIBFILE...\n"
-                                        "%prog [options] --jdelete JOB_ID" )
+                                        "%prog [options] --jdelete JOB_ID\n"
+                                        "%prog [options] --jctl OPERATION [--jvalue VALUE] "
+                                        "[--jfilter FILTER] [JOB_ID...]" )
 
     optparser.add_option("--priority", dest="priority",
             type="float", default=1.0,
@@ -301,7 +1032,24 @@ def Spool (argv):
 
     optparser.add_option("--jdelete", dest="jdel_id",
             type="string", default=None,
-            help="delete the requested job from the queue")
+            help="delete the requested job (or comma separated jobs) "
+                 "from the queue")
+
+    optparser.add_option("--jctl", dest="jctl",
+            type="choice", choices=sorted(JOB_OPERATIONS), default=None,
+            help="apply a job control operation, one of: " +
+                 ", ".join(sorted(JOB_OPERATIONS)) + ", to the JOB_IDs "
+                 "given as arguments and/or the jobs matching --jfilter")
+
+    optparser.add_option("--jfilter", dest="jfilter",
+            type="string", default=None,
+            help="with --jctl, also act on the jobs matching this "
+                 "query filter, e.g. \"owner=ragnar and not done\"")
+
+    optparser.add_option("--jvalue", dest="jvalue",
+            type="string", default=None,
+            help="the value for --jctl operations that need one, e.g. "
+                 "the new priority")
 
     optparser.set_defaults(loglevel=1)
     optparser.add_option("-v",
@@ -315,12 +1063,57 @@ def Spool (argv):
             action="store_true", default=False,
             help="submit job in paused mode")
 
+    optparser.add_option("--nokeepalive", dest="keepalive",
+            action="store_false", default=True,
+            help="open a new connection for every request rather than "
+                 "reusing pooled HTTP/1.1 keep-alive connections")
+
+    optparser.add_option("--retries", dest="retries",
+            type="int", default=3,
+            help="times a request is sent again after a network failure "
+                 "or while the engine is restarting, with a growing "
+                 "delay; spools are only resent as the same job")
+
+    optparser.add_option("--compress", dest="compress",
+            type="choice", choices=("none", "gzip", "deflate", "auto"),
+            default=spoolCompression(),
+            help="send large job scripts gzip or deflate compressed; "
+                 "'auto' gzips them unless the engine turns that down. "
+                 "Default $TRACTOR_SPOOL_COMPRESS, or none")
+
+    optparser.add_option("--outbox", dest="outbox",
+            action="store_true", default=False,
+            help="when the engine can't be reached, keep the job in the "
+                 "local outbox and spool it once the engine is back")
+
+    optparser.add_option("--concurrency", dest="concurrency",
+            type="int", default=8,
+            help="maximum number of job files spooled at the same time "
+                 "when several are given; 1 spools them one by one")
+
+    return optparser
+
+
+def Spool (argv):
+    '''
+    tractor-spool - main - examine options, connect to engine, transfer job
+    '''
+
+    optparser = spoolOptionParser()
+    defaultMtd = optparser.defaults["mtdhost"]
+    appBuild = optparser.version
+
     rc = 0
     xcpt = None
 
     try:
         options, jobfiles = optparser.parse_args( argv )
 
+        if options.mtdhost != defaultMtd:
+            h,n,p = options.mtdhost.partition(":")
+            if not p:
+                options.mtdhost = h + ':80'
+
         if options.jdel_id:
             if len(jobfiles) > 0:
                 optparser.error("too many arguments for jdelete")
@@ -328,6 +1121,9 @@ def Spool (argv):
             else:
                 return jobDelete(options)
 
+        if options.jctl:
+            return jobControlMain(options.jctl, jobfiles, options)
+
         if 0 == len(jobfiles):
             optparser.error("no job script specified")
             return 1
@@ -335,11 +1131,6 @@ def Spool (argv):
         if options.loglevel > 1:
             print("{} {} Copyright (c) 2007-%d Pixar. All rights reserved.".format(appBuild, datetime.datetime.now().year))
 
-        if options.mtdhost != defaultMtd:
-            h,n,p = options.mtdhost.partition(":")
-            if not p:
-                options.mtdhost = h + ':80'
-
         # paused starting is represented by a negative priority
         # decremented by one. This allows a zero priority to pause
         if options.paused:
@@ -361,6 +1152,14 @@ def Spool (argv):
             rc = createRibRenderJob(jobfiles, options)
             if rc == 0:
                 rc, xcpt = jobSpool(jobfiles[0], options)
+        elif len(jobfiles) > 1 and options.concurrency > 1:
+            from . import trasync
+            results = trasync.runSync( trasync.jobSpoolAll(jobfiles, options) )
+            for filename, (err, reply) in zip(jobfiles, results):
+                if options.loglevel > 0:
+                    print("{}: {}".format(filename, reply))
+                if err and not rc:
+                    rc, xcpt = err, reply
         else:
             for filename in jobfiles:
                 rc, xcpt = jobSpool(filename, options)
@@ -380,7 +1179,7 @@ def Spool (argv):
         rc = 1
 
     if xcpt:
-        print(sys.stderr,xcpt)
+        print(xcpt, file=sys.stderr)
 
     print("SPOOLED!!")
     return rc
@@ -398,12 +1197,30 @@ def trAbsPath (path):
 
 ## ------------------------------------------------------------- ##
 
-def jobSpool (jobfile, options):
+def jobSpool (jobfile, options, alfdata=None):
     '''
     Transfer the given job (alfred script) to the central job queue.
+    When the script text is at hand already it is passed as 'alfdata'
+    and the jobfile isn't read (it needn't even exist).
     '''
 
-    if options.ribspool:
+    alfdata, hdrs = jobSpoolRequest(jobfile, options, alfdata)
+
+    keepalive = getattr(options, "keepalive", True)
+    retries = getattr(options, "retries", 0)
+    compress = getattr(options, "compress", None)
+    errcode, reply = TrHttpRPC(options.mtdhost,0,keepalive=keepalive,retries=retries,compress=compress).Transaction("spool",alfdata,None,hdrs)
+    return spoolOrQueue(errcode, reply, jobfile, options, alfdata, hdrs)
+
+
+def jobSpoolRequest (jobfile, options, alfdata=None):
+    '''
+    Returns the (alfred text, http headers) making up a spool request.
+    '''
+
+    if alfdata is not None:
+        pass
+    elif options.ribspool:
         alfdata = options.ribjobtxt
     else:
         # usual case, read the alfred jobfile
@@ -417,23 +1234,160 @@ def jobSpool (jobfile, options):
         'X-Tractor-Spoolhost':  options.hname,
         'X-Tractor-Dir':        "/", #options.jobcwd, HACK
         'X-Tractor-Jobfile':    trAbsPath(jobfile),
-        'X-Tractor-Priority':   str(options.priority)
+        'X-Tractor-Priority':   str(options.priority),
+        SPOOL_TOKEN_HEADER:     uuid.uuid4().hex
     }
 
-    return TrHttpRPC(options.mtdhost,0).Transaction("spool",alfdata,None,hdrs)
+    return (alfdata, hdrs)
+
+
+def engineUnavailable (errcode):
+    return errcode in ENGINE_UNAVAILABLE
+
+
+def spoolOrQueue (errcode, reply, jobfile, options, alfdata, hdrs):
+    '''
+    The result of a spool, unless it failed because the engine isn't
+    available and --outbox is set: then the request goes in the local
+    outbox to be sent later, and the result is (0, reply) with the
+    entry's id in reply["queued"].
+    '''
+    if not (errcode and engineUnavailable(errcode) and getattr(options, "outbox", False)):
+        return (errcode, reply)
+
+    from . outbox import trOutbox, trOutboxDrainer
+    id = trOutbox().Put(options.mtdhost, trAbsPath(jobfile), alfdata, hdrs,
+                        os.path.basename(jobfile))
+    drainer = trOutboxDrainer(start=False)
+    if drainer:
+        drainer.Kick()
+    return (0, {"rc": 0, "queued": id,
+                "msg": "engine unavailable ({}), job queued in the outbox as entry {}".format(reply, id)})
+
+
+def spoolReplyJid (reply):
+    '''
+    Pick the new job id out of the engine's reply to a spool request,
+    or None if it isn't there.
+    '''
+    if isinstance(reply, dict):
+        jid = reply.get("jid")
+        return int(jid) if jid else None
+
+    m = re.search(r"\bjid\W*(\d+)", str(reply))
+    return int(m.group(1)) if m else None
 
 ## ------------------------------------------------------------- ##
 
-def register():
-    bpy.utils.register_class(TrHttpRPC)
+# job control operations, as the engine's "queries" form for one job;
+# {value} is the operation's argument, e.g. the new priority
+JOB_OPERATIONS = {
+    "delete":   "q=jdelete&jid={jid}",
+    "pause":    "q=jattr&jid={jid}&set_pause=1",
+    "resume":   "q=jattr&jid={jid}&set_pause=0",
+    "priority": "q=jattr&jid={jid}&set_priority={value}",
+    "restart":  "q=jrestart&jid={jid}",
+    "retry":    "q=jretryerrs&jid={jid}",
+}
 
 
-def unregister():
-    bpy.utils.unregister_class(TrHttpRPC)
+def jobControlForm (op, jid, value=None):
+    '''
+    The form data asking the engine to apply 'op' to job 'jid'.
+    '''
+    if op not in JOB_OPERATIONS:
+        raise ValueError("unknown job operation '{}', one of: {}".format(
+                            op, ", ".join(sorted(JOB_OPERATIONS))))
+    if "{value}" in JOB_OPERATIONS[op] and value is None:
+        raise ValueError("job operation '{}' needs a value".format(op))
+    return JOB_OPERATIONS[op].format(jid=int(jid), value=urlQuote(value))
+
+
+def jobSelect (jobfilter, options):
+    '''
+    The ids of the jobs matching the engine query filter expression
+    'jobfilter', e.g. "owner=ragnar and not done".  Returns (errcode,
+    list of jids or error message).
+    '''
+    rpc = TrHttpRPC(options.mtdhost, 0, keepalive=True, login=options.uname,
+                    retries=getattr(options, "retries", 0))
+    form = "q=jobs&columns=jid&filter={}".format(urlQuote(jobfilter))
+    errcode, outdata = rpc.TransactionItems("queries", form, "data")
+    if errcode:
+        return (errcode, outdata)
+    try:
+        return (0, [int(row["jid"]) for row in outdata])
+    except (ValueError, KeyError, TypeError) as e:
+        return (-1, "job select: {}".format(e))
 
 
-if __name__ == "__main__":
-    register()
+def jobControl (op, jids, options, value=None):
+    '''
+    Apply the job operation 'op' (see JOB_OPERATIONS) to every job in
+    'jids'.  With options.concurrency above one the requests go out
+    that many at a time over pooled keep-alive connections, otherwise
+    one after another over a single one.  Returns one (jid, errcode,
+    outdata) per job, in the order given.
+    '''
+    forms = [jobControlForm(op, jid, value) for jid in jids]
+
+    if len(jids) > 1 and getattr(options, "concurrency", 1) > 1:
+        from . import trasync
+        return trasync.runSync( trasync.jobControlAll(jids, forms, options) )
+
+    rpc = TrHttpRPC(options.mtdhost, 0, keepalive=True, login=options.uname,
+                    retries=getattr(options, "retries", 0))
+    results = []
+    for jid, form in zip(jids, forms):
+        errcode, outdata = rpc.Transaction("queries", form, "jobcontrol")
+        results.append( (jid, errcode, outdata) )
+    return results
+
+
+def jobControlMain (op, jidargs, options):
+    '''
+    The job control verbs of Spool: apply 'op' to the jobs named by
+    id in 'jidargs' (whitespace or comma separated) and to those
+    matching options.jfilter, printing a line per job.
+    '''
+    jids = [int(j) for a in jidargs for j in a.replace(",", " ").split()]
+
+    if options.jfilter:
+        errcode, selected = jobSelect(options.jfilter, options)
+        if errcode:
+            print("job select: {}".format(selected), file=sys.stderr)
+            return errcode
+        jids += [j for j in selected if j not in jids]
+
+    if not jids:
+        print("{}: no jobs selected".format(op), file=sys.stderr)
+        return 1
+
+    rc = 0
+    for jid, errcode, outdata in jobControl(op, jids, options, options.jvalue):
+        if errcode:
+            rc = errcode
+        if errcode or options.loglevel > 0:
+            msg = outdata.get("msg", outdata) if isinstance(outdata, dict) else outdata
+            print("{} {}: {}".format(op, jid, msg or ("ok" if not errcode else "failed")))
+    return rc
+
+
+def jobDelete (options):
+    '''
+    --jdelete: delete the job(s) given as comma separated ids.
+    '''
+    return jobControlMain("delete", [options.jdel_id], options)
+
+## ------------------------------------------------------------- ##
+
+def register():
+    pass
+
+
+def unregister():
+    trLogoutSessions()
+    trCloseConnectionPools()
 
 
 
@@ -0,0 +1,112 @@
+'''
+The bake stage of jobs, alone and in batches.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import importlib
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+alfred = importlib.import_module(os.path.basename(ROOT) + ".alfred")
+
+
+def settings(**kwargs):
+    job = dict(alfred.JOB_DEFAULTS)
+    job.update(title="shot", blendfull="/spool/shot.blend", frame_start=1, frame_end=4,
+               bakescript="/farm/.tractor/tractor_bake.py", scratchdir="/farm/.tractor/scratch/shot_1")
+    job.update(kwargs)
+    return job
+
+
+def commands(task):
+    for c in task.cmds:
+        yield c.argv
+    for t in task.subtasks:
+        for argv in commands(t):
+            yield argv
+
+
+def argument(argv, flag):
+    return argv[argv.index(flag) + 1]
+
+
+class BakeTest(unittest.TestCase):
+
+    def testSingleJob(self):
+        job = settings(bakeobjects=["Cloth", "Smoke"])
+        root = alfred.buildJob(job)
+        bake, render = root.subtasks
+        self.assertEqual(bake.title, "Bake Simulations")
+        self.assertTrue(bake.serialsubtasks)
+        caches, save = bake.subtasks
+        self.assertEqual([t.title for t in caches.subtasks], ["Bake Cloth", "Bake Smoke"])
+
+        baked, bakedir = alfred.bakedPaths(job)
+        self.assertEqual(baked, "/farm/.tractor/scratch/shot_1/shot_baked.blend")
+        self.assertEqual(bakedir, "/farm/.tractor/scratch/shot_1/shot_bake")
+        for argv in commands(caches):
+            self.assertEqual(argument(argv, "--bakedir"), bakedir)
+            self.assertEqual(argument(argv, "-y"), "/spool/shot.blend")
+        self.assertEqual(argument(save.cmds[0].argv, "--collect"), baked)
+        for argv in commands(render):
+            self.assertEqual(argument(argv, "-y"), baked)
+
+
+    def testNothingToBake(self):
+        root = alfred.buildJob(settings())
+        self.assertEqual([t.title for t in root.subtasks], ["Render Frames"])
+
+
+    def testJobsPerTarget(self):
+        # separate jobs, as the JOBS batch layout spools them, bake
+        # side by side and mustn't share files
+        jobs = [settings(scene="Main", viewlayer=vl, bakeobjects=["Cloth"]) for vl in ("Fg", "Bg")]
+        jobs.append(settings(scene="Alt", bakeobjects=["Cloth"]))
+        paths = [alfred.bakedPaths(j) for j in jobs]
+        self.assertEqual(len(set(p for pair in paths for p in pair)), 6)
+        for job, (baked, bakedir) in zip(jobs, paths):
+            bake, render = alfred.buildJob(job).subtasks
+            self.assertEqual(bake.title, "Bake Simulations")
+            for argv in commands(bake):
+                self.assertEqual(argument(argv, "--scene"), job['scene'])
+                self.assertEqual(argument(argv, "--bakedir"), bakedir)
+            for argv in commands(render):
+                self.assertEqual(argument(argv, "-y"), baked)
+
+
+    def testBatchBakesEachSceneOnce(self):
+        job = settings(scene="Main", bakeobjects=["Cloth"])
+        batch = [settings(scene="Main", viewlayer="Fg", target="Main / Fg", bakeobjects=["Cloth"]),
+                 settings(scene="Main", viewlayer="Bg", target="Main / Bg", bakeobjects=["Cloth"]),
+                 settings(scene="Alt", target="Alt", bakeobjects=["Rigid"]),
+                 settings(scene="Still", target="Still")]
+        bake, render = alfred.buildJob(job, batch).subtasks
+        self.assertEqual([t.title for t in bake.subtasks], ["Bake Main", "Bake Alt"])
+        self.assertFalse(bake.serialsubtasks)
+
+        main, alt = bake.subtasks
+        self.assertEqual(argument(main.subtasks[1].cmds[0].argv, "--collect"),
+                         "/farm/.tractor/scratch/shot_1/shot_Main_baked.blend")
+        self.assertEqual(main.subtasks[1].cmds[0].argv[-1], "Cloth")
+        self.assertEqual(alt.subtasks[1].cmds[0].argv[-1], "Rigid")
+
+        loads = [set(argument(argv, "-y") for argv in commands(t)) for t in render.subtasks]
+        self.assertEqual(loads, [{"/farm/.tractor/scratch/shot_1/shot_Main_baked.blend"}] * 2 +
+                                [{"/farm/.tractor/scratch/shot_1/shot_Alt_baked.blend"},
+                                 {"/spool/shot.blend"}])
+
+
+    def testTilesApart(self):
+        jobs = [settings(scene="Main", viewlayer=vl) for vl in ("Fg", "Bg")]
+        self.assertNotEqual(alfred.tileDir(jobs[0], 1), alfred.tileDir(jobs[1], 1))
+        self.assertEqual(alfred.tileDir(settings(), 7),
+                         "/farm/.tractor/scratch/shot_1/shot_tiles/frames/7")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+'''
+Render time logs, as blades write them, read back into chunks.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import tempfile
+import importlib
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+framehistory = importlib.import_module(os.path.basename(ROOT) + ".framehistory")
+
+
+class Layer(object):
+
+    def __init__(self, name, use):
+        self.name = name
+        self.use = use
+
+
+class Scene(dict):
+    # The little of a bpy Scene historyLog looks at.
+
+    def __init__(self, layers, **props):
+        dict.__init__(self, **props)
+        self.view_layers = layers
+
+
+class FrameHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.blend = os.path.join(self.tmp.name, "shot.blend")
+        os.makedirs(os.path.join(self.tmp.name, ".tractor"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def testRoundTrip(self):
+        path = framehistory.historyPath(self.blend, "Scene / Layer")
+        framehistory.appendRecord(path, "startup", "20.000")
+        for f in range(1, 11):
+            framehistory.appendRecord(path, "frame", f, "{:.3f}".format(100.0 if f < 6 else 400.0))
+        framehistory.appendRecord(path, "frame", 3, "200.000")
+        framehistory.appendRecord(path, "frame", 4)  # cut short
+
+        history = framehistory.FrameHistory(path)
+        self.assertEqual(history.startup, 20.0)
+        times = history.estimates(range(1, 13))
+        self.assertEqual(times[3], 150.0)
+        self.assertEqual(times[4], 100.0)
+        self.assertEqual(times[12], 400.0)  # never rendered, the median
+
+        chunks = list(framehistory.adaptiveChunks(range(1, 13), times, 500.0, history.startup))
+        self.assertEqual(chunks, [(1, 4), (5, 5), (6, 6), (7, 7), (8, 8), (9, 9), (10, 10), (11, 11), (12, 12)])
+
+
+    def testCompact(self):
+        path = framehistory.historyPath(self.blend)
+        for i in range(3):
+            framehistory.appendRecord(path, "frame", 1, "{:.3f}".format(10.0 * (i + 1)))
+        history = framehistory.FrameHistory(path)
+        history.compact()
+        again = framehistory.FrameHistory(path)
+        self.assertEqual(again.frames, history.frames)
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+
+    def testNothingRecorded(self):
+        history = framehistory.FrameHistory(framehistory.historyPath(self.blend))
+        self.assertIsNone(history.estimates(range(1, 5)))
+        self.assertIsNone(history.startup)
+
+
+    def testLayerLogs(self):
+        prop = framehistory.HISTORY_PROP
+        logs = {"A": "/logs/a.history", "B": "/logs/b.history"}
+        self.assertEqual(framehistory.historyLog(Scene([Layer("A", False), Layer("B", True)], **{prop: logs})),
+                         "/logs/b.history")
+        self.assertIsNone(framehistory.historyLog(Scene([Layer("A", True), Layer("B", True)], **{prop: logs})))
+        self.assertEqual(framehistory.historyLog(Scene([Layer("A", True)], **{prop: "/logs/s.history"})),
+                         "/logs/s.history")
+        self.assertIsNone(framehistory.historyLog(Scene([Layer("A", True)])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+'''
+Frames still to render, from what is in the output directories.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import tempfile
+import importlib
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+framescan = importlib.import_module(os.path.basename(ROOT) + ".framescan")
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 16
+
+
+class MissingFramesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.out = os.path.join(self.tmp.name, "render")
+        os.makedirs(self.out)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def expected(self, frames, directory=None):
+        return dict((f, os.path.join(directory or self.out, "shot_{:04d}.png".format(f))) for f in frames)
+
+
+    def write(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+    def testMissingEmptyAndPresent(self):
+        expected = self.expected(range(1, 6))
+        self.write(expected[1], PNG)
+        self.write(expected[2], b"")  # a failed blade's placeholder
+        self.write(expected[4], PNG)
+        self.assertEqual(framescan.missingFrames(expected), [2, 3, 5])
+
+
+    def testAllPresent(self):
+        expected = self.expected(range(1, 4))
+        for path in expected.values():
+            self.write(path, PNG)
+        self.assertEqual(framescan.missingFrames(expected), [])
+
+
+    def testNoOutputDirectory(self):
+        expected = self.expected(range(1, 4), os.path.join(self.tmp.name, "nowhere"))
+        self.assertEqual(framescan.missingFrames(expected), [1, 2, 3])
+
+
+    def testHeaderChecked(self):
+        expected = self.expected(range(1, 4))
+        self.write(expected[1], PNG)
+        self.write(expected[2], b"truncated garbage")
+        self.write(expected[3], PNG)
+        self.assertEqual(framescan.missingFrames(expected), [])
+        self.assertEqual(framescan.missingFrames(expected, checkheader=True), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+'''
+Outbox claiming with several drainers at once.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+import importlib
+import unittest
+from contextlib import closing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+outbox = importlib.import_module(os.path.basename(ROOT) + ".outbox")
+
+
+class ClaimTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "outbox.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def claimAll(self, claimers, entries, batch):
+        # Each claimer, with its own connection as a separate drainer
+        # would have, claims until nothing is left; returns the ids
+        # each one got.
+        box = outbox.Outbox(self.path)
+        ids = [box.Put("engine:80", "job{}.alf".format(i), "Job", {}) for i in range(entries)]
+
+        start = threading.Barrier(claimers)
+        got = [[] for _ in range(claimers)]
+
+        def claim(n):
+            mine = outbox.Outbox(self.path)
+            start.wait()
+            while True:
+                claimed = mine.Claim("engine:80", batch)
+                if not claimed:
+                    break
+                got[n].extend(entry[0] for entry in claimed)
+
+        threads = [threading.Thread(target=claim, args=(n,)) for n in range(claimers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return ids, got
+
+
+    def testConcurrentClaimsAreDisjoint(self):
+        for batch in (1, 7):
+            ids, got = self.claimAll(4, 200, batch)
+            claimed = [id for mine in got for id in mine]
+            self.assertEqual(len(claimed), len(set(claimed)), "an entry was claimed twice")
+            self.assertEqual(sorted(claimed), sorted(ids))
+            os.remove(self.path)
+
+
+    def testStaleClaimIsTakenOnce(self):
+        box = outbox.Outbox(self.path)
+        id = box.Put("engine:80", "job.alf", "Job", {})
+        self.assertEqual([e[0] for e in box.Claim("engine:80", 1)], [id])
+        self.assertEqual(box.Claim("engine:80", 1), [])
+
+        # the claim times out; two drainers go for it at once
+        with closing(box.connect()) as db, db:
+            db.execute("UPDATE outbox SET claimed = claimed - ?", (box.claimtime + 1,))
+        first, second = outbox.Outbox(self.path), outbox.Outbox(self.path)
+        self.assertEqual([e[0] for e in first.Claim("engine:80", 1)], [id])
+        self.assertEqual(second.Claim("engine:80", 1), [])
+
+
+class HousekeepingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "outbox.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def testConnectionsClosed(self):
+        box = outbox.Outbox(self.path)
+        opened = []
+        connect = box.connect
+        def tracked():
+            db = connect()
+            opened.append(db)
+            return db
+        box.connect = tracked
+
+        id = box.Put("engine:80", "job.alf", "Job", {})
+        box.Claim("engine:80", 1)
+        box.Done(id, 12)
+        box.Entry(id)
+        box.Engines()
+        box.Entries()
+        box.Counts()
+        box.Purge()
+        self.assertEqual(len(opened), 8)
+        for db in opened:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                db.execute("SELECT 1")
+
+
+    def testDrainerPurgesSent(self):
+        box = outbox.Outbox(self.path)
+        old = box.Put("engine:80", "old.alf", "Job", {})
+        new = box.Put("engine:80", "new.alf", "Job", {})
+        box.Claim("engine:80", 2)
+        box.Done(old, 1)
+        box.Done(new, 2)
+        with closing(box.connect()) as db, db:
+            db.execute("UPDATE outbox SET claimed = claimed - ? WHERE id = ?", (30 * 86400.0, old))
+
+        drainer = outbox.OutboxDrainer(box, interval=60.0)
+        drainer.start()
+        try:
+            for i in range(100):
+                if box.Entry(old) is None:
+                    break
+                time.sleep(0.05)
+        finally:
+            drainer.Stop()
+            drainer.join()
+        self.assertIsNone(box.Entry(old))
+        self.assertEqual(box.Entry(new), ("sent", 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
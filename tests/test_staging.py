@@ -0,0 +1,84 @@
+'''
+Staging spooled files, and picking an interrupted staging up again.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import tempfile
+import importlib
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+staging = importlib.import_module(os.path.basename(ROOT) + ".staging")
+
+SEGMENT = 1024
+
+
+class StagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, "shot.blend")
+        self.dst = os.path.join(self.tmp.name, "stage", "shot.blend")
+        self.data = bytes(range(256)) * 16  # four segments
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def staged(self):
+        with open(self.dst, "rb") as f:
+            return f.read()
+
+
+    def testCopyThenUnchanged(self):
+        results = staging.stageFiles([(self.src, self.dst)], segment=SEGMENT)
+        self.assertEqual(results, [(self.src, self.dst, "copied")])
+        self.assertEqual(self.staged(), self.data)
+        self.assertEqual(os.stat(self.dst).st_mtime_ns, os.stat(self.src).st_mtime_ns)
+        results = staging.stageFiles([(self.src, self.dst)], segment=SEGMENT)
+        self.assertEqual(results, [(self.src, self.dst, "unchanged")])
+
+
+    def testResumeFromDoneMarker(self):
+        # an earlier staging copied segments 0 and 2 before it stopped
+        first = staging.StagedFile(self.src, self.dst, os.stat(self.src), SEGMENT)
+        first.copySegment(0)
+        first.copySegment(2)
+        self.assertTrue(os.path.exists(first.part))
+        self.assertFalse(os.path.exists(self.dst))
+
+        again = staging.StagedFile(self.src, self.dst, os.stat(self.src), SEGMENT)
+        self.assertTrue(again.resumed)
+        self.assertEqual(again.pending(), [1, 3])
+
+        seen = []
+        results = staging.stageFiles([(self.src, self.dst)], segment=SEGMENT,
+                                     progress=lambda done, total: seen.append((done, total)))
+        self.assertEqual(results, [(self.src, self.dst, "resumed")])
+        self.assertEqual(self.staged(), self.data)
+        self.assertEqual(len(seen), 2)  # only the segments not done
+        self.assertEqual(max(seen), (len(self.data), len(self.data)))
+        self.assertFalse(os.path.exists(first.part))
+        self.assertFalse(os.path.exists(first.donelog))
+
+
+    def testPartWithoutMarkerStartsOver(self):
+        st = os.stat(self.src)
+        part = "{}.{}-{}.part".format(self.dst, st.st_size, st.st_mtime_ns)
+        os.makedirs(os.path.dirname(self.dst))
+        with open(part, "wb") as f:
+            f.write(b"x" * len(self.data))
+        staged = staging.StagedFile(self.src, self.dst, st, SEGMENT)
+        self.assertFalse(staged.resumed)
+        self.assertEqual(staged.pending(), [0, 1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+'''
+Circuit breaking and resending of engine requests.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import time
+import socket
+import importlib
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+submitter = importlib.import_module(os.path.basename(ROOT) + ".submitter")
+from mockengine import MockEngine
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def testOpensAfterThreshold(self):
+        breaker = submitter.TrCircuitBreaker(threshold=3, cooldown=60.0)
+        for i in range(2):
+            self.assertTrue(breaker.Allow())
+            breaker.Failure()
+        self.assertTrue(breaker.Allow())
+        breaker.Failure()
+        self.assertFalse(breaker.Allow())
+        self.assertGreater(breaker.RetryIn(), 59.0)
+
+
+    def testSuccessResets(self):
+        breaker = submitter.TrCircuitBreaker(threshold=2, cooldown=60.0)
+        breaker.Failure()
+        breaker.Success()
+        breaker.Failure()
+        self.assertTrue(breaker.Allow())
+
+
+    def testOneProbeAfterCooldown(self):
+        breaker = submitter.TrCircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.Failure()
+        self.assertFalse(breaker.Allow())
+        time.sleep(0.1)
+        self.assertTrue(breaker.Allow())
+        self.assertFalse(breaker.Allow())  # the probe is out
+        breaker.Success()
+        self.assertTrue(breaker.Allow())
+        self.assertEqual(breaker.RetryIn(), 0.0)
+
+
+    def testProbeFailureReopens(self):
+        breaker = submitter.TrCircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.Failure()
+        time.sleep(0.1)
+        self.assertTrue(breaker.Allow())
+        breaker.Failure()
+        self.assertFalse(breaker.Allow())
+
+
+    def testReleaseLetsAnotherProbe(self):
+        breaker = submitter.TrCircuitBreaker(threshold=1, cooldown=0.05)
+        breaker.Failure()
+        time.sleep(0.1)
+        self.assertTrue(breaker.Allow())
+        breaker.Release()
+        self.assertTrue(breaker.Allow())
+
+
+class ResendableTest(unittest.TestCase):
+
+    def testClassification(self):
+        token = {submitter.SPOOL_TOKEN_HEADER: "abc"}
+        cases = [
+            ("spool", "", token, True),
+            ("spool", "", {}, False),
+            ("config", "", {}, True),
+            ("queries", "q=jobs&filter=", {}, True),
+            ("queries?q=tasks", "", {}, True),
+            ("queries", b"q=jdelete&jid=1", {}, False),
+            ("queries", "q=jobs&q=jdelete", {}, False),
+            ("queries", "", {}, False),
+            ("monitor", "q=login&user=a", {}, True),
+            ("monitor?q=jretryerrs", "jid=1", {}, False),
+            ("ctrl", "q=jobs", {}, False),
+        ]
+        for verb, form, hdrs, expected in cases:
+            self.assertEqual(submitter.isResendable(verb, form, hdrs), expected, (verb, form, hdrs))
+
+
+class TransactionTest(unittest.TestCase):
+
+    def testDroppedSpoolSentOnce(self):
+        # carried out but the reply lost: without a token it mustn't be
+        # spooled again, a query may be asked again
+        with MockEngine(droprate=1.0) as engine:
+            rpc = submitter.TrHttpRPC(engine.address, 0, keepalive=False, retries=2, backoff=0.01)
+            errcode, reply = rpc.Transaction("spool", "Job -title {t} -subtasks {}", None, {})
+            self.assertNotEqual(errcode, 0)
+            self.assertEqual(engine.stats["requests"], 1)
+            self.assertEqual(len(engine.jobs), 1)
+
+        with MockEngine(droprate=1.0) as engine:
+            rpc = submitter.TrHttpRPC(engine.address, 0, keepalive=False, retries=2, backoff=0.01)
+            errcode, reply = rpc.Transaction("queries", "q=jobs&filter=", None, {})
+            self.assertNotEqual(errcode, 0)
+            self.assertEqual(engine.stats["requests"], 3)
+
+
+    def testTokenSpoolResent(self):
+        with MockEngine(droprate=1.0) as engine:
+            rpc = submitter.TrHttpRPC(engine.address, 0, keepalive=False, retries=2, backoff=0.01)
+            rpc.Transaction("spool", "Job -title {t} -subtasks {}", None,
+                            {submitter.SPOOL_TOKEN_HEADER: "tok"})
+            self.assertEqual(engine.stats["requests"], 3)
+            self.assertEqual(len(engine.jobs), 1)
+
+
+    def testServerErrorsRetried(self):
+        with MockEngine(errorrate=1.0) as engine:
+            rpc = submitter.TrHttpRPC(engine.address, 0, retries=1, backoff=0.01)
+            errcode, reply = rpc.Transaction("queries", "q=jobs&filter=", None, {})
+            self.assertEqual(errcode, 503)
+            self.assertEqual(engine.stats["requests"], 2)
+
+
+    def testOpenBreakerFailsAtOnce(self):
+        # a port nothing listens on
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+
+        rpc = submitter.TrHttpRPC("127.0.0.1", port, keepalive=False, retries=3, backoff=0.01)
+        breaker = submitter.trCircuitBreaker("127.0.0.1", port)
+        rpc.Transaction("queries", "q=jobs", None, {})
+        self.assertFalse(breaker.Allow())
+
+        start = time.monotonic()
+        errcode, reply = rpc.Transaction("queries", "q=jobs", None, {})
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertIn("not answering", reply)
+
+
+if __name__ == "__main__":
+    unittest.main()
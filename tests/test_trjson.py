@@ -0,0 +1,66 @@
+'''
+Decoding arrays that arrive in chunks, cut anywhere.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import json
+import random
+import importlib
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+trjson = importlib.import_module(os.path.basename(ROOT) + ".trjson")
+
+
+def chunks(data, size):
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+
+class IterArrayTest(unittest.TestCase):
+
+    def randomValue(self, rnd, depth=0):
+        kind = rnd.randrange(8 if depth < 2 else 5)
+        if kind == 0:
+            return rnd.randrange(-10**6, 10**6)
+        if kind == 1:
+            return rnd.uniform(-1e6, 1e6)
+        if kind == 2:
+            return rnd.choice([True, False, None])
+        if kind == 3:
+            return "".join(rnd.choice("ab1.e-é中\"\\") for i in range(rnd.randrange(6)))
+        if kind == 4:
+            return rnd.choice([0, -0.5, 1e-7, 2.5e+30, 10])
+        if kind == 5:
+            return [self.randomValue(rnd, depth + 1) for i in range(rnd.randrange(4))]
+        return dict(("k{}".format(i), self.randomValue(rnd, depth + 1)) for i in range(rnd.randrange(4)))
+
+
+    def testChunkSizes(self):
+        rnd = random.Random(7)
+        for n in range(50):
+            values = [self.randomValue(rnd) for i in range(rnd.randrange(1, 30))]
+            data = json.dumps(values, ensure_ascii=(n % 2 == 0)).encode("utf-8")
+            doc = json.dumps({"other": values[:2], "data": values}).encode("utf-8")
+            for size in range(1, 12):
+                self.assertEqual(list(trjson.iterArray(chunks(data, size))), values)
+                self.assertEqual(list(trjson.iterArray(chunks(doc, size), "data")), values)
+
+
+    def testNumbersAtChunkEnds(self):
+        values = [i + 0.25 for i in range(200000)]
+        data = json.dumps(values).encode()
+        for shift in range(12):
+            self.assertEqual(list(trjson.iterArray(b" " * shift + data)), values)
+
+
+    def testMissingKey(self):
+        self.assertEqual(list(trjson.iterArray(chunks(b'{"a": 1, "b": [2]}', 3), "data")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+'''
+Simulation baking for Tractor blades.
+
+    blender -b file.blend --python tractor_bake.py -- --bakedir DIR OBJECT
+    blender -b file.blend --python tractor_bake.py -- --bakedir DIR --collect OUT.blend OBJECT...
+
+Run as a Blender --python script the first form bakes every simulation
+cache of OBJECT (cloth, soft body and particle point caches, a fluid
+domain, geometry nodes simulations) that isn't baked yet to disk below
+DIR; tasks baking different objects run side by side, each on the
+unchanged .blend.
+Once they are all done the second form points the objects' caches at
+what was baked, marks them baked and saves the result as OUT.blend,
+its relative paths remapped to where that is; the render tasks load
+that file and read the caches instead of simulating up to their first
+frame.
+
+Cache locations are derived from DIR and the object's name the same
+way in both forms, which is what lets the collecting run find the
+files the baking runs wrote.
+'''
+
+import os
+import sys
+import argparse
+
+## ------------------------------------------------------------- ##
+
+def cacheName(*parts):
+    # A file name from an object and cache name.
+    return "_".join("".join(c if c.isalnum() or c in "-_" else "_" for c in p) for p in parts)
+
+
+def pointCaches(ob):
+    # (name, point cache) of the object's point cache simulations that
+    # aren't baked; hair only simulates with dynamics on.
+    caches = []
+    for mod in ob.modifiers:
+        pc = getattr(mod, "point_cache", None)
+        if pc and not pc.is_baked:
+            caches.append((mod.name, pc))
+    for psys in ob.particle_systems:
+        if psys.settings.type == 'HAIR' and not psys.use_hair_dynamics:
+            continue
+        if not psys.point_cache.is_baked:
+            caches.append((psys.name, psys.point_cache))
+    return caches
+
+
+def fluidDomains(ob):
+    # The object's fluid domains with nothing baked.
+    return [mod for mod in ob.modifiers if mod.type == 'FLUID' and mod.fluid_type == 'DOMAIN'
+            and not mod.domain_settings.has_cache_baked_any]
+
+
+def simulationBaked(mod):
+    # Whether every bake of a geometry nodes modifier is on disk already,
+    # going by the files Blender writes for one; where it can't be told
+    # (Blender before 4.1) it isn't.
+    import bpy
+
+    bakes = getattr(mod, "bakes", None)
+    if not bakes:
+        return False
+    for bk in bakes:
+        if getattr(bk, "bake_target", 'INHERIT') == 'PACKED':
+            return False
+        if getattr(bk, "use_custom_path", False) and bk.directory:
+            path = bk.directory
+        elif mod.bake_directory:
+            path = os.path.join(mod.bake_directory, str(bk.bake_id))
+        else:
+            return False
+        meta = os.path.join(bpy.path.abspath(path, library=mod.id_data.library), "meta")
+        if not os.path.isdir(meta) or not os.listdir(meta):
+            return False
+    return True
+
+
+def simulationModifiers(ob):
+    # Geometry nodes modifiers whose node tree has a simulation zone.
+    # They are baked together, so all of them unless all are baked.
+    mods = []
+    for mod in ob.modifiers:
+        if mod.type == 'NODES' and mod.node_group and any(
+                n.bl_idname == 'GeometryNodeSimulationOutput' for n in mod.node_group.nodes):
+            mods.append(mod)
+    if mods and all(simulationBaked(mod) for mod in mods):
+        return []
+    return mods
+
+
+def prepare(ob, bakedir):
+    '''
+    Point every cache of 'ob' at its directory below 'bakedir'.
+    '''
+    for name, pc in pointCaches(ob):
+        pc.use_disk_cache = True
+        pc.use_external = True
+        pc.filepath = os.path.join(bakedir, cacheName(ob.name, name))
+    for mod in fluidDomains(ob):
+        mod.domain_settings.cache_directory = os.path.join(bakedir, cacheName(ob.name, mod.name))
+    for mod in simulationModifiers(ob):
+        if hasattr(mod, "bake_target"):
+            mod.bake_target = 'DISK'
+        if hasattr(mod, "bake_directory"):
+            mod.bake_directory = os.path.join(bakedir, cacheName(ob.name, mod.name))
+
+
+def bake(ob, bakedir):
+    import bpy
+
+    prepare(ob, bakedir)
+    for name, pc in pointCaches(ob):
+        print("Tractor bake: {} {}".format(ob.name, name))
+        sys.stdout.flush()
+        with bpy.context.temp_override(object=ob, active_object=ob, point_cache=pc):
+            bpy.ops.ptcache.free_bake()
+            bpy.ops.ptcache.bake(bake=True)
+    for mod in fluidDomains(ob):
+        print("Tractor bake: {} {}".format(ob.name, mod.name))
+        sys.stdout.flush()
+        if mod.domain_settings.cache_type == 'REPLAY':
+            mod.domain_settings.cache_type = 'ALL'
+        with bpy.context.temp_override(object=ob, active_object=ob):
+            bpy.ops.fluid.bake_all()
+    if simulationModifiers(ob):
+        print("Tractor bake: {} geometry nodes".format(ob.name))
+        sys.stdout.flush()
+        with bpy.context.temp_override(object=ob, active_object=ob, selected_objects=[ob],
+                                        selected_editable_objects=[ob]):
+            bpy.ops.object.simulation_nodes_cache_bake(selected=True)
+
+
+def collect(objects, bakedir, output):
+    import bpy
+
+    for ob in objects:
+        prepare(ob, bakedir)
+        for name, pc in pointCaches(ob):
+            with bpy.context.temp_override(object=ob, active_object=ob, point_cache=pc):
+                bpy.ops.ptcache.bake_from_cache()
+        for mod in fluidDomains(ob):
+            # read back from the cache directory what the bake wrote
+            mod.domain_settings.cache_type = 'REPLAY'
+    bpy.ops.wm.save_as_mainfile(filepath=output, copy=True, relative_remap=True)
+    print("Tractor bake: saved {}".format(output))
+
+
+def bakeArgs(argv):
+    args = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(prog="tractor_bake.py")
+    parser.add_argument("--bakedir", required=True)
+    parser.add_argument("--collect", metavar="OUTPUT", default=None)
+    parser.add_argument("objects", nargs="+")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    import bpy
+
+    args = bakeArgs(sys.argv)
+    missing = [name for name in args.objects if name not in bpy.data.objects]
+    if missing:
+        print("tractor bake: no such object: {}".format(", ".join(missing)))
+        sys.exit(1)
+    objects = [bpy.data.objects[name] for name in args.objects]
+    os.makedirs(args.bakedir, exist_ok=True)
+    if args.collect:
+        collect(objects, args.bakedir, args.collect)
+    else:
+        for ob in objects:
+            bake(ob, args.bakedir)
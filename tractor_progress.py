@@ -0,0 +1,138 @@
+'''
+Render progress filter for Tractor blades.
+
+    python3 tractor_progress.py [--engine CYCLES] -- blender -b ... --render-anim
+
+Runs the given Blender command, echoes its output, and reports render
+progress in the "TR_PROGRESS n%" lines Tractor picks up, at most once
+per whole percent.  Progress covers the whole task: frames already
+saved plus the sample (or tile, or part) progress of the current frame,
+with the frame range taken from the command's --frame-start,
+--frame-end and --frame-jump (or the --frames list of a
+tractor_worker.py command).  Without a command, Blender's output is
+read from stdin instead.
+
+This replaces a bash pipeline that forked several processes for every
+line Blender printed; it only needs the standard library.
+'''
+
+import re
+import sys
+import signal
+import subprocess
+
+# per-frame progress lines of each render engine, as (done, total)
+PATTERNS = {
+    "CYCLES": re.compile(r"(?:Rendered|Sample) (\d+)/(\d+)"),
+    "BLENDER_EEVEE": re.compile(r"Rendering (\d+) / (\d+) samples"),
+    "BLENDER_WORKBENCH": re.compile(r"Part (\d+)-(\d+)"),
+}
+SAVED = re.compile(r"^Saved: ")
+
+## ------------------------------------------------------------- ##
+
+def frameCount(argv):
+    # Number of frames the Blender command line will render, either
+    # the --frame-start/--frame-end range or the --frames list given to
+    # tractor_worker.py after "--".
+    if "--" in argv:
+        args = argv[argv.index("--") + 1:]
+        for i, a in enumerate(args[:-1]):
+            if a == "--frames":
+                return max(1, framesInList(args[i + 1]))
+    opts = {"--frame-start": None, "--frame-end": None, "--frame-jump": None,
+            "-s": None, "-e": None, "-j": None}
+    for i, a in enumerate(argv[:-1]):
+        if a == "--":
+            break
+        if a in opts:
+            opts[a] = argv[i + 1]
+    try:
+        start = int(opts["--frame-start"] or opts["-s"])
+        end = int(opts["--frame-end"] or opts["-e"])
+        jump = int(opts["--frame-jump"] or opts["-j"] or 1)
+    except (TypeError, ValueError):
+        return 1
+    return max(1, len(range(start, end + 1, max(1, jump))))
+
+
+def framesInList(spec):
+    # Number of frames in a "1-10,12,20-30x2" style frame list.
+    count = 0
+    for part in spec.split(","):
+        if not part:
+            continue
+        step = 1
+        if "x" in part:
+            part, step = part.split("x")
+        if "-" in part[1:]:
+            i = part.index("-", 1)
+            count += len(range(int(part[:i]), int(part[i + 1:]) + 1, max(1, int(step))))
+        else:
+            count += 1
+    return count
+
+
+class ProgressFilter(object):
+
+    def __init__(self, engine, frames, out=sys.stdout):
+        self.pattern = PATTERNS.get(engine)
+        self.frames = frames
+        self.out = out
+        self.saved = 0
+        self.percent = -1
+
+    def feed(self, line):
+        self.out.write(line)
+
+        fraction = None
+        if SAVED.match(line):
+            self.saved += 1
+            fraction = 0.0
+        elif self.pattern:
+            m = self.pattern.search(line)
+            if m and int(m.group(2)):
+                fraction = min(1.0, int(m.group(1)) / float(int(m.group(2))))
+
+        if fraction is not None:
+            percent = int(100.0 * (min(self.saved, self.frames) + fraction) / self.frames)
+            percent = min(percent, 100)
+            if percent != self.percent:
+                self.percent = percent
+                self.out.write("TR_PROGRESS {}%\n".format(percent))
+
+        self.out.flush()
+
+
+def main(argv):
+    engine = None
+    if argv[:1] == ["--engine"] and len(argv) > 1:
+        engine = argv[1]
+        argv = argv[2:]
+    if argv[:1] == ["--"]:
+        argv = argv[1:]
+
+    if not argv:
+        pf = ProgressFilter(engine, 1)
+        for line in sys.stdin:
+            pf.feed(line)
+        return 0
+
+    pf = ProgressFilter(engine, frameCount(argv))
+    child = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True, errors="replace", bufsize=1)
+
+    # pass Tractor's kill on to Blender
+    def forward(signum, frame):
+        child.send_signal(signum)
+    for sig in ("SIGTERM", "SIGINT", "SIGHUP"):
+        if hasattr(signal, sig):
+            signal.signal(getattr(signal, sig), forward)
+
+    for line in child.stdout:
+        pf.feed(line)
+    return child.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -3,19 +3,45 @@ from bpy.props import IntProperty, StringProperty, BoolProperty, FloatProperty,
 
 import os
 import sys
-import subprocess
-from time import gmtime, strftime, sleep
-from tempfile import gettempdir
+import queue
+import shutil
+import sqlite3
+import threading
+from time import gmtime, strftime, time
 from shutil import copy2
 
-from math import ceil
-
-from . submitter import TrHttpRPC, Spool, trAbsPath, jobSpool
+from . alfred import jobScript, buildJob
+from . trasync import runSync, jobSpoolAll
+from . spoolstore import SpoolStore
+from . staging import stagePaths, stageFiles
+from . depscan import DigestCache, DependencyError, scanManifest, problems, writeManifest
+from . framescan import missingFrames
+from . trmonitor import trJobPoller, trStopJobPollers, unfinishedJobs
+from . outbox import outboxPath, trOutbox, trOutboxDrainer, trStopOutboxDrainer
+from . framehistory import FrameHistory, historyPath, HISTORY_PROP
+from . tractor_bake import pointCaches, fluidDomains, simulationModifiers
+from . submitter import jobSpool, spoolOptionParser, spoolReplyJid, trLogoutSessions
 
 ## ------------------------------------------------------------- ##
 sys.path.insert(1, os.path.join(sys.path[0], "blade-modules"))
 ## ------------------------------------------------------------- ##
 
+tractorchunking_options = [
+    ("FIXED", "Fixed", 'The same number of frames in every task', 0),
+    ("ADAPTIVE", "Adaptive", 'Pack frames into tasks of about the target duration, using render times of earlier runs', 1),
+]
+
+tractorbatch_options = [
+    ("SCENE", "Current Scene", 'Dispatch the current scene', 0),
+    ("SCENES", "All Scenes", 'Dispatch every scene in the file', 1),
+    ("VIEWLAYERS", "View Layers", 'Dispatch each view layer of the current scene', 2),
+]
+
+tractorbatchlayout_options = [
+    ("JOBS", "Separate Jobs", 'One job per scene or view layer', 0),
+    ("SUBTASKS", "One Job", 'One job, rendering each scene or view layer as a subtask', 1),
+]
+
 tractorblade_options = [
     ("ALL", "All GPUs",   'All Blades', 0),
     ("D300", "D300 GPUs", 'Blades with D300 GPU', 1),
@@ -31,7 +57,7 @@ bpy.types.Scene.tractordispacher_dorender = BoolProperty(
 
 bpy.types.Scene.tractordispacher_showprogress = BoolProperty(
     name="Show Progress",
-    description="Show per frame progress (only works on Linux or OSX with Cycles or Blender Internal renderer)",
+    description="Show per frame progress (Cycles, Eevee and Workbench; needs python3 on the blades)",
     default=True
     )
 
@@ -49,6 +75,98 @@ bpy.types.Scene.tractordispacher_framesperunit = IntProperty(
     default = 1
     )
 
+bpy.types.Scene.tractordispacher_batch = EnumProperty(
+    name="Dispatch",
+    items=tractorbatch_options,
+    description="What to dispatch from the spooled file",
+    default="SCENE",
+    )
+
+bpy.types.Scene.tractordispacher_batchlayout = EnumProperty(
+    name="As",
+    items=tractorbatchlayout_options,
+    description="How several scenes or view layers are dispatched",
+    default="JOBS",
+    )
+
+bpy.types.Scene.tractordispacher_chunking = EnumProperty(
+    name="Chunking",
+    items=tractorchunking_options,
+    description="How frames are split into tasks",
+    default="FIXED",
+    )
+
+bpy.types.Scene.tractordispacher_chunktarget = FloatProperty(
+    name="Task Duration",
+    description="Adaptive chunking, and splitting frames, aims for tasks taking about this many seconds, Blender startup included",
+    min = 1.0, max = 86400.0,
+    default = 600.0
+    )
+
+bpy.types.Scene.tractordispacher_startupcost = FloatProperty(
+    name="Startup Time",
+    description="Seconds a blade needs to launch Blender and load the scene, used until one has been recorded",
+    min = 0.0, max = 3600.0,
+    default = 30.0
+    )
+
+bpy.types.Scene.tractordispacher_recordtimes = BoolProperty(
+    name="Record Render Times",
+    description="Have blades log per-frame render times next to the .blend, for adaptive chunking",
+    default=True
+    )
+
+bpy.types.Scene.tractordispacher_bake = BoolProperty(
+    name="Bake Simulations",
+    description="Bake the cloth, soft body, particle, fluid and geometry nodes simulations not baked yet on the farm, one task per object, before any frame renders; the renders then read the caches instead of simulating up to their first frame",
+    default=False
+    )
+
+bpy.types.Scene.tractordispacher_splitframes = BoolProperty(
+    name="Split Frames",
+    description="Render frames taking longer than the task duration as several tiles on different blades, then assemble them (image outputs only; compositing effects that spread pixels, and denoising, may show seams)",
+    default=False
+    )
+
+bpy.types.Scene.tractordispacher_frametime = FloatProperty(
+    name="Frame Time",
+    description="Seconds one blade takes to render a frame, used to split frames until render times have been recorded",
+    min = 1.0, max = 604800.0,
+    default = 3600.0
+    )
+
+bpy.types.Scene.tractordispacher_maxtiles = IntProperty(
+    name="Max Tiles",
+    description="Most tiles a frame is split into",
+    min = 2, max = 1024,
+    default = 16
+    )
+
+bpy.types.Scene.tractordispacher_persistent = BoolProperty(
+    name="Persistent Workers",
+    description="Load the .blend once per task and render several chunks from it (image sequences only)",
+    default=False
+    )
+
+bpy.types.Scene.tractordispacher_workers = IntProperty(
+    name="Workers",
+    description="Number of tasks the chunks are dealt out to, round robin",
+    min = 1, max = 10000,
+    default = 4
+    )
+
+bpy.types.Scene.tractordispacher_missingonly = BoolProperty(
+    name="Missing Frames Only",
+    description="Only render frames whose output file is missing or empty",
+    default=False
+    )
+
+bpy.types.Scene.tractordispacher_checkheaders = BoolProperty(
+    name="Check Headers",
+    description="Also re-render frames whose output doesn't start with a valid image header",
+    default=False
+    )
+
 bpy.types.Scene.tractordispacher_blade = EnumProperty(
     name="Blade",
     items=tractorblade_options,
@@ -105,6 +223,78 @@ bpy.types.Scene.tractordispacher_usebinarypath = BoolProperty(
     default=False
     )
 
+bpy.types.Scene.tractordispacher_keepjobscript = BoolProperty(
+    name="Keep Job Script",
+    description="Also write the spooled .alf job script next to the spooled .blend file",
+    default=True
+    )
+
+bpy.types.Scene.tractordispacher_outbox = BoolProperty(
+    name="Queue When Offline",
+    description="If the engine can't be reached, keep the job in the local outbox and spool it as soon as the engine is back",
+    default=True
+    )
+
+bpy.types.Scene.tractordispacher_stagedir = StringProperty(
+    name="Staging Path",
+    description="Shared directory the blades can see, to copy the spooled .blend, its scripts and the files it links by relative path to; leave empty when the .blend's own directory is visible to the blades",
+    maxlen=4096,
+    default=os.environ.get('TRACTOR_STAGE_DIR', ""),
+    subtype='DIR_PATH'
+    )
+
+bpy.types.Scene.tractordispacher_stagethreads = IntProperty(
+    name="Staging Threads",
+    description="Files (or parts of big files) copied to the staging path at the same time",
+    min = 1, max = 32,
+    default = 4
+    )
+
+bpy.types.Scene.tractordispacher_checkdeps = BoolProperty(
+    name="Check Dependencies",
+    description="Before spooling, make sure the linked libraries, textures and caches the scene uses are there (and visible to the blades), and write a manifest of them next to the job script",
+    default=True
+    )
+
+bpy.types.Scene.tractordispacher_hashdeps = BoolProperty(
+    name="Hash Dependencies",
+    description="Record the sha256 of every dependency in the manifest; files unchanged since an earlier dispatch aren't read again",
+    default=True
+    )
+
+bpy.types.Scene.tractordispacher_farmroots = StringProperty(
+    name="Farm Paths",
+    description="Directories the blades can see, separated by '{}'; dependencies anywhere else are reported. Leave empty not to check".format(os.pathsep),
+    maxlen=4096,
+    default=os.environ.get('TRACTOR_FARM_ROOTS', "")
+    )
+
+bpy.types.Scene.tractordispacher_dedupe = BoolProperty(
+    name="Deduplicate Spooled Files",
+    description="Store spooled .blend files by content, so re-dispatching an unchanged scene reuses the copy already spooled",
+    default=True
+    )
+
+bpy.types.Scene.tractordispacher_spoolmaxage = FloatProperty(
+    name="Keep Spooled (Days)",
+    description="Remove deduplicated spool files not dispatched for this many days, and the scratch files of jobs no longer known after as long",
+    min = 0.0, max = 3650.0,
+    default = 14.0
+    )
+
+bpy.types.Scene.tractordispacher_spoolbudget = FloatProperty(
+    name="Spool Budget (GB)",
+    description="Remove the least recently dispatched spool files beyond this total size",
+    min = 0.0, max = 100000.0,
+    default = 100.0
+    )
+
+bpy.types.WindowManager.tractordispacher_status = StringProperty(
+    name="Dispatch Status",
+    description="Progress or outcome of the last dispatch",
+    default=""
+    )
+
 
 class TractorDispatcherPanel(bpy.types.Panel):
     """Creates a Panel in the Object properties window"""
@@ -135,13 +325,51 @@ class TractorDispatcherPanel(bpy.types.Panel):
         col.prop(sce, "frame_step", text="Step")
 
 
+        box = layout.box()
+        row = box.row()
+        row.prop(sce, "tractordispacher_batch")
+        if sce.tractordispacher_batch != 'SCENE':
+            row = box.row()
+            row.prop(sce, "tractordispacher_batchlayout")
+
         box = layout.box()
         row = box.row()
         row.prop(sce, "tractordispacher_priority")
 
+        row = box.row()
+        row.prop(sce, "tractordispacher_chunking")
+
+        if sce.tractordispacher_chunking == 'ADAPTIVE' or sce.tractordispacher_splitframes:
+            row = box.row()
+            row.prop(sce, "tractordispacher_chunktarget")
+            row = box.row()
+            row.prop(sce, "tractordispacher_startupcost")
         row = box.row()
         row.prop(sce, "tractordispacher_framesperunit")
 
+        row = box.row()
+        row.prop(sce, "tractordispacher_splitframes")
+        if sce.tractordispacher_splitframes:
+            row = box.row()
+            row.prop(sce, "tractordispacher_frametime")
+            row.prop(sce, "tractordispacher_maxtiles")
+
+        row = box.row()
+        row.prop(sce, "tractordispacher_bake")
+
+        row = box.row()
+        row.prop(sce, "tractordispacher_missingonly")
+        if sce.tractordispacher_missingonly:
+            row.prop(sce, "tractordispacher_checkheaders")
+
+        row = box.row()
+        row.prop(sce, "tractordispacher_persistent")
+        if sce.tractordispacher_persistent:
+            row.prop(sce, "tractordispacher_workers")
+
+        row = box.row()
+        row.prop(sce, "tractordispacher_recordtimes")
+
         row = box.row()
         row.prop(sce, "tractordispacher_blade")
 
@@ -162,10 +390,535 @@ class TractorDispatcherPanel(bpy.types.Panel):
 
         row = layout.row()
         row.prop(sce, "tractordispacher_usebinarypath")
+        row = layout.row()
+        row.prop(sce, "tractordispacher_keepjobscript")
+        row = layout.row()
+        row.prop(sce, "tractordispacher_outbox")
+        row = layout.row()
+        row.prop(sce, "tractordispacher_checkdeps")
+        if sce.tractordispacher_checkdeps:
+            row.prop(sce, "tractordispacher_hashdeps")
+            row = layout.row()
+            row.prop(sce, "tractordispacher_farmroots")
+        row = layout.row()
+        row.prop(sce, "tractordispacher_stagedir")
+        if sce.tractordispacher_stagedir:
+            row = layout.row()
+            row.prop(sce, "tractordispacher_stagethreads")
+        row = layout.row()
+        row.prop(sce, "tractordispacher_dedupe")
+        row = layout.row()
+        row.prop(sce, "tractordispacher_spoolmaxage")
+        if sce.tractordispacher_dedupe:
+            row.prop(sce, "tractordispacher_spoolbudget")
 
         row = layout.row()
         row.operator("tractordispacher.button", text="Dispatch Job")
 
+        status = context.window_manager.tractordispacher_status
+        if status:
+            col = layout.column(align=True)
+            for line in status.split("\n"):
+                col.label(text=line, icon='INFO')
+
+        drainer = trOutboxDrainer(start=False)
+        if drainer and (drainer.waiting or drainer.failed):
+            box = layout.box()
+            if drainer.waiting:
+                box.label(text="Outbox: {} jobs waiting for the engine".format(drainer.waiting), icon='TIME')
+            if drainer.failed:
+                box.label(text="Outbox: {} jobs turned down by the engine".format(drainer.failed), icon='ERROR')
+            if drainer.status:
+                box.label(text=drainer.status)
+
+        poller = trJobPoller(tractorEngine(), start=False)
+        if poller:
+            generation, jobs = poller.Snapshot()
+            if jobs:
+                box = layout.box()
+                row = box.row()
+                row.label(text="Spooled Jobs")
+                row.operator("tractordispacher.forget", text="Clear Finished")
+                for job in jobs:
+                    drawJobState(box.column(align=True), job)
+
+
+def drawJobState(col, job):
+    # One job of the dashboard, with its running tasks below it.
+    if job.error:
+        icon = 'ERROR'
+    elif job.finished:
+        icon = 'CHECKMARK'
+    elif job.paused:
+        icon = 'PAUSE'
+    else:
+        icon = 'RENDER_ANIMATION'
+    text = "{} {}: {}/{} tasks".format(job.jid, job.title, job.numdone, job.numtasks)
+    if job.numerror:
+        text += ", {} errors".format(job.numerror)
+    col.label(text=text, icon=icon)
+    if job.error:
+        col.label(text=job.error)
+    for title, percent in job.tasks:
+        col.label(text="    {} {}%".format(title, percent))
+
+
+def dashboardRefresh():
+    # Timer redrawing the panel when, and only when, the poller or the
+    # outbox drainer has seen a change since the last redraw.
+    poller = trJobPoller(tractorEngine(), start=False)
+    drainer = trOutboxDrainer(start=False)
+    if poller is None and drainer is None:
+        return None
+    generation = (poller.Snapshot()[0] if poller else None,
+                  drainer.generation if drainer else None)
+    if generation != dashboardRefresh.generation:
+        dashboardRefresh.generation = generation
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'PROPERTIES':
+                    area.tag_redraw()
+    return 1.0
+
+dashboardRefresh.generation = None
+
+
+def watchJob(jid, title):
+    # Hands a spooled job to the shared poller and the dashboard.
+    trJobPoller(tractorEngine()).Watch(jid, title)
+    startDashboard()
+
+
+def startDashboard():
+    if not bpy.app.timers.is_registered(dashboardRefresh):
+        bpy.app.timers.register(dashboardRefresh, first_interval=1.0, persistent=True)
+
+
+# the spool store of each reference to a job waiting in the outbox,
+# by (engine, outbox entry id), for the reference to follow the job
+queuedReferences = {}
+
+def outboxSpooled(engine, jid, title, id):
+    # Called on the drainer's thread for each queued job it spooled;
+    # the poller is thread safe, the dashboard timer is running already.
+    if jid:
+        trJobPoller(engine).Watch(jid, title)
+    root = queuedReferences.pop((engine, id), None)
+    if root and jid:
+        try:
+            swapReference(SpoolStore(root), engine, id, jid)
+        except OSError as e:
+            print("Tractor Dispatcher: {}".format(e))
+
+
+def startOutboxDrainer():
+    trOutboxDrainer(onspooled=outboxSpooled).Kick()
+    startDashboard()
+
+
+def tractorEngine():
+    # Returns the engine as "host:port", TRACTOR_ENGINE overrides the default.
+    tractorEngineName = '10.180.128.13'
+    tractorEnginePort = 8080
+    if 'TRACTOR_ENGINE' in os.environ.keys():
+        name = os.environ['TRACTOR_ENGINE']
+        tractorEngineName,n,p = name.partition( ":" )
+        if p:
+            tractorEnginePort = int( p )
+
+    return '' + str( tractorEngineName ) + ':' + str( tractorEnginePort )
+
+
+def fsyncPath(path):
+    # Flush a file (or a directory entry) through to the disk, or the
+    # file server, so that blades are sure to see it.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # e.g. directories on some platforms
+    finally:
+        os.close(fd)
+
+
+def stageJobScripts(job):
+    # Copies the pre- and post scripts next to the spooled .blend and
+    # makes sure they are on disk before the job can reach a blade.
+    staged = []
+    if job['prescript']:
+        copy2(job['prescript'], job['prefull'])
+        staged.append(job['prefull'])
+    if job['postscript']:
+        copy2(job['postscript'], job['postfull'])
+        staged.append(job['postfull'])
+    for key, name in (('historyscript', "framehistory.py"), ('progressscript', "tractor_progress.py"),
+                      ('workerscript', "tractor_worker.py"), ('bakescript', "tractor_bake.py"),
+                      ('tilescript', "tractor_tiles.py")):
+        if job[key]:
+            copy2(os.path.join(os.path.dirname(__file__), name), job[key])
+            staged.append(job[key])
+
+    for path in staged:
+        fsyncPath(path)
+    for d in set(os.path.dirname(path) for path in staged):
+        fsyncPath(d)
+
+
+def absoluteOutputPaths():
+    # Makes the render output and File Output node paths of every scene
+    # absolute; relative_remap leaves them relative to wherever the
+    # spooled copy is saved.  Returns (owner, attribute, old value) of
+    # each path changed, to put back.
+    changed = []
+    for sc in bpy.data.scenes:
+        if sc.library:
+            continue
+        owners = [(sc.render, "filepath")]
+        if sc.node_tree:
+            owners += [(node, "base_path") for node in sc.node_tree.nodes if node.type == 'OUTPUT_FILE']
+        for owner, attr in owners:
+            value = getattr(owner, attr)
+            if value.startswith("//"):
+                changed.append((owner, attr, value))
+                setattr(owner, attr, bpy.path.abspath(value))
+    return changed
+
+
+def bakeObjects(scene):
+    # Names of the scene's objects with simulations that aren't baked.
+    names = []
+    for ob in scene.objects:
+        if ob.library:
+            continue  # can't be saved baked
+        if pointCaches(ob) or fluidDomains(ob) or simulationModifiers(ob):
+            names.append(ob.name)
+    return names
+
+
+def dependency(kind, owner, path, library=None, sequence=False, directory=False,
+                optional=False):
+    # A depscan dependency dict for 'path' as Blender has it.
+    return {"kind": kind, "owner": owner,
+            "path": os.path.normpath(bpy.path.abspath(path, library=library)),
+            "relative": path.startswith("//"), "sequence": sequence,
+            "directory": directory, "optional": optional}
+
+
+def sceneDependencies():
+    # The files the open .blend uses, as depscan dependencies; packed
+    # and generated data is left out.
+    deps = []
+    for lib in bpy.data.libraries:
+        if lib.filepath and not lib.packed_file:
+            deps.append(dependency("library", lib.name, lib.filepath, getattr(lib, "parent", None)))
+    for img in bpy.data.images:
+        if img.filepath and img.source in ('FILE', 'SEQUENCE', 'MOVIE', 'TILED') and not img.packed_file:
+            deps.append(dependency("image", img.name, img.filepath, img.library,
+                                    sequence=img.source in ('SEQUENCE', 'TILED')))
+    for clip in bpy.data.movieclips:
+        if clip.filepath:
+            deps.append(dependency("movie clip", clip.name, clip.filepath, clip.library,
+                                    sequence=clip.source == 'SEQUENCE'))
+    for sound in bpy.data.sounds:
+        if sound.filepath and not sound.packed_file:
+            deps.append(dependency("sound", sound.name, sound.filepath, sound.library))
+    for font in bpy.data.fonts:
+        if font.filepath and font.filepath != "<builtin>" and not font.packed_file:
+            deps.append(dependency("font", font.name, font.filepath, font.library))
+    for cache in bpy.data.cache_files:
+        if cache.filepath:
+            deps.append(dependency("cache", cache.name, cache.filepath, cache.library,
+                                    sequence=cache.is_sequence))
+    for volume in bpy.data.volumes:
+        if volume.filepath and not volume.packed_file:
+            deps.append(dependency("volume", volume.name, volume.filepath, volume.library,
+                                    sequence=volume.is_sequence))
+
+    # disk caches of simulations, which the blades may bake themselves
+    blendcache = "//blendcache_" + os.path.splitext(bpy.path.basename(bpy.data.filepath))[0]
+    for ob in bpy.data.objects:
+        caches = [getattr(mod, "point_cache", None) for mod in ob.modifiers]
+        caches += [psys.point_cache for psys in ob.particle_systems]
+        for pc in caches:
+            if pc and pc.use_disk_cache:
+                deps.append(dependency("point cache", ob.name, pc.filepath if pc.use_external else blendcache,
+                                        ob.library, directory=True, optional=True))
+        for mod in ob.modifiers:
+            if mod.type == 'FLUID' and mod.fluid_type == 'DOMAIN':
+                deps.append(dependency("fluid cache", ob.name, mod.domain_settings.cache_directory,
+                                        ob.library, directory=True, optional=True))
+
+    for sc in bpy.data.scenes:
+        if not sc.sequence_editor:
+            continue
+        for strip in sc.sequence_editor.sequences_all:
+            if strip.type == 'IMAGE':
+                for element in strip.elements:
+                    deps.append(dependency("strip", strip.name,
+                                            os.path.join(strip.directory, element.filename), sc.library))
+            elif strip.type == 'MOVIE':
+                deps.append(dependency("strip", strip.name, strip.filepath, sc.library))
+    return deps
+
+
+def checkDependencies(job):
+    # The manifest of the job's dependencies, written next to the job
+    # script.  Fails the dispatch if any of them would break on the
+    # farm, unless only gathered for staging.
+    cache = DigestCache(job['digestcache'])
+    hashfiles = job['checkdeps'] and job['hashdeps']
+    manifest = scanManifest(job['dependencies'], cache, hashfiles)
+    cache.save()
+    if not job['checkdeps']:
+        return manifest
+
+    writeManifest(os.path.splitext(job['jobfull'])[0] + "_deps.json", manifest)
+    # without farm roots there is nothing to tell what the blades see
+    roots = job['farmroots']
+    if roots and job['stagedir']:
+        roots = roots + [job['stagedir']]
+    found = problems(manifest, roots, staged=bool(job['stagedir']))
+    if found:
+        more = " (and {} more)".format(len(found) - 3) if len(found) > 3 else ""
+        raise DependencyError("; ".join(found[:3]) + more)
+    return manifest
+
+
+def stageJob(jobs, manifest, messages):
+    # Copies the spooled .blend, the scripts run on the blades and the
+    # dependencies to the staging path, and points the jobs at the
+    # copies.
+    first = jobs[0]
+    keys = ['blendfull', 'historyscript', 'progressscript', 'workerscript', 'bakescript', 'tilescript']
+    if first['prescript']:
+        keys.append('prefull')
+    if first['postscript']:
+        keys.append('postfull')
+    local = [first[k] for k in keys if first[k]]
+    local += [f['path'] for f in manifest['files'] if f['relative']]
+
+    # the scratch directory the blades write to is mapped along, not copied
+    staged = stagePaths(first['stagedir'], local + [first['scratchdir']])
+    scratchdir = staged.pop(os.path.abspath(first['scratchdir']))
+    progress = lambda done, total: messages.put("Staging {:.0f}%".format(100.0 * done / total))
+    stageFiles(staged.items(), first['stagethreads'], progress=progress)
+
+    for job in jobs:
+        for k in keys:
+            if job[k]:
+                job[k] = staged[os.path.abspath(job[k])]
+        job['scratchdir'] = scratchdir
+
+
+def loadFrameTimes(job):
+    # Fills in the per-frame estimates used by adaptive chunking and
+    # for splitting frames, if there is any recorded history to base
+    # them on.  With fixed chunking they only size the tiles.
+    history = FrameHistory(job['historylog'])
+    frames = range(job['frame_start'], job['frame_end'] + 1, job['frame_step'])
+    job['frametimes'] = history.estimates(frames)
+    if history.startup is not None:
+        job['startupcost'] = history.startup
+
+
+def referenceName(engine, jid=None, queued=None):
+    # The spool store's name for a job's reference.
+    name = "{}_{}".format(engine, jid) if jid else "{}_queued{}".format(engine, queued)
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+def swapReference(store, engine, queued, jid):
+    # Files the reference of a job spooled from the outbox under its
+    # jid, returns the new (name, reference); None where there was none.
+    old = referenceName(engine, queued=queued)
+    ref = store.reference(old)
+    if ref is None:
+        return None
+    info = dict((k, v) for k, v in ref.items() if k not in ("paths", "time"))
+    info['jid'] = jid
+    name = referenceName(engine, jid)
+    store.addReference(name, ref["paths"], **info)
+    store.dropReference(old, scratch=False)
+    return (name, store.reference(name))
+
+
+def outboxEntry(id):
+    # (state, jid) of the outbox entry 'id', None if there is none.
+    if not os.path.exists(outboxPath()):
+        return None
+    try:
+        return trOutbox().Entry(id)
+    except sqlite3.Error:
+        return None
+
+
+def liveSpoolFiles(store, maxage):
+    # The stored files of jobs not finished yet, dropping the references
+    # of the others.  Jobs the engine can't be asked about keep theirs,
+    # as do jobs still in an outbox; jobs no one knows about any more
+    # keep theirs until 'maxage' seconds old.
+    keep = []
+    byengine = {}
+    for name, ref in list(store.references()):
+        if not ref.get("jid") and ref.get("queued"):
+            # spooled from the outbox since, maybe by another session
+            entry = outboxEntry(ref["queued"])
+            if entry and entry[0] == 'sent' and entry[1]:
+                name, ref = swapReference(store, ref["engine"], ref["queued"], entry[1]) or (name, ref)
+            elif entry and entry[0] in ('queued', 'sending'):
+                keep.extend(ref["paths"])
+                continue
+        if ref.get("jid"):
+            byengine.setdefault(ref["engine"], []).append((name, ref))
+        elif time() - ref["time"] < maxage:
+            keep.extend(ref["paths"])
+        else:
+            store.dropReference(name)
+
+    for engine, refs in byengine.items():
+        unfinished = unfinishedJobs(engine, 0, [ref["jid"] for name, ref in refs])
+        for name, ref in refs:
+            if unfinished is None or ref["jid"] in unfinished:
+                keep.extend(ref["paths"])
+            else:
+                store.dropReference(name)
+    return keep
+
+
+def sweepScratch(scratchroot, store, maxage):
+    # Removes the scratch directories below 'scratchroot' no reference
+    # names, e.g. of dispatches that failed, once 'maxage' seconds old.
+    named = set()
+    for name, ref in store.references():
+        named.update(os.path.abspath(d) for d in ref.get("scratch", []))
+    try:
+        entries = list(os.scandir(scratchroot))
+    except FileNotFoundError:
+        return
+    for d in entries:
+        if d.is_dir() and os.path.abspath(d.path) not in named \
+                and time() - d.stat().st_mtime > maxage:
+            shutil.rmtree(d.path, ignore_errors=True)
+
+
+def writeJobScript(path, alfdata):
+    # Persists an already generated job script in a single write.
+    with open(path, 'w') as f:
+        f.write(alfdata)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+## ------------------------------------------------------------- ##
+
+class DispatchWorker(threading.Thread):
+    # Does the file and network part of a dispatch off the UI thread.
+    # 'jobs' holds the settings of every scene or view layer dispatched
+    # from the one spooled file.  Status messages are posted to
+    # 'messages', the outcome ends up in 'results' as one
+    # (title, errcode, reply) per spooled job.
+
+    def __init__(self, jobs, engine):
+        threading.Thread.__init__(self, name="tractor-dispatch", daemon=True)
+        self.jobs = jobs
+        self.engine = engine
+        self.messages = queue.Queue()
+        self.results = []
+
+    def run(self):
+        first = self.jobs[0]
+        try:
+            manifest = None
+            if first['checkdeps'] or first['stagedir']:
+                self.messages.put("Checking dependencies")
+                manifest = checkDependencies(first)
+
+            store = SpoolStore(first['spoolstore'])
+            blendfull = first['blendfull']
+            if first['dedupe']:
+                self.messages.put("Hashing {}".format(first['title']))
+                blendfull = store.put(blendfull, ".blend")
+                for job in self.jobs:
+                    job['blendfull'] = blendfull
+
+            self.messages.put("Syncing {}".format(os.path.basename(first['blendfull'])))
+            fsyncPath(first['blendfull'])
+
+            stageJobScripts(first)
+
+            if first['stagedir']:
+                self.messages.put("Staging to {}".format(first['stagedir']))
+                stageJob(self.jobs, manifest, self.messages)
+
+            for job in self.jobs:
+                if job['chunking'] == 'ADAPTIVE' or job['splitframes']:
+                    loadFrameTimes(job)
+
+            self.messages.put("Generating job script")
+            if len(self.jobs) > 1 and first['batchlayout'] == 'SUBTASKS':
+                scripts = [(first['jobfull'], first['title'], buildJob(first, self.jobs).asAlfred())]
+            else:
+                scripts = [(job['jobfull'], job['title'], jobScript(job)) for job in self.jobs]
+
+            self.messages.put("Spooling to {}".format(self.engine))
+            args = []
+            args.append('--engine=' + self.engine)
+            args.append('--priority={}'.format(first['priority']))
+            #if self.doJobPause:
+            #    args.append('--paused')
+            if first['outbox']:
+                args.append('--outbox')
+            options, jobfiles = spoolOptionParser().parse_args(args)
+            if len(scripts) == 1:
+                replies = [jobSpool(scripts[0][0], options, scripts[0][2])]
+            else:
+                replies = runSync( jobSpoolAll([s[0] for s in scripts], options,
+                                                [s[2] for s in scripts]) )
+            for (jobfull, title, alfdata), (rc, reply) in zip(scripts, replies):
+                self.results.append( (title, rc, reply) )
+
+        except Exception as e:
+            self.results = [(first['title'], -1, "{} - {}".format(e.__class__.__name__, e))]
+            return
+
+        # the engine has its copy, the one on disk is just for the record
+        if first['keepjobscript']:
+            for jobfull, title, alfdata in scripts:
+                try:
+                    writeJobScript(jobfull, alfdata)
+                except OSError as e:
+                    print("Tractor Dispatcher: could not write {}: {}".format(jobfull, e))
+
+        try:
+            # what the jobs just spooled load stays until they are done;
+            # without deduplication the store only keeps the references,
+            # for the scratch directories
+            for title, rc, reply in self.results:
+                if rc:
+                    continue
+                jid = spoolReplyJid(reply)
+                queued = reply.get("queued") if isinstance(reply, dict) else None
+                if jid or queued:
+                    store.addReference(referenceName(self.engine, jid, queued), [blendfull],
+                                       engine=self.engine, jid=jid, queued=queued, title=title,
+                                       scratch=[first['scratchdir']])
+                    if queued:
+                        queuedReferences[(self.engine, queued)] = first['spoolstore']
+            keep = [blendfull] + liveSpoolFiles(store, first['spoolmaxage'])
+            sweepScratch(os.path.dirname(first['scratchdir']), store, first['spoolmaxage'])
+            if first['dedupe']:
+                store.evict(first['spoolmaxage'], first['spoolbudget'], keep=keep)
+        except OSError as e:
+            print("Tractor Dispatcher: spool eviction failed: {}".format(e))
+
+
+def setDispatchStatus(context, text):
+    context.window_manager.tractordispacher_status = text
+    for window in context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'PROPERTIES':
+                area.tag_redraw()
+
 
 class TRACTORDISPACHER_OT_Button(bpy.types.Operator):
     bl_idname = "tractordispacher.button"
@@ -173,178 +926,386 @@ class TRACTORDISPACHER_OT_Button(bpy.types.Operator):
     bl_description = "Dispatch scene to tractor blades"
     mode: IntProperty(name="mode", default=1)
 
+    _timer = None
+    _worker = None
+
     def now(self):
         # Returns preformated time for now.
         return strftime("%H%M%S", gmtime())
 
-    def spoolJob(self):
-
-        ##### TRACTOR VARIABLES ######
-        ##private variables
-        self.tractorEngineName = '10.180.128.13'
-        self.tractorEnginePort = 8080
-        if 'TRACTOR_ENGINE' in os.environ.keys():
-            name = os.environ['TRACTOR_ENGINE']
-            self.tractorEngineName,n,p = name.partition( ":" )
-            if p:
-                self.tractorEnginePort = int( p )
-        ##public variables
-
-        self.tractorEngine = '' + str( self.tractorEngineName ) + ':' + str( self.tractorEnginePort )
-
-        jobScript = self.createJobScript()
-        args = []
-        args.append('--engine=' + self.tractorEngine)
-        #if self.doJobPause:
-        #    args.append('--paused')
-        args.append(jobScript)
-
-        Spool(args)
-
-    def createJobScript(self):
+    def dispatchTargets(self, context):
+        # The (scene, view layer name) pairs to dispatch, the name is
+        # None when rendering all of a scene's enabled view layers.
+        scene = context.scene
+        if scene.tractordispacher_batch == 'SCENES':
+            return [(sc, None) for sc in bpy.data.scenes]
+        if scene.tractordispacher_batch == 'VIEWLAYERS':
+            return [(scene, vl.name) for vl in scene.view_layers if vl.use]
+        return [(scene, None)]
+
+    def renderSettings(self, context, scene, viewlayer, batch):
+        # The settings that differ between the scenes or view layers of
+        # a batch.
+
+        # render engine whose output tractor_progress.py should follow
+        progressengine = ""
+        if scene.tractordispacher_showprogress:
+            progressengine = scene.render.engine
+
+        # frames are split into tiles for image outputs only
+        dorender = context.scene.tractordispacher_dorender
+        splitframes = dorender and context.scene.tractordispacher_splitframes \
+                        and not scene.render.is_movie_format
+        missingonly = dorender and context.scene.tractordispacher_missingonly
+
+        # where each frame renders to
+        expected = None
+        if splitframes or missingonly:
+            expected = {}
+            for f in range(scene.frame_start, scene.frame_end + 1, scene.frame_step):
+                path = scene.render.frame_path(frame=f)
+                if viewlayer is not None:
+                    path = os.path.join(os.path.dirname(path), viewlayer, os.path.basename(path))
+                expected[f] = path
+
+        # with "missing frames only", the frames whose output isn't there
+        framelist = None
+        if missingonly:
+            framelist = missingFrames(expected, context.scene.tractordispacher_checkheaders)
+
+        # simulations to bake first, of the scene rendered
+        bakeobjects = []
+        if dorender and context.scene.tractordispacher_bake:
+            bakeobjects = bakeObjects(scene)
+
+        target = scene.name if viewlayer is None else "{} / {}".format(scene.name, viewlayer)
+        return {
+            'target': target,
+            'scene': scene.name if batch else None,
+            'viewlayer': viewlayer,
+            'frame_start': scene.frame_start,
+            'frame_end': scene.frame_end,
+            'frame_step': scene.frame_step,
+            'framelist': framelist,
+            'splitframes': splitframes,
+            'resolution': (scene.render.resolution_x * scene.render.resolution_percentage // 100,
+                           scene.render.resolution_y * scene.render.resolution_percentage // 100),
+            'framepaths': expected if splitframes else None,
+            'progressengine': progressengine,
+            'bakeobjects': bakeobjects,
+            'historylog': historyPath(bpy.data.filepath, target),
+        }
+
+    def jobSettings(self, context):
+        # Spool out the blender file, once, and gather everything the
+        # job scripts need while still on the UI thread.  Returns the
+        # settings of each scene or view layer to dispatch.
+        scene = context.scene
 
-        # Dispatch the job to tractor.
-        # Spool out the blender file.
-        spooledfiles = []
         spooldirname = os.path.dirname(bpy.data.filepath)
         #if not os.path.exists(bpy.context.scene.tractordispacher_spool):
         #    os.makedirs(bpy.context.scene.tractordispacher_spool)
         if not os.path.exists(spooldirname):
             os.makedirs(spooldirname)
         basefilename = os.path.basename(os.path.splitext(bpy.data.filepath)[0])
-        blendshort = "{}_{}.blend".format(basefilename, self.now())
+        stamp = self.now()
+        blendshort = "{}_{}.blend".format(basefilename, stamp)
         #blendfull = os.path.join(bpy.context.scene.tractordispacher_spool, blendshort)
         blendfull = os.path.join(spooldirname, blendshort)
-        bpy.ops.wm.save_as_mainfile(filepath=blendfull, copy=True, relative_remap=True)
-        spooledfiles.append(blendfull)
-        # Create the .alf script.
+
+        # with deduplication the copy is saved into the spool store and
+        # only gets its final, content derived, name on the worker
+        spoolstore = os.path.join(spooldirname, ".tractor", "spool")
+        if scene.tractordispacher_dedupe:
+            blendfull = SpoolStore(spoolstore).tempPath(".blend")
+
+        targets = self.dispatchTargets(context)
+        batch = scene.tractordispacher_batch != 'SCENE'
+        renders = [self.renderSettings(context, sc, vl, batch) for sc, vl in targets]
+        if scene.tractordispacher_dorender and scene.tractordispacher_missingonly:
+            # nothing to spool for what is fully rendered already
+            pending = [(t, r) for t, r in zip(targets, renders) if r['framelist']]
+            if not pending:
+                return []
+            targets = [t for t, r in pending]
+            renders = [r for t, r in pending]
+
+        # scripts run on the blades are staged here
+        bladedir = os.path.join(spooldirname, ".tractor")
+        os.makedirs(bladedir, exist_ok=True)
+        progressscript = ""
+        if any(render['progressengine'] for render in renders):
+            progressscript = os.path.join(bladedir, "tractor_progress.py")
+
+        bakescript = ""
+        if any(render['bakeobjects'] for render in renders):
+            bakescript = os.path.join(bladedir, "tractor_bake.py")
+
+        tilescript = ""
+        if any(render['splitframes'] for render in renders):
+            tilescript = os.path.join(bladedir, "tractor_tiles.py")
+
+        workerscript = ""
+        if scene.tractordispacher_persistent:
+            workerscript = os.path.join(bladedir, "tractor_worker.py")
+
+        # blades find the render time log through the spooled scene
+        historyscript = ""
+        if scene.tractordispacher_recordtimes:
+            historyscript = os.path.join(bladedir, "tractor_framehistory.py")
+            logs = {}
+            for (sc, vl), render in zip(targets, renders):
+                if vl is None:
+                    logs[sc] = render['historylog']
+                else:
+                    logs.setdefault(sc, {})[vl] = render['historylog']
+            for sc, log in logs.items():
+                sc[HISTORY_PROP] = log
+        # the spooled copy lives elsewhere, its output mustn't move along
+        outputs = absoluteOutputPaths()
+        try:
+            bpy.ops.wm.save_as_mainfile(filepath=blendfull, copy=True, relative_remap=True)
+        finally:
+            for owner, attr, value in outputs:
+                setattr(owner, attr, value)
+            for sc, vl in targets:
+                if HISTORY_PROP in sc:
+                    del sc[HISTORY_PROP]
+
         blender_binary = "blender"
-        if bpy.context.scene.tractordispacher_usebinarypath:
+        if scene.tractordispacher_usebinarypath:
             blender_binary = bpy.app.binary_path
-        jobshort = "{}_{}.alf".format(basefilename, self.now())
-        #jobfull = os.path.join(bpy.context.scene.tractordispacher_spool, jobshort)
-        jobfull = os.path.join(spooldirname, jobshort)
-        self.file = open(jobfull, 'w')
-        spooledfiles.append(jobfull)
-
-        envkey = "TOOLS={} {}".format(os.environ.get('TOOLS'), bpy.context.scene.tractordispacher_envkey)
-        addons = ",".join(bpy.context.preferences.addons.keys())
-        blender_user_scripts = os.environ.get('BLENDER_USER_SCRIPTS')
 
-        if bpy.context.scene.tractordispacher_blade == 'D300':
+        if scene.tractordispacher_blade == 'D300':
             service = 'BlenderRenderD300'
-        elif bpy.context.scene.tractordispacher_blade == 'D500':
+        elif scene.tractordispacher_blade == 'D500':
             service = 'BlenderRenderD500'
         else:
             service = 'BlenderRender'
 
-        self.file.write("Job -title {{{}}}".format(blendshort))
-        #self.file.write(" -pbias {} ".format(bpy.context.scene.tractordispacher_priority))
-        self.file.write(" -priority {}".format(bpy.context.scene.tractordispacher_priority))
-        self.file.write(" -tags {{ Blender {} }}".format(bpy.context.scene.tractordispacher_tags))
-        #self.file.write(" -service {BlenderRender}")
-        self.file.write(" -service {{ {} }}".format(service))
-        self.file.write(" -crews {{{}}}".format(bpy.context.scene.tractordispacher_crews))
-        #self.file.write(" -projects ".format(bpy.context.scene.tractordispacher_projects))
-        self.file.write(" -projects Default")
-        self.file.write(" -envkey {{{}}}".format(envkey))
-        #self.file.write(" -whendone {{{}}}".format(bpy.context.scene.tractordispacher_jobDoneCmd))
-        #self.file.write(" -whenerror {{{}}}".format(bpy.context.scene.tractordispacher_jobErrorCmd))
-        #self.file.write(" {} ".format(bpy.context.scene.tractordispacher_extraJobOptions)
-        self.file.write(" -serialsubtasks 1")
-        self.file.write(" -subtasks {\n")
-
-        # Run pre-script
-        if bpy.context.scene.tractordispacher_prescript:
-            #prefull = os.path.join(bpy.context.scene.tractordispacher_spool, "{}_{}_pre.py" .format( basefilename, self.now() ))
-            prefull = os.path.join(spooldirname, "{}_{}_pre.py" .format( basefilename, self.now() ))
-            copy2(bpy.path.abspath(bpy.context.scene.tractordispacher_prescript), prefull )
-            self.file.write("    Task {Pre-Job Script} -cmds {\n")
-            self.file.write("        RemoteCmd {{{} --background {} --python {}}}\n".format( blender_binary, blendfull, prefull ))
-            self.file.write("    }\n")
-            spooledfiles.append(prefull)
-
-        # Render frames
-        bashwrap=""
-        progresscmd=" "
-        if bpy.context.scene.tractordispacher_showprogress:
-            if bpy.context.scene.render.engine == 'BLENDER_EEVEE':
-                bashwrap="/bin/bash -c {"
-                progresscmd=" | while read line;do echo \$line;echo \$line | grep 'Rendering' | awk {'print 100 / $(NF-1) * $(NF-3)'} | cut -d. -f1 | sed 's/^/TR_PROGRESS /;s/\$/%/';done}"
-            # BLENDER_WORKBENCH has no progress
-            #if bpy.context.scene.render.engine == 'BLENDER_WORKBENCH':
-            #    bashwrap="/bin/bash -c {"
-            #    progresscmd=" | while read line;do echo \$line;echo \$line | grep 'Scene, Part' | awk {'print \$(NF)'} | sed 's/-/\\\//g' | sed 's/$/*100/' | bc -l | cut -d. -f1| sed 's/^/TR_PROGRESS /;s/\$/%/';done}"
-            if bpy.context.scene.render.engine == 'CYCLES':
-                bashwrap="/bin/bash -c {"
-                progresscmd=" | while read line;do echo \$line;echo \$line | grep 'Rendered' | awk {'print \$(NF-1)'} | sed 's/$/*100/' | bc -l | cut -d. -f1 | sed 's/^/TR_PROGRESS /;s/\$/%/';done}"
-        if bpy.context.scene.tractordispacher_dorender:
-            self.file.write("    Task {Render Frames} -subtasks {\n")
-
-            start = bpy.context.scene.frame_start
-            end = bpy.context.scene.frame_end
-            step = bpy.context.scene.frame_step
-
-            fpu = bpy.context.scene.tractordispacher_framesperunit
-
-            s = start
-            e = s + step * fpu - 1
-
-            #for f in range(start,end,step):
-            while s < end:
-                #print("s:{} e:{} s:{}".format(s,e,step))  
-                e = min(e, end)
-
-                title = "Frame {}".format(s) if s == e else "Frame {} - {}".format(s, e)
-
-                self.file.write("        Task {{ {} }} -cmds {{\n".format(title))
-                self.file.write("            RemoteCmd {{{}{} --background --factory-startup -y {} --python {}/init.py --frame-start {} --frame-end {} --frame-jump {} --render-anim -- -e {} {} }} -service {{ {} }} -envkey {{ {} }} -tags {{ Blender {} }}\n".format( bashwrap, blender_binary, blendfull, blender_user_scripts, s, e, step, addons, progresscmd, service, envkey, bpy.context.scene.tractordispacher_tags ))
-                self.file.write("        }\n")
-
-                s = e + 1
-                e = s + step * fpu - 1
-
-            self.file.write("    }\n")
-
-        # Run post-script
-        if bpy.context.scene.tractordispacher_postscript:
-            #postfull = os.path.join(bpy.context.scene.tractordispacher_spool, "{}_{}_post.py".format( basefilename, self.now() ))
-            postfull = os.path.join(spooldirname, "{}_{}_post.py".format( basefilename, self.now() ))
-            copy2(bpy.path.abspath(bpy.context.scene.tractordispacher_postscript), postfull )
-            self.file.write("    Task {Post-Script} -cmds {\n")
-            self.file.write("        RemoteCmd {{{} --background {} --python {}}}\n".format( blender_binary, blendfull, bpy.context.scene.tractordispacher_postscript ))
-            self.file.write("    }\n")
-            spooledfiles.append(postfull)
-
-        self.file.write("}\n")
-        self.file.close()
-
-        # Just to make doubly sure the .alf script is available on disk.
-        sleep(1)
-        # Python based Job to Tractor Dispatcher
-        """
-        tractor_host = os.environ.get('TRACTOR_HOST')
-        tractor_port = os.environ.get('TRACTOR_PORT')
-        command = "tractor-spool --engine={}:{} {}".format(tractor_host, tractor_port, jobfull)
-        if subprocess.call([ command, jobfull ], shell=True) != 0:
-            raise RuntimeError("Failed to run tractor-spool, check that it's in path. The spooled files were still written out to {}".format( bpy.context.scene.tractordispacher_spool ))
-        """
-        return jobfull
+        prescript = ""
+        if scene.tractordispacher_prescript:
+            prescript = bpy.path.abspath(scene.tractordispacher_prescript)
+        postscript = ""
+        if scene.tractordispacher_postscript:
+            postscript = bpy.path.abspath(scene.tractordispacher_postscript)
+
+        base = {
+            'title': blendshort,
+            'blendfull': blendfull,
+            #'jobfull': os.path.join(bpy.context.scene.tractordispacher_spool, jobshort),
+            'jobfull': os.path.join(spooldirname, "{}_{}.alf".format(basefilename, stamp)),
+            'scratchdir': os.path.join(bladedir, "scratch", "{}_{}".format(basefilename, stamp)),
+            'prescript': prescript,
+            'prefull': os.path.join(spooldirname, "{}_{}_pre.py" .format( basefilename, stamp )),
+            'postscript': postscript,
+            'postfull': os.path.join(spooldirname, "{}_{}_post.py".format( basefilename, stamp )),
+            'blender_binary': blender_binary,
+            'blender_user_scripts': os.environ.get('BLENDER_USER_SCRIPTS'),
+            'addons': ",".join(context.preferences.addons.keys()),
+            'envkey': "TOOLS={} {}".format(os.environ.get('TOOLS'), scene.tractordispacher_envkey),
+            'service': service,
+            'priority': scene.tractordispacher_priority,
+            'tags': scene.tractordispacher_tags,
+            'crews': scene.tractordispacher_crews,
+            'dorender': scene.tractordispacher_dorender,
+            'framesperunit': scene.tractordispacher_framesperunit,
+            'keepjobscript': scene.tractordispacher_keepjobscript,
+            'outbox': scene.tractordispacher_outbox,
+            'historyscript': historyscript,
+            'progressscript': progressscript,
+            'workerscript': workerscript,
+            'workers': scene.tractordispacher_workers if workerscript else 0,
+            'bakescript': bakescript,
+            'tilescript': tilescript,
+            'frametime': scene.tractordispacher_frametime,
+            'maxtiles': scene.tractordispacher_maxtiles,
+            'chunking': scene.tractordispacher_chunking,
+            'chunktarget': scene.tractordispacher_chunktarget,
+            'startupcost': scene.tractordispacher_startupcost,
+            'frametimes': None,
+            'spoolstore': spoolstore,
+            'dedupe': scene.tractordispacher_dedupe,
+            'stagedir': bpy.path.abspath(scene.tractordispacher_stagedir) if scene.tractordispacher_stagedir else "",
+            'stagethreads': scene.tractordispacher_stagethreads,
+            'checkdeps': scene.tractordispacher_checkdeps,
+            'hashdeps': scene.tractordispacher_hashdeps,
+            'farmroots': [bpy.path.abspath(p.strip()) for p in scene.tractordispacher_farmroots.split(os.pathsep) if p.strip()],
+            'dependencies': sceneDependencies() if scene.tractordispacher_checkdeps or scene.tractordispacher_stagedir else [],
+            'digestcache': os.path.join(bladedir, "digests.json"),
+            'spoolmaxage': scene.tractordispacher_spoolmaxage * 86400.0,
+            'spoolbudget': scene.tractordispacher_spoolbudget * 1e9,
+            'batchlayout': scene.tractordispacher_batchlayout,
+        }
+
+        jobs = []
+        for render in renders:
+            job = dict(base)
+            job.update(render)
+            if len(renders) > 1 and base['batchlayout'] == 'JOBS':
+                suffix = "".join(c if c.isalnum() or c in "-_" else "_" for c in render['target'])
+                job['title'] = "{} {}".format(blendshort, render['target'])
+                job['jobfull'] = os.path.join(spooldirname, "{}_{}_{}.alf".format(basefilename, stamp, suffix))
+            jobs.append(job)
+
+        return jobs
 
     def execute(self, context):
 
-        self.spoolJob()
+        if TRACTORDISPACHER_OT_Button._worker is not None:
+            self.report({'WARNING'}, "A dispatch is already in progress")
+            return {'CANCELLED'}
+
+        scene = context.scene
+        if scene.tractordispacher_persistent and scene.render.is_movie_format:
+            self.report({'ERROR'}, "Persistent workers render image sequences, not movies")
+            return {'CANCELLED'}
+        if scene.tractordispacher_splitframes and scene.render.is_movie_format:
+            self.report({'ERROR'}, "Split frames are assembled into images, not movies")
+            return {'CANCELLED'}
+
+        setDispatchStatus(context, "Saving spool copy")
+        try:
+            jobs = self.jobSettings(context)
+        except Exception as e:
+            setDispatchStatus(context, "Failed: {}".format(e))
+            self.report({'ERROR'}, "Failed to spool the blend file: {}".format(e))
+            return {'CANCELLED'}
+
+        if not jobs:
+            setDispatchStatus(context, "")
+            self.report({'INFO'}, "All frames are rendered already")
+            return {'CANCELLED'}
+
+        worker = DispatchWorker(jobs, tractorEngine())
+        worker.start()
+        TRACTORDISPACHER_OT_Button._worker = worker
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.25, window=context.window)
+        wm.modal_handler_add(self)
+
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        try:
+            worker = TRACTORDISPACHER_OT_Button._worker
+            postMessages(context, worker)
+            if worker.is_alive():
+                return {'PASS_THROUGH'}
+        except Exception:
+            self.cancel(context)
+            raise
+
+        self.cancel(context)
+
+        failed, lines = reportResults(context, worker)
+        if failed:
+            self.report({'ERROR'}, "Tractor dispatch failed for {} of {} jobs".format(failed, len(worker.results)))
+            return {'CANCELLED'}
+
+        self.report({'INFO'}, "Tractor: " + "; ".join(lines))
+        return {'FINISHED'}
+
+    def cancel(self, context):
+        # Every way out of the modal ends up here.  A worker still
+        # running is followed by a timer from then on, and counts as
+        # the dispatch in progress until it is done.
+        if self._timer is not None:
+            context.window_manager.event_timer_remove(self._timer)
+            self._timer = None
+        worker = TRACTORDISPACHER_OT_Button._worker
+        if worker is not None and worker.is_alive():
+            if not bpy.app.timers.is_registered(followWorker):
+                bpy.app.timers.register(followWorker, first_interval=0.25)
+        else:
+            TRACTORDISPACHER_OT_Button._worker = None
+
+
+def postMessages(context, worker):
+    # Shows the latest of the worker's status messages.
+    text = None
+    while not worker.messages.empty():
+        text = worker.messages.get()
+    if text:
+        setDispatchStatus(context, text)
+
+
+def reportResults(context, worker):
+    # Shows the outcome of a finished dispatch and watches the jobs it
+    # spooled, returns (failed, lines).
+    lines = []
+    failed = 0
+    for title, rc, reply in worker.results:
+        if rc:
+            failed += 1
+            text = "Failed: {}".format(reply)
+        elif isinstance(reply, dict) and reply.get("queued"):
+            text = "Engine unavailable, queued to spool later"
+            startOutboxDrainer()
+        else:
+            jid = spoolReplyJid(reply)
+            text = "Spooled job {}".format(jid) if jid else "Spooled: {}".format(reply)
+            if jid:
+                watchJob(jid, title)
+        lines.append(text if len(worker.results) == 1 else "{}: {}".format(title, text))
+    setDispatchStatus(context, "\n".join(lines))
+    return failed, lines
+
+
+def followWorker():
+    # Timer taking over from a modal operator that went away before its
+    # worker was done, so what that spools is still shown and watched.
+    worker = TRACTORDISPACHER_OT_Button._worker
+    if worker is None:
+        return None
+    postMessages(bpy.context, worker)
+    if worker.is_alive():
+        return 0.25
+    TRACTORDISPACHER_OT_Button._worker = None
+    reportResults(bpy.context, worker)
+    return None
+
+
+class TRACTORDISPACHER_OT_Forget(bpy.types.Operator):
+    """Stop showing the spooled jobs that have finished"""
+    bl_idname = "tractordispacher.forget"
+    bl_label = "Clear Finished"
 
-        return{'FINISHED'}
+    def execute(self, context):
+        poller = trJobPoller(tractorEngine(), start=False)
+        if poller:
+            for job in poller.Snapshot()[1]:
+                if job.finished:
+                    poller.Forget(job.jid)
+        return {'FINISHED'}
 
 
 def register():
     bpy.utils.register_class(TRACTORDISPACHER_OT_Button)
+    bpy.utils.register_class(TRACTORDISPACHER_OT_Forget)
     bpy.utils.register_class(TractorDispatcherPanel)
+    # jobs left queued by an earlier session
+    if os.path.exists(outboxPath()):
+        bpy.app.timers.register(startOutboxDrainer, first_interval=1.0)
 
 
 def unregister():
+    if bpy.app.timers.is_registered(dashboardRefresh):
+        bpy.app.timers.unregister(dashboardRefresh)
+    if bpy.app.timers.is_registered(startOutboxDrainer):
+        bpy.app.timers.unregister(startOutboxDrainer)
+    if bpy.app.timers.is_registered(followWorker):
+        bpy.app.timers.unregister(followWorker)
+    trStopOutboxDrainer()
+    trStopJobPollers()
+    trLogoutSessions()
     bpy.utils.unregister_class(TRACTORDISPACHER_OT_Button)
+    bpy.utils.unregister_class(TRACTORDISPACHER_OT_Forget)
     bpy.utils.unregister_class(TractorDispatcherPanel)
 
 
@@ -356,14 +1317,13 @@ if __name__ == "__main__":
 ********
 * NEXT *
 ********
-- Test if sleep is needed.
+- Test if fsync is enough on every file server we spool to.
 
 *********
 * TODO! *
 *********
 - Catch errors when jobs fail to dispatch.
 - Combine Blur pass with progress to get a non-repeating progressbar when rendering with Blender Internal render and motion blur.
-- Add support for easily baking simulations that don't require th
 
 *********
 * NOTES *
@@ -375,7 +1335,7 @@ if __name__ == "__main__":
 ***************
 * LIMITATIONS *
 ***************
-- Not tested on Windows and OSX. While I've tried making everything as os independent as possible, I don't have access to a farm running on Windows or OSX. OSX will likely work, but for Windows you'll have to disable the progress display as it uses *nix tools to convert the render output log to percentages.
-- Only tested with Cycles and Blender internal renderer. If trying to use it with other renders you need to uncheck Show Progress. The renderer should also be launched with the same standard command line used for launching blender internal or cycles renderer.
+- Not tested on Windows and OSX. While I've tried making everything as os independent as possible, I don't have access to a farm running on Windows or OSX. The progress display runs tractor_progress.py with python3, which has to be on the blades' path.
+- Progress is only parsed for Cycles, Eevee and Workbench. Other renderers just report progress per saved frame.
 - The progress bar for each frame works incorrectly when using motion blur in the internal render. It will go from zero to full for each pass, rather than for the whole frame.
 '''
@@ -0,0 +1,253 @@
+'''
+Split-frame rendering for Tractor blades.
+
+    blender -b file.blend --python tractor_tiles.py -- --frame F --grid CxR --tiledir DIR --tile I
+    blender -b --python tractor_tiles.py -- --assemble --frame F --grid CxR --tiledir DIR --size WxH --output OUT
+
+Run as a Blender --python script the first form renders tile I of
+frame F, split into a grid of C columns and R rows, with the render
+border cropped to the tile, and saves it below DIR in the scene's own
+output format; tasks rendering the other tiles of the frame run side
+by side on other blades.  The second form pastes the tiles into the
+full frame of W x H pixels and writes it to OUT (with a .blend loaded
+these default to the scene's size and to where it renders frame F),
+then removes the tiles.
+
+Tiles are pasted pixel for pixel, so nothing is lost or converted.
+Where the blade's Python has OpenImageIO it does the pasting, keeping
+every channel of OpenEXR tiles, multilayer ones included, with its
+pixel type and the file's attributes; without it Blender's image API
+does, which reads single layer images only.
+
+Compositing effects that spread pixels (blur, glare, lens distortion)
+and denoising only see their own tile, and may show seams.
+'''
+
+import os
+import sys
+import glob
+import time
+import argparse
+
+## ------------------------------------------------------------- ##
+
+def resolution(render):
+    # The size of the rendered frame in pixels, as Blender works it out.
+    return (render.resolution_x * render.resolution_percentage // 100,
+            render.resolution_y * render.resolution_percentage // 100)
+
+
+def tileRect(width, height, cols, rows, index):
+    '''
+    The pixels (x0, x1, y0, y1) of tile 'index' of a 'cols' x 'rows'
+    grid over a 'width' x 'height' frame, y counting up from the
+    bottom row as in Blender.  Tiles are numbered left to right,
+    bottom to top.
+    '''
+    col, row = index % cols, index // cols
+    return (width * col // cols, width * (col + 1) // cols,
+            height * row // rows, height * (row + 1) // rows)
+
+
+def tilePath(tiledir, index, ext):
+    return os.path.join(tiledir, "tile_{:03d}{}".format(index, ext))
+
+
+def recordTime(scene, frame, seconds):
+    # Adds the render time of the whole frame, estimated from a tile's,
+    # to the history log framehistory.py keeps for the scene.
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        from tractor_framehistory import historyLog, appendRecord
+    except ImportError:
+        return
+    path = historyLog(scene)
+    if path:
+        try:
+            appendRecord(path, "frame", frame, "{:.3f}".format(seconds))
+        except OSError as e:
+            print("tractor frame history: {}".format(e))
+
+
+def renderTile(frame, cols, rows, index, tiledir):
+    '''
+    Render tile 'index' of 'frame' and save it below 'tiledir'.
+    '''
+    import bpy
+
+    scene = bpy.context.scene
+    render = scene.render
+    if render.is_movie_format:
+        raise RuntimeError("split-frame rendering needs an image output, not a movie")
+
+    width, height = resolution(render)
+    x0, x1, y0, y1 = tileRect(width, height, cols, rows, index)
+    # Blender truncates border * size to whole pixels, the half pixel
+    # keeps that from landing one short
+    render.use_border = True
+    render.use_crop_to_border = True
+    render.border_min_x = (x0 + 0.5) / width
+    render.border_max_x = min(1.0, (x1 + 0.5) / width)
+    render.border_min_y = (y0 + 0.5) / height
+    render.border_max_y = min(1.0, (y1 + 0.5) / height)
+
+    start = time.monotonic()
+    scene.frame_set(frame)
+    bpy.ops.render.render()
+    seconds = time.monotonic() - start
+
+    # written under another name first, so assembly never reads half a tile
+    os.makedirs(tiledir, exist_ok=True)
+    path = tilePath(tiledir, index, render.file_extension)
+    part = tilePath(tiledir, index, ".part" + render.file_extension)
+    bpy.data.images["Render Result"].save_render(part, scene=scene)
+    os.replace(part, path)
+    print("Saved: '{}'".format(path))
+    print("Tractor tiles: frame {} tile {}/{} in {:.2f}s".format(frame, index + 1, cols * rows, seconds))
+    sys.stdout.flush()
+    recordTime(scene, frame, seconds * width * height / float((x1 - x0) * (y1 - y0)))
+
+## ------------------------------------------------------------- ##
+
+def tileFiles(tiledir, count):
+    # The file of each of 'count' tiles in 'tiledir', in order.
+    paths = []
+    for index in range(count):
+        found = [p for p in glob.glob(tilePath(tiledir, index, ".*")) if ".part." not in p]
+        if not found:
+            raise RuntimeError("tile {} missing from {}".format(index, tiledir))
+        paths.append(found[0])
+    return paths
+
+
+def checkTileSize(path, size, rect):
+    x0, x1, y0, y1 = rect
+    if tuple(size) != (x1 - x0, y1 - y0):
+        raise RuntimeError("{} is {}x{}, expected {}x{}".format(
+                path, size[0], size[1], x1 - x0, y1 - y0))
+
+
+def assembleOIIO(oiio, paths, width, height, cols, rows, output):
+    # Pastes the tiles with OpenImageIO: all channels, pixel types and
+    # attributes (multilayer EXR passes, compression) of the tiles.
+    first = oiio.ImageBuf(paths[0])
+    tilespec = first.spec()
+    spec = oiio.ImageSpec(tilespec)
+    spec.width = spec.full_width = width
+    spec.height = spec.full_height = height
+    spec.x = spec.y = spec.full_x = spec.full_y = 0
+    full = oiio.ImageBuf(spec)
+
+    for index, path in enumerate(paths):
+        buf = first if index == 0 else oiio.ImageBuf(path)
+        rect = tileRect(width, height, cols, rows, index)
+        checkTileSize(path, (buf.spec().width, buf.spec().height), rect)
+        # image rows go top down here
+        if not oiio.ImageBufAlgo.paste(full, rect[0], height - rect[3], 0, 0, buf):
+            raise RuntimeError("pasting {}: {}".format(path, oiio.geterror()))
+
+    if len(tilespec.channelformats):
+        full.set_write_format(tilespec.channelformats)
+    else:
+        full.set_write_format(tilespec.format)
+    if not full.write(output):
+        raise RuntimeError("writing {}: {}".format(output, full.geterror()))
+
+
+def assembleBlender(paths, width, height, cols, rows, output):
+    # Pastes single layer tiles with Blender's image API.
+    import bpy
+    import numpy
+
+    full = numpy.zeros((height, width, 4), dtype=numpy.float32)
+    first = None
+    for index, path in enumerate(paths):
+        img = bpy.data.images.load(path)
+        if img.type == 'MULTILAYER':
+            raise RuntimeError("multilayer EXR tiles need OpenImageIO to be assembled")
+        rect = tileRect(width, height, cols, rows, index)
+        checkTileSize(path, img.size, rect)
+        x0, x1, y0, y1 = rect
+        channels = img.channels
+        pixels = numpy.empty((y1 - y0) * (x1 - x0) * channels, dtype=numpy.float32)
+        img.pixels.foreach_get(pixels)
+        # Blender's pixels go bottom up, like the tile rectangles
+        tile = pixels.reshape(y1 - y0, x1 - x0, channels)
+        full[y0:y1, x0:x1, :3] = tile[..., :3] if channels >= 3 else tile[..., :1]
+        full[y0:y1, x0:x1, 3] = tile[..., 3] if channels == 4 else 1.0
+        if first is None:
+            first = img
+        else:
+            bpy.data.images.remove(img)
+
+    out = bpy.data.images.new("Tractor Tiles", width, height, alpha=True, float_buffer=first.is_float)
+    out.colorspace_settings.name = first.colorspace_settings.name
+    out.pixels.foreach_set(full.ravel())
+    out.file_format = first.file_format
+    out.filepath_raw = output
+    out.save()
+
+
+def assemble(frame, cols, rows, tiledir, size=None, output=None):
+    '''
+    Paste the tiles of 'frame' into the whole (width, height) 'size'
+    frame, written to 'output'.  Either left out is taken from the
+    loaded scene.
+    '''
+    paths = tileFiles(tiledir, cols * rows)
+    if size is None or output is None:
+        import bpy
+        render = bpy.context.scene.render
+        size = size or resolution(render)
+        output = output or render.frame_path(frame=frame)
+    width, height = size
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    part = os.path.join(os.path.dirname(output), ".part." + os.path.basename(output))
+    try:
+        import OpenImageIO as oiio
+    except ImportError:
+        oiio = None
+    if oiio:
+        assembleOIIO(oiio, paths, width, height, cols, rows, part)
+    else:
+        assembleBlender(paths, width, height, cols, rows, part)
+    os.replace(part, output)
+    print("Saved: '{}'".format(output))
+    print("Tractor tiles: frame {} assembled from {} tiles".format(frame, cols * rows))
+    sys.stdout.flush()
+
+    for path in paths:
+        os.remove(path)
+    try:
+        os.rmdir(tiledir)
+    except OSError:
+        pass
+
+
+def tilesArgs(argv):
+    args = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(prog="tractor_tiles.py")
+    parser.add_argument("-e", dest="addons", default="")
+    parser.add_argument("--frame", type=int, required=True)
+    parser.add_argument("--grid", required=True, metavar="COLSxROWS")
+    parser.add_argument("--tiledir", required=True)
+    parser.add_argument("--tile", type=int, default=None)
+    parser.add_argument("--assemble", action="store_true")
+    parser.add_argument("--size", default=None, metavar="WIDTHxHEIGHT")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(args)
+    args.cols, args.rows = (int(n) for n in args.grid.lower().split("x"))
+    if args.size:
+        args.size = tuple(int(n) for n in args.size.lower().split("x"))
+    if args.assemble == (args.tile is not None):
+        parser.error("give one of --tile and --assemble")
+    return args
+
+
+if __name__ == "__main__":
+    args = tilesArgs(sys.argv)
+    if args.assemble:
+        assemble(args.frame, args.cols, args.rows, args.tiledir, args.size, args.output)
+    else:
+        renderTile(args.frame, args.cols, args.rows, args.tile, args.tiledir)
@@ -0,0 +1,95 @@
+'''
+Persistent render worker for Tractor blades.
+
+    blender -b file.blend --python tractor_worker.py -- --frames 1-10,21-30,41
+
+Run as a Blender --python script this renders every frame of the
+--frames list (single frames and ranges, any order, no need to be
+contiguous) from the one Blender session, so the add-ons and the .blend
+are loaded once per task rather than once per chunk.  Each frame is
+written where --render-anim would have put it and reported with
+Blender's usual "Saved:" line, which tractor_progress.py counts.
+
+The command line must not also have --render-anim, or the animation is
+rendered again once this script is done.
+'''
+
+import os
+import sys
+import time
+
+## ------------------------------------------------------------- ##
+
+def parseFrames(spec):
+    '''
+    The frames of a "1-10,12,20-30x2" style frame list, in order.
+    '''
+    frames = []
+    for part in spec.split(","):
+        if not part:
+            continue
+        step = 1
+        if "x" in part:
+            part, step = part.split("x")
+            step = int(step)
+        if "-" in part[1:]:
+            i = part.index("-", 1)
+            start, end = int(part[:i]), int(part[i + 1:])
+        else:
+            start = end = int(part)
+        frames.extend(range(start, end + 1, step))
+    return frames
+
+
+def workerArgs(argv):
+    # The frame list given after the "--" ending Blender's arguments.
+    if "--" in argv:
+        args = argv[argv.index("--") + 1:]
+        for i, a in enumerate(args[:-1]):
+            if a == "--frames":
+                return parseFrames(args[i + 1])
+    return None
+
+
+def renderFrames(frames):
+    '''
+    Render and save 'frames' of the current scene, as --render-anim
+    would, honouring the scene's overwrite and placeholder settings.
+    '''
+    import bpy
+
+    scene = bpy.context.scene
+    render = scene.render
+    if render.is_movie_format:
+        raise RuntimeError("persistent rendering needs an image sequence output, not a movie")
+
+    filepath = render.filepath
+    try:
+        for n, frame in enumerate(frames):
+            path = render.frame_path(frame=frame)
+            if not render.use_overwrite and os.path.exists(path):
+                print("Skipping existing frame {}: {}".format(frame, path))
+                print("Saved: '{}'".format(path))
+                continue
+            if render.use_placeholder and not os.path.exists(path):
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                open(path, "ab").close()
+
+            start = time.monotonic()
+            scene.frame_set(frame)
+            render.filepath = path
+            bpy.ops.render.render(write_still=True)
+            render.filepath = filepath
+            print("Tractor worker: frame {} ({}/{}) in {:.2f}s".format(
+                    frame, n + 1, len(frames), time.monotonic() - start))
+            sys.stdout.flush()
+    finally:
+        render.filepath = filepath
+
+
+if __name__ == "__main__":
+    frames = workerArgs(sys.argv)
+    if frames is None:
+        print("tractor worker: no --frames given")
+        sys.exit(1)
+    renderFrames(frames)
@@ -0,0 +1,292 @@
+'''
+An asyncio counterpart to submitter.TrHttpRPC, for spooling many jobs
+(or running many queries) concurrently instead of one network round
+trip after another.
+
+TrAsyncHttpRPC.Transaction takes the same arguments and returns the
+same (errcode, outdata) pairs as TrHttpRPC.Transaction.  A client keeps
+its own small pool of keep-alive connections, and bounds the number of
+requests in flight with a semaphore.  runSync() runs a coroutine to
+completion from ordinary synchronous code, which is how Spool and
+jobControl use it.
+'''
+
+import errno
+import asyncio
+import random
+import threading
+
+from . submitter import (TrHttpRPC, TrHttpReply, ENCODING_REFUSED, isResendable, jobSpoolRequest, spoolOrQueue, sessionVerb,
+                         trCircuitBreaker, trNoteEncoding)
+
+## ------------------------------------------------------------- ##
+
+class TrAsyncHttpRPC(TrHttpRPC):
+
+    def __init__(self, host, port=80, logger=None, apphdrs={},
+                    timeout=30.0, concurrency=8, retries=2, backoff=0.5,
+                    login=False, compress=None):
+        TrHttpRPC.__init__(self, host, port, logger, apphdrs,
+                            keepalive=True, timeout=timeout, login=login,
+                            compress=compress)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.idle = []  # (reader, writer) pairs ready for another request
+        self.gate = None
+
+
+    async def Transaction (self, tractorverb, formdata, parseCtxName=None,
+                            xheaders={}, analyzer=None, rawbody=False):
+        '''
+        Asynchronous TrHttpRPC.Transaction, see there.  Failures before
+        any of the request was written are retried up to 'retries'
+        times with a growing delay; failures once it was, and 502-504
+        replies, are only retried for requests that don't change engine
+        state and spools carrying a spool token.  The engine's circuit
+        breaker is shared with TrHttpRPC, and while it is open calls
+        fail at once; a pooled connection the engine had dropped
+        doesn't count against it.
+        '''
+        if not self.session:
+            return await self.sendTransaction(tractorverb, formdata,
+                            parseCtxName, xheaders, analyzer, rawbody)
+
+        # logging in is a one-off, done the synchronous way
+        loop = asyncio.get_running_loop()
+        stale = None
+        for attempt in range(2):
+            errcode, tsid = await loop.run_in_executor(None,
+                                    self.session.Tsid, self, stale)
+            if errcode:
+                return (errcode, tsid)
+
+            errcode, outdata = await self.sendTransaction(
+                                    sessionVerb(tractorverb, tsid), formdata,
+                                    parseCtxName, xheaders, analyzer, rawbody)
+            if errcode not in (401, 403):
+                break
+            stale = tsid
+
+        return (errcode, outdata)
+
+
+    async def sendTransaction (self, tractorverb, formdata, parseCtxName=None,
+                                xheaders={}, analyzer=None, rawbody=False):
+        if self.gate is None:
+            self.gate = asyncio.Semaphore(self.concurrency)
+
+        encoding = self.requestEncoding(formdata)
+        req = self.formatRequest(tractorverb, formdata, xheaders, encoding)
+        resendable = isResendable(tractorverb, formdata, xheaders)
+        breaker = trCircuitBreaker(self.host, self.port)
+
+        attempt = 0
+        while True:
+            if not breaker.Allow():
+                return (errno.ECONNREFUSED,
+                        "engine {}:{} is not answering, not trying again for {:.0f}s".format(
+                        self.host, self.port, breaker.RetryIn()))
+
+            reused = False
+            written = [False]
+            try:
+                async with self.gate:
+                    conn, reused = await asyncio.wait_for(self.acquire(), self.timeout)
+                    reply = await asyncio.wait_for(self.exchange(conn, req, written),
+                                                    self.timeout)
+                result = self.replyResult(reply, parseCtxName, analyzer, rawbody)
+                if encoding and result[0] in ENCODING_REFUSED and self.compress == "auto":
+                    # not taken, so not done; send it again as it is
+                    breaker.Success()
+                    trNoteEncoding(self.host, self.port, "")
+                    encoding = None
+                    req = self.formatRequest(tractorverb, formdata, xheaders)
+                    continue
+                if encoding and result[0] == 0:
+                    trNoteEncoding(self.host, self.port, encoding)
+                if result[0] not in (502, 503, 504):
+                    breaker.Success()
+                    return result
+                breaker.Failure()
+                retry = resendable
+
+            except (OSError, EOFError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError) as e:
+                if reused:
+                    # most likely closed while idle, says nothing
+                    # about the engine
+                    breaker.Release()
+                else:
+                    breaker.Failure()
+                retry = not written[0] or resendable
+                if isinstance(e, asyncio.TimeoutError):
+                    result = (errno.ETIMEDOUT, "http transaction: time-out waiting for http reply")
+                else:
+                    result = self.errorResult(e)
+
+            except Exception as e:
+                breaker.Release()
+                return self.errorResult(e)
+
+            if not retry or attempt >= self.retries:
+                return result
+
+            attempt += 1
+            delay = min(self.maxbackoff, self.backoff * (2 ** (attempt - 1)))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+
+    async def acquire (self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return ((reader, writer), True)
+            writer.close()
+        conn = await asyncio.open_connection(self.host, self.port)
+        return (conn, False)
+
+
+    async def exchange (self, conn, req, written):
+        # 'written[0]' is set once any of the request may have gone out.
+        reader, writer = conn
+        try:
+            written[0] = True
+            writer.write(req)
+            await writer.drain()
+            reply = await self.readReply(reader)
+        except BaseException:
+            writer.close()
+            raise
+
+        if reply.reusable:
+            self.idle.append(conn)
+        else:
+            writer.close()
+        return reply
+
+
+    async def readReply (self, reader):
+        '''
+        The asyncio version of submitter.TrHttpReader.Read.
+        '''
+        header = await reader.readuntil(b"\r\n\r\n")
+        header = header[:-4].decode("iso-8859-1")
+
+        lines = header.split("\r\n")
+        status = lines[0].split(None, 2)
+        fields = {}
+        for line in lines[1:]:
+            k,c,v = line.partition(":")
+            fields[k.strip().lower()] = v.strip()
+
+        reusable = status[0] != "HTTP/1.0" and \
+                    fields.get("connection", "").lower() != "close"
+
+        if "chunked" in fields.get("transfer-encoding", "").lower():
+            body = bytearray()
+            while True:
+                line = await reader.readuntil(b"\r\n")
+                size = int(line.split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                        pass
+                    break
+                body += await reader.readexactly(size + 2)
+                del body[-2:]
+        elif "content-length" in fields:
+            body = bytearray(await reader.readexactly(int(fields["content-length"])))
+        else:
+            body = bytearray(await reader.read())
+            reusable = False
+
+        return TrHttpReply(int(status[1]), header, fields, body, reusable)
+
+
+    async def Close (self):
+        idle = self.idle
+        self.idle = []
+        for reader, writer in idle:
+            writer.close()
+        for reader, writer in idle:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+## ------------------------------------------------------------- ##
+
+async def jobSpoolAll (jobfiles, options, alfdatas=None):
+    '''
+    Spool all the given alfred scripts concurrently to the engine in
+    options.mtdhost.  If the scripts' text is at hand already it is
+    passed in 'alfdatas', in the same order as 'jobfiles'.  Returns
+    one (errcode, outdata) per job file, in the order given.
+    '''
+    rpc = TrAsyncHttpRPC(options.mtdhost, 0,
+                            concurrency=getattr(options, "concurrency", 8),
+                            retries=getattr(options, "retries", 2),
+                            compress=getattr(options, "compress", None))
+
+    if alfdatas is None:
+        alfdatas = [None] * len(jobfiles)
+
+    async def spool (jobfile, alfdata):
+        try:
+            alfdata, hdrs = jobSpoolRequest(jobfile, options, alfdata)
+        except Exception as e:
+            return (-1, "job spool: {} - {}".format(e.__class__.__name__, e))
+        errcode, reply = await rpc.Transaction("spool", alfdata, None, hdrs)
+        return spoolOrQueue(errcode, reply, jobfile, options, alfdata, hdrs)
+
+    try:
+        return await asyncio.gather(*[spool(f, a) for f, a in zip(jobfiles, alfdatas)])
+    finally:
+        await rpc.Close()
+
+
+async def jobControlAll (jids, forms, options):
+    '''
+    Send the job control 'forms' (see submitter.jobControlForm), one
+    per job in 'jids', at most options.concurrency at a time.  Returns
+    one (jid, errcode, outdata) per job, in the order given.
+    '''
+    rpc = TrAsyncHttpRPC(options.mtdhost, 0, login=options.uname,
+                            concurrency=getattr(options, "concurrency", 8),
+                            retries=getattr(options, "retries", 2))
+
+    async def control (jid, form):
+        errcode, outdata = await rpc.Transaction("queries", form, "jobcontrol")
+        return (jid, errcode, outdata)
+
+    try:
+        return await asyncio.gather(*[control(j, f) for j, f in zip(jids, forms)])
+    finally:
+        await rpc.Close()
+
+
+def runSync (coro):
+    '''
+    Run a coroutine to completion and return its result.  If the
+    calling thread already runs an event loop, the coroutine is run
+    on a fresh loop in a helper thread instead.
+    '''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = []
+    def run():
+        try:
+            result.append( (True, asyncio.run(coro)) )
+        except BaseException as e:
+            result.append( (False, e) )
+
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+    ok, value = result[0]
+    if not ok:
+        raise value
+    return value
@@ -0,0 +1,156 @@
+'''
+JSON decoding for engine replies.
+
+loads() uses orjson or ujson when one of them is importable and falls
+back to the standard library json module otherwise; 'backend' names
+the decoder in use.  iterArray() decodes the elements of one large
+array (such as the "jobs" or "tasks" of a query reply) one at a time,
+so the whole document is never held as python objects at once.
+'''
+
+import json
+import codecs
+
+try:
+    import orjson as _fastjson
+    backend = "orjson"
+except ImportError:
+    try:
+        import ujson as _fastjson
+        backend = "ujson"
+    except ImportError:
+        _fastjson = None
+        backend = "json"
+
+## ------------------------------------------------------------- ##
+
+def loads (data):
+    '''
+    Decode a JSON document from str, bytes, bytearray or memoryview.
+    '''
+    if _fastjson is not None:
+        if isinstance(data, memoryview) and backend != "orjson":
+            data = data.tobytes()
+        return _fastjson.loads(data)
+
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+## ------------------------------------------------------------- ##
+
+_NUMBER_CHARS = "0123456789.eE+-"
+
+class _ArrayScanner(object):
+    '''
+    Holds the not yet decoded text of a document that arrives as a
+    sequence of byte (or str) chunks.
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+
+    def more (self):
+        # append the next chunk, returns False at the end of input
+        if self.eof:
+            return False
+        for c in self.chunks:
+            if isinstance(c, str):
+                t = c
+            else:
+                t = self.utf8.decode(c)
+            if t:
+                self.buf = self.buf[self.pos:] + t
+                self.pos = 0
+                return True
+        self.eof = True
+        self.buf = self.buf[self.pos:] + self.utf8.decode(b"", True)
+        self.pos = 0
+        return False
+
+
+    def skipSpace (self):
+        while True:
+            n = len(self.buf)
+            while self.pos < n and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < n or not self.more():
+                return
+
+
+    def expect (self, chars):
+        self.skipSpace()
+        if self.pos >= len(self.buf) or self.buf[self.pos] not in chars:
+            raise ValueError("expected one of {!r} at offset {}".format(chars, self.pos))
+        c = self.buf[self.pos]
+        self.pos += 1
+        return c
+
+
+    def value (self):
+        # A value is only accepted when something follows it in the
+        # buffer, and for a number only when that something can't be
+        # more of it, otherwise it might be cut off mid-chunk.
+        self.skipSpace()
+        while True:
+            try:
+                v, end = self.decoder.raw_decode(self.buf, self.pos)
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return v
+            except ValueError:
+                if self.eof:
+                    raise
+            self.more()
+
+
+def _chunked (data, size=1<<20):
+    view = memoryview(data)
+    for i in range(0, len(view), size):
+        yield view[i:i+size]
+
+
+def iterArray (source, key=None):
+    '''
+    Generate the elements of a JSON array one by one.  With 'key' the
+    array is the named member of a top-level object, otherwise the
+    document itself must be an array.  'source' is a str or bytes-like
+    reply body, or an iterable of byte/str chunks.
+    '''
+    if isinstance(source, str):
+        source = [source]
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        source = _chunked(source)
+
+    sc = _ArrayScanner(source)
+
+    if key is not None:
+        sc.expect("{")
+        while True:
+            sc.skipSpace()
+            if sc.expect('"}') == "}":
+                return  # no such member
+            sc.pos -= 1
+            name = sc.value()
+            sc.expect(":")
+            sc.skipSpace()
+            if name == key:
+                break
+            sc.value()  # some other member, decode and drop it
+            if sc.expect(",}") == "}":
+                return
+
+    sc.expect("[")
+    sc.skipSpace()
+    if sc.pos < len(sc.buf) and sc.buf[sc.pos] == "]":
+        return
+    while True:
+        yield sc.value()
+        if sc.expect(",]") == "]":
+            return
@@ -0,0 +1,293 @@
+'''
+Watching spooled jobs on the engine.
+
+One TrJobPoller per engine, shared by everything dispatched to it,
+watches the jobs that haven't finished yet with a single tasks query
+per round, for their running tasks and those whose state changed since
+the last round (by the engine's 'statetime', so the two clocks needn't
+agree).  Only the jobs such a task belongs to are then asked for again
+in a jobs query, along with newly watched ones; every 'fullevery'
+rounds all of them are, which catches what changes no task, a pause
+say.  A round in which nothing changed doubles the wait before the
+next one, up to 'maxinterval'; any change, or a new job to watch,
+brings it back down to 'mininterval'.  With nothing left to watch the
+poller just sleeps.
+
+Readers take Snapshot(), and compare its generation with the one they
+last drew to know whether anything is new.
+'''
+
+import threading
+from urllib.parse import urlencode
+
+from . submitter import TrHttpRPC
+
+JOB_COLUMNS = ("jid", "title", "numtasks", "numactive", "numdone",
+                "numerror", "stoptime", "pausetime")
+TASK_COLUMNS = ("jid", "tid", "title", "state", "progress", "statetime")
+
+## ------------------------------------------------------------- ##
+
+class TrJobState(object):
+    '''
+    What is known of one watched job.  'tasks' holds (title, percent)
+    for each of its running tasks.
+    '''
+    __slots__ = ("jid", "title", "numtasks", "numactive", "numdone",
+                 "numerror", "finished", "paused", "tasks", "error")
+
+    def __init__(self, jid, title=""):
+        self.jid = jid
+        self.title = title
+        self.numtasks = 0
+        self.numactive = 0
+        self.numdone = 0
+        self.numerror = 0
+        self.finished = False
+        self.paused = False
+        self.tasks = ()
+        self.error = None
+
+    def update(self, row):
+        # Fold a jobs query row in, returns whether anything changed.
+        old = self.key()
+        self.title = row.get("title") or self.title
+        self.numtasks = int(row.get("numtasks") or 0)
+        self.numactive = int(row.get("numactive") or 0)
+        self.numdone = int(row.get("numdone") or 0)
+        self.numerror = int(row.get("numerror") or 0)
+        self.finished = bool(row.get("stoptime")) or (
+            self.numtasks > 0 and self.numdone == self.numtasks)
+        self.paused = bool(row.get("pausetime"))
+        self.error = None
+        return self.key() != old
+
+    def copy(self):
+        other = TrJobState(self.jid)
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
+
+    def key(self):
+        return (self.title, self.numtasks, self.numactive, self.numdone,
+                self.numerror, self.finished, self.paused, self.tasks, self.error)
+
+    def progress(self):
+        # Fraction of the job's tasks done.
+        return self.numdone / float(self.numtasks) if self.numtasks else 0.0
+
+
+class TrJobPoller(threading.Thread):
+
+    def __init__(self, host, port, mininterval=2.0, maxinterval=60.0, fullevery=10):
+        threading.Thread.__init__(self, name="tractor job poller", daemon=True)
+        self.rpc = TrHttpRPC(host, port, keepalive=True, timeout=15.0, login=True)
+        self.mininterval = mininterval
+        self.maxinterval = maxinterval
+        self.interval = mininterval
+        self.fullevery = fullevery
+        self.rounds = 0
+        self.since = None   # latest task statetime seen, engine time
+        self.atsince = set()  # (jid, tid) of the tasks changed then
+        self.known = set()  # jobs asked for in a jobs query already
+        self.jobs = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+
+
+    def Watch (self, jid, title=""):
+        with self.lock:
+            if jid not in self.jobs:
+                self.jobs[jid] = TrJobState(jid, title)
+                self.generation += 1
+        self.interval = self.mininterval
+        self.wakeup.set()
+
+
+    def Forget (self, jid):
+        with self.lock:
+            if self.jobs.pop(jid, None):
+                self.generation += 1
+            self.known.discard(jid)
+
+
+    def Snapshot (self):
+        '''
+        Returns (generation, jobs) with a copy of the watched jobs in
+        the order they were spooled.
+        '''
+        with self.lock:
+            return self.generation, [self.jobs[jid].copy() for jid in sorted(self.jobs)]
+
+
+    def Stop (self):
+        self.stopping = True
+        self.wakeup.set()
+
+
+    def run (self):
+        while not self.stopping:
+            with self.lock:
+                pending = [j.jid for j in self.jobs.values() if not j.finished]
+            if not pending:
+                self.wakeup.wait()
+            else:
+                changed = self.poll(pending)
+                if changed:
+                    self.interval = self.mininterval
+                else:
+                    self.interval = min(self.interval * 2, self.maxinterval)
+                self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+
+    def poll (self, jids):
+        # One round of queries for the unfinished jobs 'jids', returns
+        # whether any of them changed.
+        taskfilter = "jid in [{}]".format(" ".join(str(j) for j in jids))
+        if self.since is not None:
+            taskfilter += " and (state=active or statetime >= {})".format(timeValue(self.since))
+        taskrows, ok = self.query("tasks", taskfilter, TASK_COLUMNS)
+
+        # ask again for the jobs with a changed task and new ones, and
+        # now and then for all of them
+        full = self.since is None or not ok or self.rounds % self.fullevery == 0
+        self.rounds += 1
+        since, atsince = self.since, set(self.atsince)
+        stale = set(j for j in jids if j not in self.known)
+        tasks = dict((jid, []) for jid in jids)
+        for row in taskrows:
+            jid = int(row.get("jid", 0))
+            if jid not in tasks:
+                continue
+            if row.get("state") == "active":
+                tasks[jid].append((row.get("title", ""), int(float(row.get("progress") or 0))))
+            statetime = row.get("statetime")
+            if statetime in (None, ""):
+                continue
+            # the filter takes the tasks changed at 'since' again, so
+            # that none changed later in the same second are missed
+            task = (jid, row.get("tid"))
+            if self.since is not None and timeKey(statetime) < timeKey(self.since):
+                continue
+            if self.since is None or statetime != self.since or task not in self.atsince:
+                stale.add(jid)
+            if since is None or timeKey(statetime) > timeKey(since):
+                since, atsince = statetime, set()
+            if statetime == since:
+                atsince.add(task)
+        if ok:
+            self.since, self.atsince = since, atsince
+
+        changed = False
+        ask = jids if full else [j for j in jids if j in stale]
+        if ask:
+            rows, ok = self.query("jobs", "jid in [{}]".format(" ".join(str(j) for j in ask)),
+                                    JOB_COLUMNS)
+            if ok:
+                self.known.update(ask)
+            with self.lock:
+                for row in rows:
+                    job = self.jobs.get(int(row.get("jid", 0)))
+                    if job and job.update(row):
+                        changed = True
+
+        with self.lock:
+            for jid, running in tasks.items():
+                job = self.jobs.get(jid)
+                if job and job.tasks != tuple(running):
+                    job.tasks = tuple(running)
+                    changed = True
+            if changed:
+                self.generation += 1
+        return changed
+
+
+    def query (self, what, filt, columns):
+        # (rows, ok) of a Tractor query, no rows if it failed; a failure
+        # is shown against every watched job.
+        formdata = urlencode({"q": what, "filter": filt, "columns": ",".join(columns)})
+        errcode, outdata = self.rpc.TransactionItems("queries", formdata, "data")
+        rows = []
+        if errcode == 0:
+            try:
+                rows = list(outdata)
+            except ValueError as e:
+                errcode, outdata = -1, "parse {}: {}".format(what, e)
+
+        if errcode:
+            with self.lock:
+                for job in self.jobs.values():
+                    if job.error != outdata:
+                        job.error = outdata
+                        self.generation += 1
+        return (rows, errcode == 0)
+
+
+def timeKey(value):
+    # Engine times compare as numbers where they are, else as text.
+    try:
+        return (0, float(value), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(value))
+
+
+def timeValue(value):
+    # An engine time as it goes in a query filter.
+    try:
+        float(value)
+        return str(value)
+    except (TypeError, ValueError):
+        return '"{}"'.format(value)
+
+
+def unfinishedJobs (host, port, jids):
+    '''
+    The set of those of 'jids' the engine at host:port (or "host:port"
+    in 'host') has and that haven't finished; None if it couldn't be
+    asked.
+    '''
+    rpc = TrHttpRPC(host, port, timeout=15.0, login=True)
+    formdata = urlencode({"q": "jobs", "filter": "jid in [{}]".format(" ".join(str(j) for j in jids)),
+                          "columns": ",".join(JOB_COLUMNS)})
+    errcode, outdata = rpc.TransactionItems("queries", formdata, "data")
+    if errcode:
+        return None
+    unfinished = set()
+    try:
+        for row in outdata:
+            job = TrJobState(int(row.get("jid", 0)))
+            job.update(row)
+            if not job.finished:
+                unfinished.add(job.jid)
+    except ValueError:
+        return None
+    return unfinished
+
+## ------------------------------------------------------------- ##
+
+_trJobPollers = {}
+_trJobPollersLock = threading.Lock()
+
+def trJobPoller (host, port=0, start=True):
+    '''
+    The shared, running, poller for the engine at host:port (or
+    "host:port" in 'host').  Unless 'start' is set None is returned
+    where there isn't one yet.
+    '''
+    with _trJobPollersLock:
+        poller = _trJobPollers.get((host, port))
+        if poller is None and start:
+            poller = TrJobPoller(host, port)
+            poller.start()
+            _trJobPollers[(host, port)] = poller
+        return poller
+
+
+def trStopJobPollers ():
+    with _trJobPollersLock:
+        for poller in _trJobPollers.values():
+            poller.Stop()
+        _trJobPollers.clear()